@@ -0,0 +1,681 @@
+# Program name: benchmark.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# Benchmarks for the pipeline, every benchmark is a subcommand:
+# python3 benchmark.py semantics -t human.jsonl group1.jsonl prompts.jsonl
+# python3 benchmark.py batching human.jsonl
+# python3 benchmark.py loading human.jsonl
+# python3 benchmark.py compression human.jsonl --parse
+# python3 benchmark.py sentiment human.jsonl group1.jsonl prompts.jsonl
+# python3 benchmark.py importtime --cli-budget 300 --predict-budget 1500
+# python3 benchmark.py memory -t human.jsonl group1.jsonl prompts.jsonl --scales 0.5 1 2 --budget parse=1500 --max-rss 4000 -o memory.json
+
+# import the supporting packages
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+MEGABYTE: int = 1024 * 1024
+
+# the import paths checked by the importtime benchmark: the command line (main.py --help)
+# and scoring parsed documents, and the packages that may not be imported by them
+IMPORT_PATHS: Dict[str, str] = {'cli': 'main', 'predict': 'detector'}
+HEAVY_MODULES: Tuple[str, ...] = ('torch', 'transformers', 'fastcoref', 'sklearn', 'nltk', 'textblob', 'spacytextblob')
+
+# the stages the memory benchmark measures, in order, a budget can be given for every one of them
+MEMORY_STAGES: Tuple[str, ...] = ('load', 'parse', 'do_morpology_analysis', 'do_syntactic_analysis', 'do_semantic_analysis',
+                                  'do_sentiment_analysis', 'get_morphology_results', 'get_syntactic_results',
+                                  'get_semantic_results', 'get_sentiment_results')
+
+
+def timed(function: Callable, *args, **kwargs) -> Tuple[object, float]:
+    '''
+    Run a function and measure how long it takes
+    param function: Callable, the function to run
+    return: Tuple[object, float], the result of the function and the time it took in seconds
+    '''
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def accuracy(true_labels: List[str], pred_labels: List[str]) -> float:
+    '''
+    Calculate the share of predictions that are equal to the true label
+    param true_labels: List[str], the true labels
+    param pred_labels: List[str], the predicted labels
+    '''
+    if not true_labels:
+        return 0.0
+    return sum(true == pred for true, pred in zip(true_labels, pred_labels)) / len(true_labels)
+
+
+def benchmark_semantics(human_path: str, machine_path: str, prompt_path: str) -> Dict[str, float]:
+    '''
+    Compare the coref-free fast semantic analysis with the fastcoref based one.
+    Reports the parse time with and without fastcoref, how far the estimated
+    references per cluster are from the fastcoref values and the accuracy delta on the prompts.
+    param human_path: str, the path to the human training data
+    param machine_path: str, the path to the machine training data
+    param prompt_path: str, the path to the prompt data
+    '''
+    from preprocessor import load_spacy_model, load_jsonl, process_data, process_prompt_data, Path
+    from semantics import perform_analysis_single, do_semantic_analysis, get_semantic_results
+
+    nlp = load_spacy_model()
+    human_data = load_jsonl(Path(human_path))
+    machine_data = load_jsonl(Path(machine_path))
+
+    # parse the training data with and without the coreference component
+    with nlp.select_pipes(disable=['fastcoref']):
+        _, fast_parse_time = timed(process_data, human_data + machine_data, nlp)
+    human, human_parse_time = timed(process_data, human_data, nlp)
+    machine, machine_parse_time = timed(process_data, machine_data, nlp)
+    full_parse_time = human_parse_time + machine_parse_time
+
+    # compare the references per cluster of every document
+    errors: List[float] = []
+    for doc in human + machine: # type: ignore
+        coref, references = perform_analysis_single(doc)[:2]
+        fast_coref, fast_references = perform_analysis_single(doc, fast=True)[:2]
+        if coref and fast_coref:
+            errors.append(abs(references / coref - fast_references / fast_coref))
+
+    # fit both variants and compare their votes on the prompts
+    prompts = process_prompt_data(load_jsonl(Path(prompt_path)), nlp)
+    true_labels: List[str] = [prompt['by'] for prompt in prompts] # type: ignore
+    separators, full_fit_time = timed(do_semantic_analysis, human, machine)
+    fast_separators, fast_fit_time = timed(do_semantic_analysis, human, machine, True)
+    full_prediction = [result[0] for result in get_semantic_results(separators, prompts)] # type: ignore
+    fast_prediction = [result[0] for result in get_semantic_results(fast_separators, prompts, True)] # type: ignore
+
+    report: Dict[str, float] = {
+        'parse time with fastcoref (s)': full_parse_time,
+        'parse time without fastcoref (s)': fast_parse_time,
+        'parse speedup': full_parse_time / fast_parse_time,
+        'fit time with fastcoref values (s)': full_fit_time,
+        'fit time with estimated values (s)': fast_fit_time,
+        'mean absolute error references per cluster': sum(errors) / len(errors) if errors else 0.0,
+        'reference separator with fastcoref': separators[1],
+        'reference separator estimated': fast_separators[1],
+        'accuracy with fastcoref': accuracy(true_labels, full_prediction),
+        'accuracy estimated': accuracy(true_labels, fast_prediction),
+        'vote agreement': accuracy(full_prediction, fast_prediction),
+    }
+    report['accuracy delta'] = report['accuracy estimated'] - report['accuracy with fastcoref']
+    return report
+
+
+def benchmark_batching(corpus_path: str, coref: bool = True) -> Dict[str, float]:
+    '''
+    Compare the throughput of nlp.pipe over the texts in file order with the length-bucketed
+    scheduler of the preprocessor, and check that the docs come back in the original order.
+    param corpus_path: str, the path to the corpus to parse, for example human.jsonl
+    param coref: bool, whether to run the fastcoref component
+    '''
+    from preprocessor import load_spacy_model, load_jsonl, bucket_by_length, pipe_bucketed, Path
+
+    nlp = load_spacy_model(coref)
+    texts: List[str] = [entry['text'] for entry in load_jsonl(Path(corpus_path)) if entry.get('text', '').strip()]
+    characters: int = sum(len(text) for text in texts)
+
+    # warm up the pipeline, so neither run is timed with the model loading
+    nlp(texts[0])
+
+    file_order_docs, file_order_time = timed(lambda: list(nlp.pipe(texts)))
+    bucketed_docs, bucketed_time = timed(pipe_bucketed, [(text, None) for text in texts], nlp)
+    if [doc.text for doc, _ in bucketed_docs] != [doc.text for doc in file_order_docs]: # type: ignore
+        raise ValueError('The bucketed docs are not in the original order')
+
+    return {
+        'texts': len(texts),
+        'length buckets': len(bucket_by_length([len(text) for text in texts])),
+        'file order time (s)': file_order_time,
+        'bucketed time (s)': bucketed_time,
+        'file order throughput (chars/s)': characters / file_order_time,
+        'bucketed throughput (chars/s)': characters / bucketed_time,
+        'throughput gain': file_order_time / bucketed_time,
+    }
+
+
+def load_jsonl_reference(file_path: str) -> List[Dict[str, str]]:
+    '''
+    The original loader of the preprocessor, line by line with json.loads, as the baseline for benchmark_loading
+    param file_path: str, the path to the jsonl file
+    '''
+    with open(file_path, 'r') as file:
+        data: List[Dict[str, str]] = [json.loads(line) for line in file]
+    return data
+
+
+def benchmark_loading(corpus_path: str, repeat: int = 5, workers: int = 4) -> Dict[str, float]:
+    '''
+    Compare the mmap based loader of corpus.py with the original line by line json.loads loader
+    param corpus_path: str, the path to the corpus to load, for example human.jsonl
+    param repeat: int, the amount of times every loader runs, the fastest run counts
+    param workers: int, the amount of processes for the parallel run
+    '''
+    import corpus
+
+    def fastest(function: Callable, *args, **kwargs) -> float:
+        return min(timed(function, *args, **kwargs)[1] for _ in range(repeat))
+
+    reference = load_jsonl_reference(corpus_path)
+    loaded = corpus.load_jsonl(corpus_path, workers=workers)
+    if [(entry.get('text'), entry.get('by')) for entry in reference] != [(entry.get('text'), entry.get('by')) for entry in loaded]:
+        raise ValueError('The loaders do not return the same records')
+
+    reference_time = fastest(load_jsonl_reference, corpus_path)
+    single_time = fastest(corpus.load_jsonl, corpus_path, workers=1)
+    parallel_time = fastest(corpus.load_jsonl, corpus_path, workers=workers)
+    return {
+        'records': len(reference),
+        'megabytes': os.path.getsize(corpus_path) / 1024 / 1024,
+        'orjson decoder': float(corpus.json_loads is not json.loads),
+        'json.loads line by line (s)': reference_time,
+        'mmap single process (s)': single_time,
+        f'mmap {workers} processes (s)': parallel_time,
+        'single process speedup': reference_time / single_time,
+        'parallel speedup': reference_time / parallel_time,
+    }
+
+
+def write_compressed(corpus_path: str, directory: str) -> Dict[str, str]:
+    '''
+    Write a gzip, xz and, when the zstandard package is installed, a zstd copy of a corpus
+    param corpus_path: str, the path to the uncompressed corpus
+    param directory: str, the directory to write the copies to
+    return: Dict[str, str], the path of the corpus in every format
+    '''
+    import gzip
+    import lzma
+
+    openers: Dict[str, Callable] = {'gzip': lambda path: gzip.open(path, 'wb', compresslevel=6), 'xz': lambda path: lzma.open(path, 'wb')}
+    try:
+        import zstandard # type: ignore
+        openers['zstd'] = lambda path: zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'))
+    except ImportError:
+        print('The zstandard package is not installed, zstd is skipped')
+
+    paths: Dict[str, str] = {'jsonl': corpus_path}
+    suffixes: Dict[str, str] = {'gzip': '.gz', 'xz': '.xz', 'zstd': '.zst'}
+    for name, opener in openers.items():
+        paths[name] = os.path.join(directory, os.path.basename(corpus_path) + suffixes[name])
+        with open(corpus_path, 'rb') as source, opener(paths[name]) as target:
+            shutil.copyfileobj(source, target)
+    return paths
+
+
+def benchmark_compression(corpus_path: str, repeat: int = 3, parse: bool = False, coref: bool = True) -> Dict[str, float]:
+    '''
+    Compare reading a corpus uncompressed with reading a gzip, xz and zstd copy of it: the size on disk,
+    the load time of load_jsonl and, with parse, the end-to-end time of loading and parsing the texts,
+    with the texts loaded first and with the texts parsed while the file is decompressed (process_stream)
+    param corpus_path: str, the path to the uncompressed corpus, for example human.jsonl
+    param repeat: int, the amount of times every load runs, the fastest run counts
+    param parse: bool, whether to also measure the end-to-end time with the spacy pipeline
+    param coref: bool, whether to run the fastcoref component when parsing
+    '''
+    import corpus
+
+    report: Dict[str, float] = {}
+    reference = corpus.load_jsonl(corpus_path, workers=1)
+    nlp = None
+    if parse:
+        from preprocessor import load_spacy_model, process_data, process_stream
+        nlp = load_spacy_model(coref)
+        nlp(reference[0]['text'])
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, path in write_compressed(corpus_path, directory).items():
+            if corpus.load_jsonl(path, workers=1) != reference:
+                raise ValueError(f'The {name} corpus does not load the same records')
+            # the offset index and the sample read the lines of the decompressed stream
+            if corpus.count_records(path) != len(reference) or corpus.read_records(path, -3) != reference[-3:]:
+                raise ValueError(f'The offset index of the {name} corpus does not find the same records')
+            if sorted(map(str, corpus.sample_records(path, len(reference), seed=0))) != sorted(map(str, reference)):
+                raise ValueError(f'The sample of the {name} corpus does not have the same records')
+            report[f'{name} size (MB)'] = os.path.getsize(path) / MEGABYTE
+            report[f'{name} load (s)'] = min(timed(corpus.load_jsonl, path, workers=1)[1] for _ in range(repeat))
+            if nlp is not None:
+                report[f'{name} load and parse (s)'] = timed(lambda: process_data(corpus.load_jsonl(path, workers=1), nlp))[1]
+                report[f'{name} streamed parse (s)'] = timed(process_stream, path, nlp)[1]
+    return report
+
+
+def benchmark_sentiment(corpus_paths: List[str], tolerance: float = 0.01) -> Dict[str, float]:
+    '''
+    Compare the lexicon sentiment component of sentiment.py with spacytextblob: how far the polarity
+    and subjectivity of every document are apart, and how long both take to score the documents
+    param corpus_paths: List[str], the paths to the corpora to score
+    param tolerance: float, the largest difference that counts as the same score
+    '''
+    from preprocessor import load_spacy_model, load_jsonl, process_data, Path
+    from sentiment import get_sentiment_scores, load_lexicon, PROPERTIES_KEY
+    from textblob import TextBlob # type: ignore
+    import numpy as np
+
+    nlp = load_spacy_model(coref=False, sentiment='textblob')
+    docs = process_data([entry for path in corpus_paths for entry in load_jsonl(Path(path))], nlp)
+    load_lexicon()
+
+    textblob_scores, textblob_time = timed(lambda: [TextBlob(doc.text).sentiment for doc in docs])
+    for doc in docs:
+        doc.user_data.pop(PROPERTIES_KEY, None)
+    lexicon_scores, lexicon_time = timed(lambda: [get_sentiment_scores(doc) for doc in docs])
+
+    polarity = np.abs(np.array([score.polarity for score in textblob_scores]) - np.array([score[0] for score in lexicon_scores]))
+    subjectivity = np.abs(np.array([score.subjectivity for score in textblob_scores]) - np.array([score[1] for score in lexicon_scores]))
+    return {
+        'documents': len(docs),
+        'max polarity difference': float(polarity.max()),
+        'mean polarity difference': float(polarity.mean()),
+        'max subjectivity difference': float(subjectivity.max()),
+        'mean subjectivity difference': float(subjectivity.mean()),
+        'documents within tolerance': float(((polarity <= tolerance) & (subjectivity <= tolerance)).mean()),
+        'textblob time (s)': textblob_time,
+        'lexicon time (s)': lexicon_time,
+        'speedup': textblob_time / lexicon_time,
+    }
+
+
+def parse_importtime(output: str) -> Dict[str, Tuple[int, int]]:
+    '''
+    Parse the output of python -X importtime
+    param output: str, the standard error of the python process
+    return: Dict[str, Tuple[int, int]], the self and cumulative import time in microseconds of every module
+    '''
+    modules: Dict[str, Tuple[int, int]] = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, module = line[len('import time:'):].split('|')
+        modules[module.strip()] = (int(self_time), int(cumulative))
+    return modules
+
+
+def benchmark_importtime(repeat: int = 5, top: int = 5) -> Dict[str, Dict[str, Any]]:
+    '''
+    Measure the import time of the import paths in fresh python processes: the cumulative import time of
+    the module, the slowest imports, the heavy packages it pulls in and the cold start time of the process
+    param repeat: int, the amount of runs per import path, the fastest run counts
+    param top: int, the amount of slowest imports to report
+    '''
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results: Dict[str, Dict[str, Any]] = {}
+    for path, module in IMPORT_PATHS.items():
+        command = [sys.executable, '-X', 'importtime', '-c', f'import sys, {module}; print(" ".join(sys.modules))']
+        runs = []
+        for _ in range(repeat):
+            process, seconds = timed(subprocess.run, command, cwd=directory, capture_output=True, text=True)
+            if process.returncode != 0: # type: ignore
+                raise RuntimeError(f'importing {module} failed:\n{process.stderr}') # type: ignore
+            runs.append((seconds, parse_importtime(process.stderr))) # type: ignore
+
+        # -X importtime also lists imports that failed, so the loaded modules come from sys.modules
+        modules = min(runs, key=lambda run: run[1][module][1])[1]
+        slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        results[path] = {
+            'module': module,
+            'import time (ms)': modules[module][1] / 1000,
+            'cold start (ms)': runs[0][0] * 1000,
+            'warm start (ms)': min(run[0] for run in runs) * 1000,
+            'heavy modules': sorted(set(process.stdout.split()) & set(HEAVY_MODULES)), # type: ignore
+            'slowest imports (ms)': {name: times[0] / 1000 for name, times in slowest},
+        }
+    return results
+
+
+def check_import_budgets(results: Dict[str, Dict[str, Any]], budgets: Dict[str, float]) -> List[str]:
+    '''
+    Check the import times against the budgets, and that no heavy package is imported
+    param results: Dict[str, Dict[str, Any]], the measurements of benchmark_importtime
+    param budgets: Dict[str, float], the maximum import time in milliseconds of every import path
+    return: List[str], a description of every budget that is exceeded
+    '''
+    violations: List[str] = []
+    for path, result in results.items():
+        if result['import time (ms)'] > budgets[path]:
+            violations.append(f"importing {result['module']} takes {result['import time (ms)']:.0f} ms > {budgets[path]:.0f} ms")
+        if result['heavy modules']:
+            violations.append(f"importing {result['module']} imports {', '.join(result['heavy modules'])}")
+    return violations
+
+
+def reset_peak_rss() -> bool:
+    '''
+    Reset the peak resident set size of this process, only possible on Linux
+    return: bool, whether the peak was reset
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss() -> float:
+    '''
+    Get the peak resident set size of this process in megabytes, since the last reset_peak_rss if that worked
+    '''
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # without /proc the peak of the whole process is the best we have, ru_maxrss is in kilobytes on Linux and bytes on macOS
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / MEGABYTE if sys.platform == 'darwin' else peak / 1024
+
+
+def measure_stage(stage: str, function: Callable, *args, top: int = 10) -> Tuple[Any, Dict[str, Any]]:
+    '''
+    Run one stage of the pipeline and measure its memory use
+    param stage: str, the name of the stage
+    param function: Callable, the stage
+    param top: int, the amount of allocators to report
+    return: the result of the stage and its measurements: the time, the memory the stage left allocated,
+            the peak of the traced memory, the peak RSS and the lines that allocated the most memory
+    '''
+    before = tracemalloc.take_snapshot()
+    allocated_before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    reset_peak_rss()
+
+    result, seconds = timed(function, *args)
+
+    allocated_after, traced_peak = tracemalloc.get_traced_memory()
+    peak_rss = get_peak_rss()
+    differences = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+    allocators = [{'location': f'{difference.traceback[0].filename}:{difference.traceback[0].lineno}',
+                   'size (MB)': difference.size_diff / MEGABYTE,
+                   'blocks': difference.count_diff}
+                  for difference in differences[:top]]
+    return result, {
+        'stage': stage,
+        'time (s)': seconds,
+        'allocated (MB)': (allocated_after - allocated_before) / MEGABYTE,
+        'peak traced (MB)': (traced_peak - allocated_before) / MEGABYTE,
+        'peak rss (MB)': peak_rss,
+        'top allocators': allocators,
+    }
+
+
+def scale_records(records: List[Dict[str, Any]], scale: float) -> List[Dict[str, Any]]:
+    '''
+    Scale a corpus: a scale below 1 takes the first part of the records, above 1 the records are repeated
+    param records: List[Dict[str, Any]], the records of the corpus
+    param scale: float, the scale of the corpus
+    '''
+    amount: int = max(1, round(len(records) * scale))
+    return [records[number % len(records)] for number in range(amount)]
+
+
+def measure_memory(human_path: str, machine_path: str, prompt_path: str, scale: float,
+                   fast_semantics: bool = False, top: int = 10) -> Dict[str, Any]:
+    '''
+    Measure the memory of every stage of the pipeline on a scaled corpus: loading, parsing,
+    every do_*_analysis and every get_*_results. Runs in its own process, see benchmark_memory
+    param human_path: str, the path to the human training data
+    param machine_path: str, the path to the machine training data
+    param prompt_path: str, the path to the prompt data
+    param scale: float, the scale of the corpora, see scale_records
+    param fast_semantics: bool, whether to leave fastcoref out and estimate the coreference values
+    param top: int, the amount of allocators to report per stage
+    '''
+    tracemalloc.start()
+    stages: List[Dict[str, Any]] = []
+
+    def stage(name: str, function: Callable, *args) -> Any:
+        result, measurement = measure_stage(name, function, *args, top=top)
+        stages.append(measurement)
+        return result
+
+    def load() -> Tuple[Any, ...]:
+        from preprocessor import load_spacy_model, load_jsonl, Path
+        nlp = load_spacy_model(not fast_semantics)
+        return nlp, *(scale_records(load_jsonl(Path(path)), scale) for path in (human_path, machine_path, prompt_path))
+
+    nlp, human_data, machine_data, prompt_data = stage('load', load)
+
+    from preprocessor import process_data, process_prompt_data
+    from morphology import do_morpology_analysis, get_morphology_results
+    from syntax import do_syntactic_analysis, get_syntactic_results
+    from semantics import do_semantic_analysis, get_semantic_results
+    from pragmatics import do_sentiment_analysis, get_sentiment_results
+
+    human, machine, prompts = stage('parse', lambda: (process_data(human_data, nlp), process_data(machine_data, nlp),
+                                                     process_prompt_data(prompt_data, nlp)))
+
+    morphology = stage('do_morpology_analysis', do_morpology_analysis, human, machine)
+    syntax = stage('do_syntactic_analysis', do_syntactic_analysis, human, machine)
+    semantics = stage('do_semantic_analysis', do_semantic_analysis, human, machine, fast_semantics)
+    polarity, subjectivity = stage('do_sentiment_analysis', do_sentiment_analysis, human)
+    pragmatics = (polarity[0], polarity[1], subjectivity[0], subjectivity[1])
+
+    stage('get_morphology_results', get_morphology_results, prompts, morphology)
+    stage('get_syntactic_results', get_syntactic_results, syntax, prompts)
+    stage('get_semantic_results', get_semantic_results, semantics, prompts, fast_semantics)
+    stage('get_sentiment_results', get_sentiment_results, prompts, pragmatics)
+
+    tracemalloc.stop()
+    return {
+        'scale': scale,
+        'records': {'human': len(human_data), 'machine': len(machine_data), 'prompts': len(prompt_data)},
+        'peak rss (MB)': max(measurement['peak rss (MB)'] for measurement in stages),
+        'stages': stages,
+    }
+
+
+def check_budgets(results: List[Dict[str, Any]], budgets: Dict[str, float], max_rss: float | None) -> List[str]:
+    '''
+    Check the measurements against the memory budgets
+    param results: List[Dict[str, Any]], the measurements of every scale, see measure_memory
+    param budgets: Dict[str, float], the maximum peak traced memory of a stage in megabytes
+    param max_rss: float, the maximum peak RSS in megabytes, if any
+    return: List[str], a description of every budget that is exceeded
+    '''
+    violations: List[str] = []
+    measured = {measurement['stage'] for result in results for measurement in result['stages']}
+    for stage in budgets:
+        if results and stage not in measured:
+            violations.append(f'{stage} has a budget, but no stage with that name was measured')
+    for result in results:
+        if max_rss is not None and result['peak rss (MB)'] > max_rss:
+            violations.append(f"scale {result['scale']}: peak rss {result['peak rss (MB)']:.1f} MB > {max_rss:.1f} MB")
+        for measurement in result['stages']:
+            budget = budgets.get(measurement['stage'])
+            if budget is not None and measurement['peak traced (MB)'] > budget:
+                violations.append(f"scale {result['scale']}: {measurement['stage']} peaked at "
+                                  f"{measurement['peak traced (MB)']:.1f} MB > {budget:.1f} MB")
+    return violations
+
+
+def benchmark_memory(human_path: str, machine_path: str, prompt_path: str, scales: List[float],
+                     fast_semantics: bool = False, top: int = 10) -> List[Dict[str, Any]]:
+    '''
+    Measure the memory of the pipeline for every scale of the corpora. Every scale runs in a fresh
+    process, so the peak RSS of one scale does not hide the next
+    param human_path: str, the path to the human training data
+    param machine_path: str, the path to the machine training data
+    param prompt_path: str, the path to the prompt data
+    param scales: List[float], the scales of the corpora, see scale_records
+    param fast_semantics: bool, whether to leave fastcoref out and estimate the coreference values
+    param top: int, the amount of allocators to report per stage
+    '''
+    results: List[Dict[str, Any]] = []
+    for scale in scales:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results.append(pool.submit(measure_memory, human_path, machine_path, prompt_path, scale, fast_semantics, top).result())
+    return results
+
+
+def parse_budget(value: str) -> Tuple[str, float]:
+    '''
+    Parse a memory budget like parse=1500, the maximum peak traced memory of a stage in megabytes
+    param value: str, the budget from the command line
+    '''
+    stage, _, megabytes = value.partition('=')
+    if stage not in MEMORY_STAGES:
+        raise argparse.ArgumentTypeError(f'invalid budget {value!r}, the stage must be one of {", ".join(MEMORY_STAGES)}')
+    try:
+        return stage, float(megabytes)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid budget {value!r}, expected <stage>=<megabytes>')
+
+
+def print_report(title: str, report: Dict[str, float]) -> None:
+    '''
+    Print a benchmark report
+    param title: str, the name of the benchmark
+    param report: Dict[str, float], the measured values
+    '''
+    print(f'The {title} benchmark results are: \n')
+    for key, value in report.items():
+        print(f'{key:45}: {value:.4f}')
+    print('\n')
+
+
+def create_parser():
+    '''
+    Create the parser for the command line arguments, with one subcommand per benchmark
+    '''
+    parser = argparse.ArgumentParser(description='benchmarks for the detection of AI generated text')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    semantics = subparsers.add_parser('semantics', help='compare the coref-free semantic analysis with fastcoref')
+    semantics.add_argument('-t', '--training', metavar=('<human_data>', '<machine_data>'), nargs=2, type=str,
+                           default=['human.jsonl', 'group1.jsonl'], help='Path to the human and machine data jsonl file')
+    semantics.add_argument('prompt', metavar="prompt data", type=str, nargs='?', default='prompts.jsonl',
+                           help='Path to the prompt data jsonl file')
+
+    batching = subparsers.add_parser('batching', help='compare file order batching with length-bucketed batching')
+    batching.add_argument('corpus', metavar="corpus data", type=str, nargs='?', default='human.jsonl',
+                          help='Path to the corpus jsonl file to parse')
+    batching.add_argument('--fast-semantics', action='store_true',
+                          help='Leave the fastcoref component out of the pipeline')
+
+    loading = subparsers.add_parser('loading', help='compare the mmap jsonl loader with json.loads line by line')
+    loading.add_argument('corpus', metavar="corpus data", type=str, nargs='?', default='human.jsonl',
+                         help='Path to the corpus jsonl file to load')
+    loading.add_argument('--repeat', type=int, default=5, help='The amount of runs per loader')
+    loading.add_argument('--workers', type=int, default=4, help='The amount of processes for the parallel run')
+
+    compression = subparsers.add_parser('compression', help='compare reading a corpus uncompressed with gzip, xz and zstd')
+    compression.add_argument('corpus', metavar="corpus data", type=str, nargs='?', default='human.jsonl',
+                             help='Path to the uncompressed corpus jsonl file')
+    compression.add_argument('--repeat', type=int, default=3, help='The amount of runs per load')
+    compression.add_argument('--parse', action='store_true',
+                             help='Also measure the end-to-end time of loading and parsing the texts')
+    compression.add_argument('--fast-semantics', action='store_true',
+                             help='Leave the fastcoref component out of the pipeline')
+
+    sentiment = subparsers.add_parser('sentiment', help='compare the lexicon sentiment component with spacytextblob')
+    sentiment.add_argument('corpora', metavar="corpus data", type=str, nargs='*', default=['human.jsonl', 'group1.jsonl'],
+                           help='Path to the corpus jsonl files to score')
+    sentiment.add_argument('--tolerance', type=float, default=0.01,
+                           help='The largest difference in polarity or subjectivity that counts as the same score')
+    sentiment.add_argument('--min-agreement', type=float, default=0.99,
+                           help='The share of documents that must be within the tolerance')
+
+    importtime = subparsers.add_parser('importtime', help='measure the import time of the command line and the predict path')
+    importtime.add_argument('--cli-budget', metavar='<ms>', type=float, default=300,
+                            help='The maximum import time of main.py')
+    importtime.add_argument('--predict-budget', metavar='<ms>', type=float, default=1500,
+                            help='The maximum import time of the predict path, detector.py')
+    importtime.add_argument('--repeat', type=int, default=5, help='The amount of runs per import path')
+
+    memory = subparsers.add_parser('memory', help='measure the peak memory of every stage and check the memory budgets')
+    memory.add_argument('-t', '--training', metavar=('<human_data>', '<machine_data>'), nargs=2, type=str,
+                        default=['human.jsonl', 'group1.jsonl'], help='Path to the human and machine data jsonl file')
+    memory.add_argument('prompt', metavar="prompt data", type=str, nargs='?', default='prompts.jsonl',
+                        help='Path to the prompt data jsonl file')
+    memory.add_argument('--scales', metavar='<scale>', type=float, nargs='+', default=[0.25, 0.5, 1.0],
+                        help='The scales of the corpora, below 1 part of the records is used, above 1 they are repeated')
+    memory.add_argument('--budget', metavar='<stage>=<megabytes>', type=parse_budget, action='append', default=[],
+                        help='The maximum peak traced memory of a stage, for example parse=1500')
+    memory.add_argument('--max-rss', metavar='<megabytes>', type=float, default=None,
+                        help='The maximum peak RSS of the pipeline')
+    memory.add_argument('--top', type=int, default=10, help='The amount of allocators to report per stage')
+    memory.add_argument('-o', '--output', metavar='<report>', type=str, default=None,
+                        help='Path to write the json report to')
+    memory.add_argument('--fast-semantics', action='store_true',
+                        help='Leave the fastcoref component out of the pipeline')
+    return parser.parse_args()
+
+
+def main():
+
+    args = create_parser()
+
+    if args.benchmark == 'semantics':
+        report = benchmark_semantics(args.training[0], args.training[1], args.prompt)
+        print_report('semantics', report)
+
+    elif args.benchmark == 'batching':
+        report = benchmark_batching(args.corpus, not args.fast_semantics)
+        print_report('batching', report)
+
+    elif args.benchmark == 'loading':
+        report = benchmark_loading(args.corpus, args.repeat, args.workers)
+        print_report('loading', report)
+
+    elif args.benchmark == 'compression':
+        report = benchmark_compression(args.corpus, args.repeat, args.parse, not args.fast_semantics)
+        print_report('compression', report)
+
+    elif args.benchmark == 'sentiment':
+        report = benchmark_sentiment(args.corpora, args.tolerance)
+        print_report('sentiment', report)
+        if report['documents within tolerance'] < args.min_agreement:
+            print(f"Only {report['documents within tolerance']:.2%} of the documents are within the tolerance")
+            sys.exit(1)
+
+    elif args.benchmark == 'importtime':
+        results = benchmark_importtime(args.repeat)
+        for path, result in results.items():
+            print_report(f"{path} import ({result['module']})",
+                         {key: value for key, value in result.items() if isinstance(value, float)})
+            print(f"slowest imports (ms): {result['slowest imports (ms)']}\n")
+
+        violations = check_import_budgets(results, {'cli': args.cli_budget, 'predict': args.predict_budget})
+        for violation in violations:
+            print(f'Import budget exceeded, {violation}')
+        if violations:
+            sys.exit(1)
+
+    elif args.benchmark == 'memory':
+        budgets: Dict[str, float] = dict(args.budget)
+        results = benchmark_memory(args.training[0], args.training[1], args.prompt, args.scales, args.fast_semantics, args.top)
+        for result in results:
+            print_report(f"memory (scale {result['scale']}, peak traced MB)",
+                         {measurement['stage']: measurement['peak traced (MB)'] for measurement in result['stages']})
+        violations = check_budgets(results, budgets, args.max_rss)
+
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump({'budgets': budgets, 'max rss (MB)': args.max_rss, 'results': results,
+                           'violations': violations}, file, indent=2)
+
+        for violation in violations:
+            print(f'Memory budget exceeded, {violation}')
+        if violations:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
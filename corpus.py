@@ -0,0 +1,508 @@
+# Program name: corpus.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# Reading the jsonl corpora. The file is memory-mapped and split into byte ranges on line
+# boundaries, and large files are decoded range by range in worker processes. This module
+# only uses light imports, so the worker processes start quickly.
+# Compressed corpora (.jsonl.gz, .jsonl.xz and .jsonl.zst) are decompressed as a stream, block by
+# block, optionally in a background thread so the decompression overlaps with what reads the records.
+# A sidecar offset index (<corpus>.idx) gives random access to single records and record ranges:
+# python3 corpus.py index human.jsonl dev/machines/*.jsonl
+# python3 corpus.py show prompts.jsonl 17
+
+# import the supporting packages
+import argparse
+import gzip
+import hashlib
+import json
+import lzma
+import mmap
+import os
+import queue
+import random
+import sys
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Tuple
+
+# use the faster orjson decoder when it is installed
+try:
+    import orjson # type: ignore
+    json_loads: Callable[[bytes], Any] = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# the fields of a record the pipeline uses, the others are dropped while decoding
+FIELDS: Tuple[str, ...] = ('id', 'text', 'by')
+
+# files smaller than this are decoded in the main process, starting workers would cost more than it saves
+PARALLEL_MIN_BYTES: int = 8 * 1024 * 1024
+
+# the offset index is stored next to the corpus, with this suffix
+INDEX_SUFFIX: str = '.idx'
+INDEX_VERSION: int = 1
+
+# the amount of bytes hashed at the start and the end of a corpus to validate its index
+DIGEST_BLOCK: int = 64 * 1024
+
+# the compressed corpus formats, zstd needs the zstandard package, and the suffixes a corpus may have
+COMPRESSED_SUFFIXES: Tuple[str, ...] = ('.gz', '.xz', '.zst')
+CORPUS_SUFFIXES: Tuple[str, ...] = ('.jsonl',) + tuple('.jsonl' + suffix for suffix in COMPRESSED_SUFFIXES)
+
+# the amount of decompressed bytes read at once, and the amount of blocks the background thread reads ahead
+READ_BLOCK: int = 1024 * 1024
+READ_AHEAD: int = 8
+
+
+def is_compressed(file_path: str) -> bool:
+    '''
+    Whether a corpus is compressed, by its suffix
+    param file_path: str, the path to the corpus
+    '''
+    return str(file_path).endswith(COMPRESSED_SUFFIXES)
+
+
+def open_corpus(file_path: str) -> BinaryIO:
+    '''
+    Open a corpus for reading bytes, a compressed corpus is decompressed while it is read
+    param file_path: str, the path to the corpus
+    '''
+    file_path = str(file_path)
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rb') # type: ignore
+    if file_path.endswith('.xz'):
+        return lzma.open(file_path, 'rb') # type: ignore
+    if file_path.endswith('.zst'):
+        try:
+            import zstandard # type: ignore
+        except ImportError:
+            raise ImportError(f'{file_path}, please install the zstandard package to read .zst corpora')
+        return zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True)
+    return open(file_path, 'rb')
+
+
+def read_blocks(file_path: str, block_size: int = READ_BLOCK) -> Iterator[bytes]:
+    '''
+    Read a corpus in blocks of whole lines, decompressing it if it is compressed
+    param file_path: str, the path to the corpus
+    param block_size: int, about the amount of bytes per block
+    '''
+    rest: bytes = b''
+    with open_corpus(file_path) as file:
+        while True:
+            block: bytes = file.read(block_size)
+            if not block:
+                break
+            end: int = block.rfind(b'\n') + 1
+            if end:
+                yield rest + block[:end]
+                rest = block[end:]
+            else:
+                rest += block
+    if rest:
+        yield rest
+
+
+def read_lines(file_path: str) -> Iterator[bytes]:
+    '''
+    Read the lines of a corpus, decompressing it if it is compressed. The lines are split from the blocks
+    of read_blocks, the decompressing readers (zstandard's stream_reader) do not all iterate over lines
+    param file_path: str, the path to the corpus
+    return: Iterator[bytes], the lines with their newline, the last line may not have one
+    '''
+    for block in read_blocks(file_path):
+        lines: List[bytes] = block.split(b'\n')
+        last: bytes = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+        if last:
+            yield last
+
+
+def read_ahead(blocks: Iterator[bytes], depth: int = READ_AHEAD) -> Iterator[bytes]:
+    '''
+    Read blocks in a background thread, at most depth blocks ahead of the caller. Decompression
+    releases the GIL, so it runs at the same time as the decoding and parsing of the earlier blocks.
+    param blocks: Iterator[bytes], the blocks, for example from read_blocks
+    param depth: int, the most blocks that are waiting
+    '''
+    waiting: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                waiting.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for block in blocks:
+                if not put(block):
+                    return
+            put(None)
+        except Exception as error:
+            put(error)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = waiting.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # the caller stopped early or is done, let the thread end
+        stop.set()
+
+
+def iter_records(file_path: str, fields: Tuple[str, ...] | None = FIELDS, background: bool = False) -> Iterator[Dict[str, Any]]:
+    '''
+    Stream the records of a corpus, compressed or not, without loading the whole file
+    param file_path: str, the path to the corpus
+    param fields: Tuple[str, ...], the fields to keep of every record, None keeps all of them
+    param background: bool, whether the file is read and decompressed in a background thread
+    '''
+    blocks: Iterator[bytes] = read_blocks(file_path)
+    if background:
+        blocks = read_ahead(blocks)
+    for block in blocks:
+        yield from decode_lines(block, fields)
+
+
+def split_byte_ranges(buffer: mmap.mmap | bytes, parts: int) -> List[Tuple[int, int]]:
+    '''
+    Split a buffer into about equal byte ranges that start and end on line boundaries
+    param buffer: mmap.mmap | bytes, the contents of the jsonl file
+    param parts: int, the amount of ranges to split the buffer into
+    return: List[Tuple[int, int]], the (start, end) byte offsets of every range
+    '''
+    size: int = len(buffer)
+    ranges: List[Tuple[int, int]] = []
+    start: int = 0
+    for part in range(1, parts + 1):
+        if start >= size:
+            break
+        if part == parts:
+            end = size
+        else:
+            # end the range after the first newline from the split point on
+            end = buffer.find(b'\n', max(start, size * part // parts)) + 1 or size
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def decode_lines(chunk: bytes, fields: Tuple[str, ...] | None = FIELDS) -> List[Dict[str, Any]]:
+    '''
+    Decode the jsonl lines in a chunk of bytes, skipping empty lines
+    param chunk: bytes, whole lines of a jsonl file
+    param fields: Tuple[str, ...], the fields to keep of every record, None keeps all of them
+    '''
+    records: List[Dict[str, Any]] = []
+    for line in chunk.split(b'\n'):
+        if not line.strip():
+            continue
+        record: Dict[str, Any] = json_loads(line)
+        if fields is not None:
+            record = {key: record[key] for key in fields if key in record}
+        records.append(record)
+    return records
+
+
+def decode_range(file_path: str, start: int, end: int, fields: Tuple[str, ...] | None = FIELDS) -> List[Dict[str, Any]]:
+    '''
+    Decode the lines in a byte range of a jsonl file, used by the worker processes of load_jsonl
+    param file_path: str, the path to the jsonl file
+    param start: int, the offset of the first byte of the range
+    param end: int, the offset after the last byte of the range
+    param fields: Tuple[str, ...], the fields to keep of every record, None keeps all of them
+    '''
+    if is_compressed(file_path):
+        # a compressed stream can only be searched by decompressing up to the range
+        with open_corpus(file_path) as file:
+            file.seek(start)
+            return decode_lines(file.read(end - start), fields)
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return decode_lines(buffer[start:end], fields)
+
+
+def load_jsonl(file_path: str, fields: Tuple[str, ...] | None = FIELDS, workers: int | None = None) -> List[Dict[str, Any]]:
+    '''
+    Loads a jsonl file
+    param file_path: str, the path to the jsonl file
+    param fields: Tuple[str, ...], the fields to keep of every record, None keeps all of them
+    param workers: int, the amount of processes that decode the file, by default one per cpu for large files
+    return: list of dictionaries, with each dictionary being a line in the jsonl file
+    '''
+    if os.path.getsize(file_path) == 0:
+        return []
+    if is_compressed(file_path):
+        return list(iter_records(file_path, fields, background=True))
+
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        if workers is None:
+            workers = (os.cpu_count() or 1) if len(buffer) >= PARALLEL_MIN_BYTES else 1
+        if workers <= 1:
+            return decode_lines(buffer[:], fields)
+        ranges = split_byte_ranges(buffer, workers)
+
+    return decode_ranges(file_path, ranges, fields, workers)
+
+
+def decode_ranges(file_path: str, ranges: List[Tuple[int, int]], fields: Tuple[str, ...] | None = FIELDS, workers: int = 1) -> List[Dict[str, Any]]:
+    '''
+    Decode byte ranges of a jsonl file, every range in its own process when there are multiple workers
+    param file_path: str, the path to the jsonl file
+    param ranges: List[Tuple[int, int]], the (start, end) byte offsets of the ranges, on line boundaries
+    param fields: Tuple[str, ...], the fields to keep of every record, None keeps all of them
+    param workers: int, the amount of processes that decode the ranges
+    return: list of dictionaries, the records of all ranges in the order of the ranges
+    '''
+    if not ranges:
+        return []
+    starts, ends = zip(*ranges)
+    records: List[Dict[str, Any]] = []
+    if workers <= 1:
+        for start, end in ranges:
+            records.extend(decode_range(file_path, start, end, fields))
+        return records
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk_records in pool.map(decode_range, repeat(file_path), starts, ends, repeat(fields)):
+            records.extend(chunk_records)
+    return records
+
+
+def get_file_signature(file_path: str) -> Dict[str, Any]:
+    '''
+    Get the values an offset index is validated with: the size, the modification time and
+    a hash of the size and the first and last bytes of the file
+    param file_path: str, the path to the corpus
+    '''
+    status = os.stat(file_path)
+    digest = hashlib.blake2b(str(status.st_size).encode(), digest_size=16)
+    with open(file_path, 'rb') as file:
+        digest.update(file.read(DIGEST_BLOCK))
+        if status.st_size > DIGEST_BLOCK:
+            file.seek(max(DIGEST_BLOCK, status.st_size - DIGEST_BLOCK))
+            digest.update(file.read(DIGEST_BLOCK))
+    return {'version': INDEX_VERSION, 'size': status.st_size, 'mtime_ns': status.st_mtime_ns, 'hash': digest.hexdigest()}
+
+
+def build_index(file_path: str) -> array:
+    '''
+    Find the byte offset of every record in a jsonl file, empty lines are not records.
+    The offsets of a compressed corpus are offsets in the decompressed stream.
+    param file_path: str, the path to the corpus
+    return: array, the offset of every record, followed by the size of the file, so
+            record i is found between offsets[i] and offsets[i + 1]
+    '''
+    offsets = array('Q')
+    if is_compressed(file_path):
+        position: int = 0
+        for line in read_lines(file_path):
+            if line.strip():
+                offsets.append(position)
+            position += len(line)
+        offsets.append(position)
+        return offsets
+
+    size: int = os.path.getsize(file_path)
+    if size:
+        with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            start: int = 0
+            while start < size:
+                end: int = buffer.find(b'\n', start) + 1 or size
+                if buffer[start:end].strip():
+                    offsets.append(start)
+                start = end
+    offsets.append(size)
+    return offsets
+
+
+def write_index(file_path: str, offsets: array, signature: Dict[str, Any]) -> None:
+    '''
+    Write the offset index next to the corpus: a json header line with the signature of the corpus,
+    followed by the offsets as little-endian 64 bit integers. The file is replaced atomically.
+    param file_path: str, the path to the corpus
+    param offsets: array, the offsets from build_index
+    param signature: Dict[str, Any], the signature of the corpus from get_file_signature
+    '''
+    if sys.byteorder != 'little':
+        offsets = array('Q', offsets)
+        offsets.byteswap()
+    index_path: str = file_path + INDEX_SUFFIX
+    temporary_path: str = f'{index_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(json.dumps(signature).encode() + b'\n')
+        file.write(offsets.tobytes())
+    os.replace(temporary_path, index_path)
+
+
+def read_index(file_path: str) -> Tuple[Dict[str, Any], array] | None:
+    '''
+    Read the offset index of a corpus, if there is one
+    param file_path: str, the path to the corpus
+    return: the signature and the offsets stored in the index, or None if there is no readable index
+    '''
+    try:
+        with open(file_path + INDEX_SUFFIX, 'rb') as file:
+            signature: Dict[str, Any] = json.loads(file.readline())
+            offsets = array('Q', file.read())
+    except (OSError, ValueError):
+        return None
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+    return signature, offsets
+
+
+def load_index(file_path: str) -> array:
+    '''
+    Get the offset index of a corpus. The stored index is used when the size, modification time and hash
+    of the corpus still match, otherwise the index is built again and stored next to the corpus.
+    param file_path: str, the path to the corpus
+    return: array, the record offsets, see build_index
+    '''
+    signature: Dict[str, Any] = get_file_signature(file_path)
+    stored = read_index(file_path)
+    if stored is not None and stored[0] == signature:
+        return stored[1]
+
+    offsets: array = build_index(file_path)
+    try:
+        write_index(file_path, offsets, signature)
+    except OSError:
+        # a read-only corpus directory, the index is only kept in memory
+        pass
+    return offsets
+
+
+def count_records(file_path: str) -> int:
+    '''
+    Count the records of a corpus using its offset index
+    param file_path: str, the path to the corpus
+    '''
+    return len(load_index(file_path)) - 1
+
+
+def parse_record_range(value: str) -> Tuple[int | None, int | None]:
+    '''
+    Parse a record range like 1000:2000, :500 or 1000:, or a single record number like 17
+    param value: str, the range as given on the command line
+    return: Tuple[int | None, int | None], the start and stop of the range, like a python slice
+    '''
+    try:
+        if ':' not in value:
+            return int(value), int(value) + 1
+        start, stop = value.split(':')
+        return (int(start) if start else None), (int(stop) if stop else None)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value}, the records must be a number or a range like 1000:2000')
+
+
+def read_records(file_path: str, start: int | None = None, stop: int | None = None,
+                 fields: Tuple[str, ...] | None = FIELDS, workers: int = 1) -> List[Dict[str, Any]]:
+    '''
+    Read a range of records from a corpus without scanning the records before it
+    param file_path: str, the path to the corpus
+    param start: int, the number of the first record, counted from 0
+    param stop: int, the number after the last record, like a python slice
+    param fields: Tuple[str, ...], the fields to keep of every record, None keeps all of them
+    param workers: int, the amount of processes that decode the range
+    return: list of dictionaries, the records in the range
+    '''
+    offsets: array = load_index(file_path)
+    start, stop, _ = slice(start, stop).indices(len(offsets) - 1)
+    if start >= stop:
+        return []
+
+    # split the range into about equal parts on record boundaries, one per worker,
+    # every worker would decompress a compressed corpus from the start, so it is read by one
+    parts: int = 1 if is_compressed(file_path) else max(1, min(workers, stop - start))
+    bounds: List[int] = [start + (stop - start) * part // parts for part in range(parts + 1)]
+    ranges: List[Tuple[int, int]] = [(offsets[first], offsets[last]) for first, last in zip(bounds, bounds[1:])]
+    return decode_ranges(file_path, ranges, fields, parts)
+
+
+def read_record(file_path: str, number: int, fields: Tuple[str, ...] | None = None) -> Dict[str, Any]:
+    '''
+    Read a single record from a corpus
+    param file_path: str, the path to the corpus
+    param number: int, the number of the record, counted from 0
+    param fields: Tuple[str, ...], the fields to keep of the record, None keeps all of them
+    '''
+    records: List[Dict[str, Any]] = read_records(file_path, number, number + 1, fields)
+    if not records or number < 0:
+        raise IndexError(f'{file_path} has no record {number}')
+    return records[0]
+
+
+def sample_records(file_path: str, size: int, seed: int | None = None, fields: Tuple[str, ...] | None = FIELDS) -> List[Dict[str, Any]]:
+    '''
+    Draw a uniform random sample of records from a corpus in one pass, with reservoir sampling.
+    Only the sampled lines are decoded, and they are returned in random order, so every prefix
+    of the sample is a uniform sample too.
+    param file_path: str, the path to the corpus
+    param size: int, the amount of records to sample, all records if the corpus is smaller
+    param seed: int, the seed of the random generator, for a reproducible sample
+    param fields: Tuple[str, ...], the fields to keep of every record, None keeps all of them
+    '''
+    generator = random.Random(seed)
+    reservoir: List[bytes] = []
+    seen: int = 0
+    for line in read_lines(file_path):
+        if not line.strip():
+            continue
+        if len(reservoir) < size:
+            reservoir.append(line)
+        else:
+            slot: int = generator.randrange(seen + 1)
+            if slot < size:
+                reservoir[slot] = line
+        seen += 1
+
+    generator.shuffle(reservoir)
+    return decode_lines(b'\n'.join(line.rstrip(b'\n') for line in reservoir), fields)
+
+
+def create_parser():
+    '''
+    Create the parser for the command line arguments
+    '''
+    parser = argparse.ArgumentParser(description='offset indexes for the jsonl corpora')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    index = subparsers.add_parser('index', help='build or refresh the offset index of corpora')
+    index.add_argument('corpora', metavar='corpus', type=str, nargs='+', help='Path to a corpus jsonl file, optionally compressed')
+
+    show = subparsers.add_parser('show', help='print records of a corpus')
+    show.add_argument('corpus', type=str, help='Path to the corpus jsonl file')
+    show.add_argument('records', type=parse_record_range, help='A record number or a range like 1000:2000')
+    return parser.parse_args()
+
+
+def main():
+
+    args = create_parser()
+
+    if args.command == 'index':
+        for corpus_path in args.corpora:
+            print(f'{corpus_path}: {count_records(corpus_path)} records')
+
+    elif args.command == 'show':
+        for record in read_records(args.corpus, *args.records, fields=None):
+            print(json.dumps(record, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
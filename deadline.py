@@ -0,0 +1,265 @@
+# Program name: deadline.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# Deadline-aware scoring of single texts. DeadlineScorer.score gets a time budget per text. It estimates
+# the time of every stage from the length of the text, with a cost model that learns from the timings
+# of the texts scored before, and when the stages would not fit in the budget it drops the most
+# expensive of the optional ones: fastcoref, the WordNet based semantic analysis, and the sentiment
+# component with the pragmatic analysis. The separators of the semantic analysis are fitted on either
+# real or estimated coreference values, so without fastcoref the semantic analysis of a model that is
+# trained with fastcoref is dropped too, and a model trained without fastcoref never needs it.
+# The analyzers that ran vote with renormalized weights, see detector.get_partial_predicion.
+#
+# python3 deadline.py prompts.jsonl -m model.json --budget 0.2
+
+# import our modules
+from __future__ import annotations
+from detector import get_partial_predicion, get_semantic_votes, ANALYZERS
+from morphology import get_morphology_results
+from syntax import get_syntactic_results
+from pragmatics import get_sentiment_results
+
+# import the supporting packages
+import argparse
+import time
+from typing import Any, Callable, Dict, List, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from spacy.language import Language
+    from spacy.tokens import Doc
+
+# the stage of every pipeline component that can be dropped, the other components are the parse stage
+COMPONENT_STAGES: Dict[str, str] = {
+    'fastcoref': 'coref',
+    'lexicon_sentiment': 'sentiment',
+    'spacytextblob': 'sentiment',
+}
+
+# the stages that can be dropped, and the analyzers that cannot run without them
+OPTIONAL_STAGES: Tuple[str, ...] = ('coref', 'semantics', 'sentiment')
+DROPPED_ANALYZERS: Dict[str, str] = {'semantics': 'semantics', 'sentiment': 'pragmatics'}
+
+# the stages that are dropped together, fastcoref only serves the semantic analysis, which is fitted on its values
+LINKED_STAGES: Dict[str, str] = {'coref': 'semantics', 'semantics': 'coref'}
+
+# the seconds per character of every stage on a cpu, used until the stage has been timed
+PRIOR_SECONDS_PER_CHARACTER: Dict[str, float] = {
+    'parse': 2e-5,
+    'coref': 1e-4,
+    'sentiment': 2e-6,
+    'morphology': 2e-7,
+    'syntax': 2e-7,
+    'semantics': 2e-6,
+    'pragmatics': 1e-8,
+}
+
+# how much the timings of earlier texts count, every new timing multiplies the weight of the old ones by this
+DECAY: float = 0.98
+
+
+class CostModel:
+    '''
+    Estimate the seconds a stage takes from the length of the text, with a linear fit on the timings
+    of the earlier texts that gives recent texts more weight
+    param decay: float, the factor the weight of the earlier timings is multiplied by for every new timing
+    '''
+
+    def __init__(self, decay: float = DECAY) -> None:
+        self.decay = decay
+        # per stage the weighted sums of 1, x, y, x * x and x * y, with x the characters and y the seconds
+        self.sums: Dict[str, List[float]] = {}
+
+    def observe(self, stage: str, characters: int, seconds: float) -> None:
+        '''
+        Add the timing of a stage
+        param stage: str, the stage
+        param characters: int, the length of the text
+        param seconds: float, the time the stage took
+        '''
+        sums = self.sums.setdefault(stage, [0.0] * 5)
+        for number, value in enumerate((1.0, characters, seconds, characters * characters, characters * seconds)):
+            sums[number] = sums[number] * self.decay + value
+
+    def estimate(self, stage: str, characters: int) -> float:
+        '''
+        Estimate the time of a stage for a text
+        param stage: str, the stage
+        param characters: int, the length of the text
+        '''
+        if stage not in self.sums:
+            return PRIOR_SECONDS_PER_CHARACTER.get(stage, 0.0) * characters
+        weight, x, y, xx, xy = self.sums[stage]
+        variance: float = weight * xx - x * x
+        if weight < 3 or variance <= 1e-9 * weight * xx:
+            # too few or too similar texts for a line, scale the average time by the length
+            return y / x * characters if x else y / weight
+        slope: float = (weight * xy - x * y) / variance
+        return max(0.0, (y - slope * x) / weight + slope * characters)
+
+
+class DeadlineScorer:
+    '''
+    Score single texts within a time budget
+    param nlp: Language, the loaded spacy model
+    param model: Dict[str, Any], the model from detector.train_detector
+    param costs: CostModel, the cost model, by default a new one
+    '''
+
+    def __init__(self, nlp: Language, model: Dict[str, Any], costs: CostModel | None = None) -> None:
+        self.nlp = nlp
+        self.model = model
+        self.costs = costs or CostModel()
+        self.stages: List[str] = sorted(set(COMPONENT_STAGES.get(name, 'parse') for name in nlp.pipe_names))
+        if not model['fast_semantics'] and 'coref' not in self.stages:
+            raise ValueError('The model is trained with fastcoref, so the pipeline needs the fastcoref component')
+
+    def plan(self, stages: List[str], characters: int, remaining: float) -> List[str]:
+        '''
+        Drop the most expensive optional stages until the estimated time of the stages fits in the remaining time
+        param stages: List[str], the stages that are still to run
+        param characters: int, the length of the text
+        param remaining: float, the seconds left of the budget
+        return: List[str], the dropped stages
+        '''
+        estimates = {stage: self.costs.estimate(stage, characters) for stage in stages}
+        dropped: List[str] = []
+        while sum(estimates.values()) > remaining:
+            optional = [stage for stage in estimates if stage in OPTIONAL_STAGES]
+            if not optional:
+                break
+            stage = max(optional, key=lambda stage: estimates[stage])
+            dropped.append(stage)
+            del estimates[stage]
+            # the analyzers that need the dropped stage do not run either
+            for analyzer in [DROPPED_ANALYZERS[stage]] if stage in DROPPED_ANALYZERS else []:
+                estimates.pop(analyzer, None)
+            linked = LINKED_STAGES.get(stage)
+            if linked in estimates:
+                dropped.append(linked)
+                del estimates[linked]
+        return dropped
+
+    def timed(self, stage: str, characters: int, function: Callable, *args) -> Any:
+        '''
+        Run a stage and add its timing to the cost model
+        param stage: str, the stage
+        param characters: int, the length of the text
+        param function: Callable, the function of the stage
+        '''
+        start: float = time.perf_counter()
+        result = function(*args)
+        self.costs.observe(stage, characters, time.perf_counter() - start)
+        return result
+
+    def parse(self, text: str, skipped: List[str]) -> Doc:
+        '''
+        Run the pipeline components of the stages that are not skipped, component by component, timing every stage
+        param text: str, the text to parse
+        param skipped: List[str], the dropped stages
+        '''
+        characters: int = len(text)
+        seconds: Dict[str, float] = {}
+        doc = self.nlp.make_doc(text)
+        for name, component in self.nlp.pipeline:
+            stage = COMPONENT_STAGES.get(name, 'parse')
+            if stage in skipped:
+                continue
+            start: float = time.perf_counter()
+            doc = component(doc)
+            seconds[stage] = seconds.get(stage, 0.0) + time.perf_counter() - start
+        for stage, stage_seconds in seconds.items():
+            self.costs.observe(stage, characters, stage_seconds)
+        return doc
+
+    def score(self, text: str, budget: float) -> Dict[str, Any]:
+        '''
+        Score a text within a time budget
+        param text: str, the text to score
+        param budget: float, the seconds the scoring may take
+        return: Dict[str, Any], the prediction and its score, the votes of the analyzers that ran,
+                the skipped stages, the time it took and whether that was within the budget
+        '''
+        start: float = time.perf_counter()
+        characters: int = len(text)
+
+        # plan all stages up front, the parse stage cannot be dropped, and a model trained without fastcoref does not need it
+        stages = [stage for stage in self.stages if stage != 'coref' or not self.model['fast_semantics']]
+        skipped = self.plan(stages + list(ANALYZERS), characters, budget)
+        doc = self.parse(text, skipped if stages == self.stages else skipped + ['coref'])
+        prompt: List[Dict[str, Any]] = [{'text': doc}]
+
+        # plan the analyzers again with the time that is left after parsing
+        analyzers = [analyzer for analyzer in ANALYZERS if analyzer not in [DROPPED_ANALYZERS.get(stage) for stage in skipped]]
+        skipped += self.plan(analyzers, characters, budget - (time.perf_counter() - start))
+        analyzers = [analyzer for analyzer in analyzers if analyzer not in [DROPPED_ANALYZERS.get(stage) for stage in skipped]]
+
+        fast_semantics: bool = self.model['fast_semantics']
+        run: Dict[str, Callable[[], List[str]]] = {
+            'morphology': lambda: get_morphology_results(prompt, self.model['morphology']),
+            'syntax': lambda: get_syntactic_results(self.model['syntax'], prompt),
+            'semantics': lambda: get_semantic_votes(self.model['semantics'], prompt, fast_semantics),
+            'pragmatics': lambda: get_sentiment_results(prompt, self.model['pragmatics']),
+        }
+        votes: Dict[str, str] = {analyzer: self.timed(analyzer, characters, run[analyzer])[0] for analyzer in analyzers}
+
+        prediction, score = get_partial_predicion(votes)
+        elapsed: float = time.perf_counter() - start
+        return {
+            'prediction': prediction,
+            'score': score,
+            'votes': votes,
+            'skipped': skipped,
+            'seconds': elapsed,
+            'in time': elapsed <= budget,
+        }
+
+
+def create_parser():
+    '''
+    Create the parser for the command line arguments
+    '''
+    parser = argparse.ArgumentParser(description='score every prompt within a time budget')
+    parser.add_argument('prompt', metavar="prompt data", type=str,
+                        help='Path to the prompt data jsonl file')
+    parser.add_argument('-m', '--model', metavar='<model>', type=str, required=True,
+                        help='Path to a model saved with detector.save_model')
+    parser.add_argument('--budget', metavar='<seconds>', type=float, default=0.2,
+                        help='The time budget per prompt')
+    parser.add_argument('--records', metavar='<start:stop>', type=str, default=None,
+                        help='Only score these prompt records, a number like 17 or a range like 1000:2000')
+    return parser.parse_args()
+
+
+def main():
+    from detector import load_model
+    from preprocessor import load_spacy_model
+    from corpus import read_records, parse_record_range
+
+    args = create_parser()
+    model = load_model(args.model)
+    nlp = load_spacy_model(not model['fast_semantics'])
+    scorer = DeadlineScorer(nlp, model)
+    records = read_records(args.prompt, *(parse_record_range(args.records) if args.records else (None, None)))
+
+    # warm up the pipeline, so the first text is not timed with the model loading
+    nlp('Warming up the pipeline.')
+
+    skipped: Dict[str, int] = {}
+    in_time: int = 0
+    correct: int = 0
+    for number, record in enumerate(records):
+        result = scorer.score(record['text'], args.budget)
+        for stage in result['skipped']:
+            skipped[stage] = skipped.get(stage, 0) + 1
+        in_time += result['in time']
+        correct += result['prediction'] == record.get('by')
+        print(f'{number:>6} {result["prediction"]:6} {result["score"]:>6.2f} {result["seconds"]:>7.3f}s '
+              f'skipped: {", ".join(result["skipped"]) or "nothing"}')
+
+    print(f'\n{in_time} of {len(records)} prompts are scored within {args.budget}s, the accuracy is {correct / max(len(records), 1):.2%}')
+    for stage, amount in skipped.items():
+        print(f'{stage} is skipped for {amount} prompts')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+# Program name: dedup.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# Near-duplicate detection over the training corpora and the prompts, in one streaming pass before the
+# texts are parsed. Every text gets a MinHash signature of its word 5-grams (shingles), two texts agree
+# on a value of the signature as often as their shingle sets overlap (the Jaccard similarity). The
+# signature is split into bands, and texts that share a whole band are candidates, so a text is only
+# compared to the few texts that are likely to be near-duplicates. A text that is a near-duplicate of
+# an earlier text is dropped before nlp.pipe, or flagged with the earlier text. Because the training
+# corpora are read before the prompts, a flagged prompt is training data that leaks into the evaluation.
+# The index takes about 2 KB per unique text, so millions of texts fit in memory on one machine.
+#
+# python3 dedup.py human.jsonl dev/machines/*.jsonl prompts.jsonl -o deduplicated
+
+# import the supporting packages
+from __future__ import annotations
+import argparse
+import os
+import re
+import zlib
+import numpy as np
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# the words of a shingle, and the values of a signature split into bands of rows
+SHINGLE_SIZE: int = 5
+BANDS: int = 16
+ROWS: int = 8
+PERMUTATIONS: int = BANDS * ROWS
+
+# the Jaccard similarity from which a text is a near-duplicate, two texts that are this similar
+# share a band with a probability of 1 - (1 - 0.8 ** ROWS) ** BANDS, which is about 0.95
+THRESHOLD: float = 0.8
+
+# the hash functions of the signature are (a * x + b) mod a Mersenne prime, with the same a and b in every run
+PRIME: int = (1 << 61) - 1
+SEED: int = 53745
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def get_shingles(text: str) -> np.ndarray:
+    '''
+    Get the 32 bit hashes of the word shingles of a text, the words are lowercased and the punctuation is ignored
+    param text: str, the text
+    return: np.ndarray, the hashes, empty for a text without words
+    '''
+    words = np.array([zlib.crc32(word.encode('utf-8')) for word in WORD_PATTERN.findall(text.lower())], dtype=np.uint64)
+    if not len(words):
+        return words
+    if len(words) < SHINGLE_SIZE:
+        # a short text is one shingle
+        return np.array([zlib.crc32(words.tobytes())], dtype=np.uint64)
+
+    # a polynomial hash of the words of every shingle, modulo 2 ** 32 so it fits the hash functions
+    shingles = np.zeros(len(words) - SHINGLE_SIZE + 1, dtype=np.uint64)
+    for offset in range(SHINGLE_SIZE):
+        shingles = shingles * np.uint64(0x01000193) + words[offset:len(words) - SHINGLE_SIZE + 1 + offset]
+    return np.unique(shingles & np.uint64(0xFFFFFFFF))
+
+
+class Deduplicator:
+    '''
+    Find the near-duplicates of earlier texts, in the order the corpora are read
+    param threshold: float, the Jaccard similarity of the shingles from which a text is a near-duplicate
+    param drop: bool, whether near-duplicates are dropped, otherwise they are kept and flagged
+    '''
+
+    def __init__(self, threshold: float = THRESHOLD, drop: bool = True) -> None:
+        self.threshold = threshold
+        self.drop = drop
+        # a and b stay below 2 ** 31, so a * x + b fits in 64 bits for the 32 bit shingles
+        generator = np.random.default_rng(SEED)
+        self.multipliers = generator.integers(1, 1 << 31, PERMUTATIONS, dtype=np.uint64)[:, None]
+        self.increments = generator.integers(0, 1 << 31, PERMUTATIONS, dtype=np.uint64)[:, None]
+
+        # the signatures of the unique texts, the corpus and record number of every text, and per band the first text with a band value
+        self.signatures = np.empty((1024, PERMUTATIONS), dtype=np.uint32)
+        self.texts: int = 0
+        self.sources: List[str] = []
+        self.text_sources = array('H')
+        self.text_records = array('L')
+        self.bands: List[Dict[int, int]] = [{} for _ in range(BANDS)]
+
+        # per corpus the amount of records, and per corpus and earlier corpus the amount of near-duplicates
+        self.records: Dict[str, int] = {}
+        self.duplicates: Dict[Tuple[str, str], int] = {}
+
+    def get_signature(self, shingles: np.ndarray) -> np.ndarray:
+        '''
+        Get the MinHash signature of a text, the lowest value of every hash function over the shingles
+        param shingles: np.ndarray, the shingles of the text, see get_shingles
+        '''
+        hashes = (self.multipliers * shingles + self.increments) % np.uint64(PRIME)
+        return hashes.min(axis=1).astype(np.uint32)
+
+    def find(self, signature: np.ndarray) -> int | None:
+        '''
+        Find the most similar earlier text among the texts that share a band, if it is similar enough
+        param signature: np.ndarray, the signature of the text
+        return: int | None, the number of the earlier text, or None
+        '''
+        candidates = {self.bands[band].get(hash(signature[band * ROWS:(band + 1) * ROWS].tobytes())) for band in range(BANDS)}
+        candidates.discard(None)
+        if not candidates:
+            return None
+        numbers = np.fromiter(candidates, dtype=np.intp)
+        similarities = (self.signatures[numbers] == signature).mean(axis=1)
+        best = int(similarities.argmax())
+        return int(numbers[best]) if similarities[best] >= self.threshold else None
+
+    def add(self, signature: np.ndarray, source: int, number: int) -> None:
+        '''
+        Add a unique text to the index
+        param signature: np.ndarray, the signature of the text
+        param source: int, the number of the corpus of the text
+        param number: int, the record number of the text in its corpus
+        '''
+        if self.texts == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.empty_like(self.signatures)])
+        self.signatures[self.texts] = signature
+        self.text_sources.append(source)
+        self.text_records.append(number)
+        for band in range(BANDS):
+            self.bands[band].setdefault(hash(signature[band * ROWS:(band + 1) * ROWS].tobytes()), self.texts)
+        self.texts += 1
+
+    def check(self, text: str, source: str, number: int) -> str | None:
+        '''
+        Check whether a text is a near-duplicate of an earlier text, a unique text is added to the index
+        param text: str, the text
+        param source: str, the corpus of the text
+        param number: int, the record number of the text in its corpus
+        return: str | None, the earlier text as corpus:record, or None for a unique text or a text without words
+        '''
+        if source not in self.sources:
+            self.sources.append(source)
+        self.records[source] = self.records.get(source, 0) + 1
+
+        # a text without words has no shingles, it is not similar to anything, not even to another one without words
+        shingles = get_shingles(text)
+        if not len(shingles):
+            return None
+        signature = self.get_signature(shingles)
+        earlier = self.find(signature)
+        if earlier is None:
+            self.add(signature, self.sources.index(source), number)
+            return None
+
+        earlier_source = self.sources[self.text_sources[earlier]]
+        self.duplicates[(source, earlier_source)] = self.duplicates.get((source, earlier_source), 0) + 1
+        return f'{earlier_source}:{self.text_records[earlier]}'
+
+    def filter(self, records: Iterable[Dict[str, Any]], source: str, start: int = 0) -> Iterator[Dict[str, Any]]:
+        '''
+        Drop the near-duplicate records of a corpus, or flag them with the earlier text in record['duplicate']
+        param records: Iterable[Dict[str, Any]], the records, a list or a stream
+        param source: str, the corpus of the records
+        param start: int, the record number of the first record, when the records are a range of the corpus
+        '''
+        for number, record in enumerate(records, start):
+            text = record.get('text')
+            duplicate = self.check(text, source, number) if isinstance(text, str) else None
+            if duplicate is None:
+                yield record
+            elif not self.drop:
+                record['duplicate'] = duplicate
+                yield record
+
+
+def write_report(deduplicator: Deduplicator) -> None:
+    '''
+    Print per corpus the amount of near-duplicates within the corpus and of every earlier corpus
+    param deduplicator: Deduplicator, the deduplicator after all corpora were read
+    '''
+    action: str = 'dropped' if deduplicator.drop else 'flagged'
+    for source in deduplicator.sources:
+        amount = sum(count for (duplicate_source, _), count in deduplicator.duplicates.items() if duplicate_source == source)
+        print(f'{source}: {amount} of {deduplicator.records[source]} records are near-duplicates and {action}')
+        for earlier_source in deduplicator.sources:
+            count = deduplicator.duplicates.get((source, earlier_source), 0)
+            if count:
+                where = 'within the corpus' if earlier_source == source else f'of {earlier_source}'
+                print(f'  {count} {where}')
+
+
+def create_parser():
+    '''
+    Create the parser for the command line arguments
+    '''
+    parser = argparse.ArgumentParser(description='find the near-duplicates in and between corpora in one streaming pass')
+    parser.add_argument('corpora', metavar='corpus', type=str, nargs='+',
+                        help='Path to a corpus jsonl file, optionally compressed, the training corpora before the prompts')
+    parser.add_argument('--threshold', metavar='<similarity>', type=float, default=THRESHOLD,
+                        help='The Jaccard similarity of the word 5-grams from which a text is a near-duplicate')
+    parser.add_argument('-o', '--output', metavar='<directory>', type=str, default=None,
+                        help='Write the corpora without the near-duplicates to this directory')
+    return parser.parse_args()
+
+
+def main():
+    import json
+    from corpus import iter_records
+
+    args = create_parser()
+    deduplicator = Deduplicator(args.threshold)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        names = [os.path.basename(corpus_path).split('.jsonl')[0] for corpus_path in args.corpora]
+        if len(set(names)) < len(names):
+            raise ValueError('The corpora written to one directory need different file names')
+
+    for corpus_path in args.corpora:
+        records = deduplicator.filter(iter_records(corpus_path, fields=None, background=True), corpus_path)
+        if not args.output:
+            for _ in records:
+                pass
+            continue
+        # the written corpus is not compressed, whatever the corpus was
+        output_path = os.path.join(args.output, os.path.basename(corpus_path).split('.jsonl')[0] + '.jsonl')
+        with open(output_path, 'w', encoding='utf-8') as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    write_report(deduplicator)
+
+
+if __name__ == '__main__':
+    main()
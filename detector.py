@@ -0,0 +1,236 @@
+# Program name: detector.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# The detector combines the four analyzers. train_detector fits all of them on the
+# training data and returns the fitted values as one model, which can be saved as json,
+# and get_analyzer_votes / predict use a model to label the prompts.
+# train_and_vote does the same with the stages of get_stages, which run concurrently in a process pool.
+# With drift set, the model also holds a profile of the training data, which drift.DriftMonitor compares the
+# scored texts to. It lets the analyzers vote on all training texts, so it is only made when it is used or saved.
+
+# import our modules
+from pragmatics import do_sentiment_analysis, get_sentiment_results
+from morphology import do_morpology_analysis, get_morphology_results
+from syntax import do_syntactic_analysis, get_syntactic_results
+from semantics import perform_analysis, get_separators, do_semantic_analysis, get_semantic_results
+from features import get_doc_array
+from drift import get_training_profile
+from scheduler import Stage, run_stages, write_schedule
+
+# import the supporting packages
+import json
+import os
+from functools import partial
+from spacy.tokens import Doc
+from typing import Any, Dict, List, Tuple
+
+# the analyzers in the order get_predicion takes their votes
+ANALYZERS: Tuple[str, ...] = ('morphology', 'syntax', 'semantics', 'pragmatics')
+
+# how much an AI and a Human vote of every analyzer count in the final prediction
+WEIGHTS: Dict[str, Tuple[float, float]] = {
+    'morphology': (0.66, 0.78),
+    'syntax': (0.97, 0.73),
+    'semantics': (0.59, 0.46),
+    'pragmatics': (0.98, 0.53),
+}
+
+
+def get_predicion(morph: str, syn: str, sam: str, prag: str) -> str:
+    '''
+    Combine the votes of the four analyzers into the final prediction
+    param morph, syn, sam, prag: str, the vote (AI, Human or Unsure) of every analyzer
+    '''
+    score: float = 0.0
+    for analyzer, vote in zip(ANALYZERS, (morph, syn, sam, prag)):
+        ai_weight, human_weight = WEIGHTS[analyzer]
+        if vote == 'AI':
+            score += ai_weight
+        elif vote == 'Human':
+            score -= human_weight
+
+    return 'AI' if score > 0.0 else 'Human'
+
+
+def get_partial_predicion(votes: Dict[str, str]) -> Tuple[str, float]:
+    '''
+    Combine the votes of the analyzers that ran into the final prediction, like get_predicion.
+    The weights are renormalized over these analyzers, so the score is comparable whichever analyzers ran.
+    param votes: Dict[str, str], the vote (AI, Human or Unsure) of every analyzer that ran
+    return: Tuple[str, float], the prediction and its score, from -1 (surely Human) to 1 (surely AI)
+    '''
+    score: float = 0.0
+    total: float = 0.0
+    for analyzer, vote in votes.items():
+        ai_weight, human_weight = WEIGHTS[analyzer]
+        total += max(ai_weight, human_weight)
+        if vote == 'AI':
+            score += ai_weight
+        elif vote == 'Human':
+            score -= human_weight
+
+    score = score / total if total else 0.0
+    return ('AI' if score > 0.0 else 'Human'), score
+
+
+def train_detector(human: List[Doc], machine: List[Doc], fast_semantics: bool = False, drift: bool = False) -> Dict[str, Any]:
+    '''
+    Fit the four analyzers on the training data
+    param human: List[Doc], the human training data
+    param machine: List[Doc], the machine training data
+    param fast_semantics: bool, whether the semantic analysis estimates the coreference values without fastcoref
+    param drift: bool, whether to add the drift profile of the training data, see get_drift_profile
+    return: Dict[str, Any], the model, with the fitted values of every analyzer and with drift the drift profile
+    '''
+    model: Dict[str, Any] = {
+        'morphology': do_morpology_analysis(human, machine),
+        'syntax': do_syntactic_analysis(human, machine),
+        'semantics': do_semantic_analysis(human, machine, fast_semantics),
+        'pragmatics': fit_pragmatics(human),
+        'fast_semantics': fast_semantics,
+    }
+    if drift:
+        model['drift'] = get_drift_profile(human, machine, *[model[analyzer] for analyzer in ANALYZERS], fast_semantics=fast_semantics)
+    return model
+
+
+def get_drift_profile(human: List[Doc], machine: List[Doc], morphology: Any, syntax: Any, semantics: Any, pragmatics: Any,
+                      fast_semantics: bool = False) -> Dict[str, Any]:
+    '''
+    Get the drift profile of the training data, with the votes of the fitted analyzers on the training data
+    param human: List[Doc], the human training data
+    param machine: List[Doc], the machine training data
+    param morphology, syntax, semantics, pragmatics: Any, the fitted values of every analyzer
+    param fast_semantics: bool, whether the semantic analysis estimates the coreference values without fastcoref
+    '''
+    model: Dict[str, Any] = dict(zip(ANALYZERS, (morphology, syntax, semantics, pragmatics)))
+    model['fast_semantics'] = fast_semantics
+    docs = human + machine
+    votes = get_analyzer_votes(model, [{'text': doc} for doc in docs])
+    return get_training_profile(docs, votes, fast_semantics)
+
+
+def fit_pragmatics(human: List[Doc]) -> Tuple[float, float, float, float]:
+    '''
+    Fit the pragmatic analysis, the maximum and minimum polarity and subjectivity of the human data
+    param human: List[Doc], the human training data
+    '''
+    polarity, subjectivity = do_sentiment_analysis(human)
+    return (polarity[0], polarity[1], subjectivity[0], subjectivity[1])
+
+
+def get_semantic_votes(separators: Tuple[float, float, float], prompts: List[Dict[str, Doc | str]], fast_semantics: bool = False) -> List[str]:
+    '''
+    Let the semantic analysis vote on the prompts, without the certainty of get_semantic_results
+    param separators: Tuple[float, float, float], the fitted semantic separators
+    param prompts: List[Dict[str, Doc | str]], the parsed prompts
+    param fast_semantics: bool, whether the coreference values are estimated without fastcoref
+    '''
+    return [result[0] for result in get_semantic_results(separators, prompts, fast_semantics)]
+
+
+def get_analyzer_votes(model: Dict[str, Any], prompts: List[Dict[str, Doc | str]]) -> Dict[str, List[str]]:
+    '''
+    Let every analyzer vote on the prompts
+    param model: Dict[str, Any], the model from train_detector
+    param prompts: List[Dict[str, Doc | str]], the parsed prompts
+    return: Dict[str, List[str]], the votes of every analyzer, in the order of ANALYZERS
+    '''
+    # the syntactic results are the votes themselves, unlike the semantic results they are no (vote, value) tuples
+    return {
+        'morphology': get_morphology_results(prompts, model['morphology']), # type: ignore
+        'syntax': get_syntactic_results(model['syntax'], prompts), # type: ignore
+        'semantics': get_semantic_votes(model['semantics'], prompts, model['fast_semantics']),
+        'pragmatics': get_sentiment_results(prompts, model['pragmatics']),
+    }
+
+
+def get_stages(fast_semantics: bool = False, drift: bool = False) -> List[Stage]:
+    '''
+    Declare the training and voting of the four analyzers as stages for scheduler.run_stages.
+    The shared data is human, machine and prompts. The slow semantic analysis of the human and the
+    machine data are separate stages, so they run next to each other and next to the other analyzers.
+    param fast_semantics: bool, whether the semantic analysis estimates the coreference values without fastcoref
+    param drift: bool, whether to add the stage of the drift profile
+    '''
+    stages: List[Stage] = [
+        Stage('morphology', do_morpology_analysis, ('human', 'machine')),
+        Stage('syntax', do_syntactic_analysis, ('human', 'machine')),
+        Stage('semantics_machine', partial(perform_analysis, fast=fast_semantics), ('machine',)),
+        Stage('semantics_human', partial(perform_analysis, fast=fast_semantics), ('human',)),
+        Stage('semantics', get_separators, ('semantics_machine', 'semantics_human')),
+        Stage('pragmatics', fit_pragmatics, ('human',)),
+        Stage('morphology_votes', get_morphology_results, ('prompts', 'morphology')),
+        Stage('syntax_votes', get_syntactic_results, ('syntax', 'prompts')),
+        Stage('semantics_votes', partial(get_semantic_votes, fast_semantics=fast_semantics), ('semantics', 'prompts')),
+        Stage('pragmatics_votes', get_sentiment_results, ('prompts', 'pragmatics')),
+    ]
+    if drift:
+        stages.append(Stage('drift', partial(get_drift_profile, fast_semantics=fast_semantics),
+                            ('human', 'machine', 'morphology', 'syntax', 'semantics', 'pragmatics')))
+    return stages
+
+
+def train_and_vote(human: List[Doc], machine: List[Doc], prompts: List[Dict[str, Doc | str]],
+                   fast_semantics: bool = False, workers: int = 4, drift: bool = False) -> Tuple[Dict[str, Any], Dict[str, List[str]]]:
+    '''
+    Fit the four analyzers and let them vote on the prompts, with the stages of get_stages running in
+    worker processes, and print the duration of every stage and the critical path
+    param human: List[Doc], the human training data
+    param machine: List[Doc], the machine training data
+    param prompts: List[Dict[str, Doc | str]], the parsed prompts
+    param fast_semantics: bool, whether the semantic analysis estimates the coreference values without fastcoref
+    param workers: int, the amount of worker processes
+    param drift: bool, whether to add the drift profile of the training data
+    return: Tuple[Dict[str, Any], Dict[str, List[str]]], the model like train_detector and the votes like get_analyzer_votes
+    '''
+    # extract the feature arrays once, the forked workers share them with this process
+    for doc in human + machine + [prompt['text'] for prompt in prompts]:
+        get_doc_array(doc) # type: ignore
+
+    stages = get_stages(fast_semantics, drift)
+    results, times = run_stages(stages, {'human': human, 'machine': machine, 'prompts': prompts}, workers)
+    write_schedule(stages, times)
+
+    model: Dict[str, Any] = {analyzer: results[analyzer] for analyzer in ANALYZERS}
+    model['fast_semantics'] = fast_semantics
+    if drift:
+        model['drift'] = results['drift']
+    return model, {analyzer: results[f'{analyzer}_votes'] for analyzer in ANALYZERS}
+
+
+def predict(model: Dict[str, Any], prompts: List[Dict[str, Doc | str]]) -> List[str]:
+    '''
+    Predict for every prompt whether it is written by a human or AI
+    param model: Dict[str, Any], the model from train_detector
+    param prompts: List[Dict[str, Doc | str]], the parsed prompts
+    '''
+    votes = get_analyzer_votes(model, prompts)
+    return [get_predicion(*prompt_votes) for prompt_votes in zip(*votes.values())]
+
+
+def save_model(model: Dict[str, Any], model_path: str) -> None:
+    '''
+    Save a model as json, the file is replaced atomically
+    param model: Dict[str, Any], the model from train_detector
+    param model_path: str, the path to save the model to
+    '''
+    temporary_path: str = f'{model_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump(model, file, indent=2)
+    os.replace(temporary_path, model_path)
+
+
+def load_model(model_path: str) -> Dict[str, Any]:
+    '''
+    Load a model saved with save_model
+    param model_path: str, the path to the saved model
+    '''
+    with open(model_path, 'r') as file:
+        model: Dict[str, Any] = json.load(file)
+
+    # json stores tuples as lists, the analyzers expect tuples
+    for analyzer in ANALYZERS:
+        model[analyzer] = tuple(model[analyzer])
+    return model
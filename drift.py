@@ -0,0 +1,322 @@
+# Program name: drift.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# Drift monitor for the scored texts. The fitted separators of the analyzers go stale when the
+# generators change, so the model stores a profile of the training data: the distribution of the
+# per-text features of every analyzer, as the share of texts in a few quantile bins, and the share
+# of AI votes of every analyzer. The DriftMonitor keeps the same summaries over a rolling window of
+# the scored texts, in fixed-size arrays, and raises an alert when the population stability index
+# (PSI) of a feature or the AI vote share of an analyzer moves too far from the training profile.
+#
+# python3 drift.py prompts.jsonl -m model.json --window 500
+
+# import our modules
+from features import get_doc_array, count_values, TAG_COLUMN
+from morphology import get_text_ratios
+from semantics import perform_analysis_single
+from pragmatics import get_sentiment
+
+# import the supporting packages
+import argparse
+import numpy as np
+from spacy.tokens import Doc
+from typing import Any, Dict, List, Tuple
+
+# the amount of quantile bins per feature and the amount of most common tags the syntax features follow
+BINS: int = 10
+SYNTAX_TAGS: int = 8
+
+# a PSI over 0.1 is a small shift and over 0.2 a large one, an alert is cleared below half its threshold
+PSI_THRESHOLD: float = 0.2
+VOTE_THRESHOLD: float = 0.15
+
+# the smallest share used in the PSI, so an empty bin does not give an infinite value
+MIN_SHARE: float = 0.001
+
+
+def get_document_features(doc: Doc, tags: List[str], fast_semantics: bool = False) -> Dict[str, float]:
+    '''
+    Get the per-text features of the four analyzers, a ratio without a denominator is nan
+    param doc: Doc, the text to get the features of
+    param tags: List[str], the tags of the syntax features
+    param fast_semantics: bool, whether the coreference values are estimated without fastcoref
+    '''
+    token_amount: int = len(get_doc_array(doc))
+    comma_point, token_lemma, token_types = get_text_ratios(doc)
+    tag_counts = count_values(doc, TAG_COLUMN)
+    coref_amount, reference_amount, sentence_amount, NE_amount, verb_amount, synset_amount = perform_analysis_single(doc, fast_semantics)
+    polarity, subjectivity = get_sentiment(doc)
+
+    features: Dict[str, float] = {
+        'tokens': token_amount,
+        'morphology comma-point': comma_point,
+        'morphology token-lemma': token_lemma,
+        'morphology token-types': token_types,
+    }
+    for tag in tags:
+        features[f'syntax {tag}'] = tag_counts.get(tag, 0) / token_amount
+    features['semantics NE-sentence'] = NE_amount / sentence_amount if sentence_amount else np.nan
+    features['semantics references-cluster'] = reference_amount / coref_amount if coref_amount else np.nan
+    features['semantics synsets-verb'] = synset_amount / verb_amount if verb_amount else np.nan
+    features['pragmatics polarity'] = polarity
+    features['pragmatics subjectivity'] = subjectivity
+    return features
+
+
+def get_bins(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    '''
+    Get the bin of every feature value, the edges of a feature are padded with inf
+    param values: np.ndarray, one value per feature, or one row of values per text
+    param edges: np.ndarray, the bin edges, one row per feature
+    return: np.ndarray, the bin of every value, -1 for nan
+    '''
+    bins = (edges <= values[..., None]).sum(axis=-1)
+    return np.where(np.isnan(values), -1, bins)
+
+
+def pad_rows(rows: List[List[float]], value: float) -> np.ndarray:
+    '''
+    Stack rows of different lengths into an array, the short rows are padded
+    param rows: List[List[float]], the rows
+    param value: float, the value to pad with
+    '''
+    array = np.full((len(rows), max([len(row) for row in rows] + [1])), value)
+    for number, row in enumerate(rows):
+        array[number, :len(row)] = row
+    return array
+
+
+def get_training_profile(docs: List[Doc], votes: Dict[str, List[str]], fast_semantics: bool = False, bins: int = BINS) -> Dict[str, Any]:
+    '''
+    Summarize the training data for the DriftMonitor
+    param docs: List[Doc], the human and machine training data
+    param votes: Dict[str, List[str]], the votes of every analyzer on the training data
+    param fast_semantics: bool, whether the coreference values are estimated without fastcoref
+    param bins: int, the amount of quantile bins per feature
+    return: Dict[str, Any], the profile, which is stored in the model
+    '''
+    # follow the tags that are most common over the training data
+    tag_ratios: Dict[str, float] = {}
+    for doc in docs:
+        token_amount = len(get_doc_array(doc))
+        for tag, amount in count_values(doc, TAG_COLUMN).items():
+            tag_ratios[tag] = tag_ratios.get(tag, 0.0) + amount / token_amount
+    tags: List[str] = sorted(tag_ratios, key=lambda tag: -tag_ratios[tag])[:SYNTAX_TAGS]
+
+    rows = [get_document_features(doc, tags, fast_semantics) for doc in docs]
+    names: List[str] = list(rows[0])
+    values = np.array([[row[name] for name in names] for row in rows])
+
+    edges: List[List[float]] = []
+    for column in values.T:
+        column = column[~np.isnan(column)]
+        quantiles = np.quantile(column, np.linspace(0, 1, bins + 1)[1:-1]) if len(column) else []
+        edges.append([float(edge) for edge in np.unique(quantiles)])
+
+    proportions: List[List[float]] = []
+    bin_array = get_bins(values, pad_rows(edges, np.inf))
+    for number, feature_edges in enumerate(edges):
+        column = bin_array[:, number]
+        counts = np.bincount(column[column >= 0], minlength=len(feature_edges) + 1)
+        proportions.append([float(share) for share in counts / max(counts.sum(), 1)])
+
+    return {
+        'features': names,
+        'tags': tags,
+        'edges': edges,
+        'proportions': proportions,
+        'votes': {analyzer: analyzer_votes.count('AI') / len(analyzer_votes) for analyzer, analyzer_votes in votes.items()},
+        'documents': len(docs),
+    }
+
+
+class DriftMonitor:
+    '''
+    Compare the scored texts to the training profile of a model, over a rolling window of texts.
+    The memory is fixed by the window size, and adding a text costs a few small array operations.
+    param model: Dict[str, Any], a model from detector.train_detector, with a drift profile
+    param window: int, the amount of most recent texts that are compared to the training data
+    param min_documents: int, the amount of texts in the window before alerts are raised
+    param psi_threshold: float, the PSI of a feature above which an alert is raised
+    param vote_threshold: float, the change of the AI vote share of an analyzer above which an alert is raised
+    '''
+
+    def __init__(self, model: Dict[str, Any], window: int = 500, min_documents: int = 100,
+                 psi_threshold: float = PSI_THRESHOLD, vote_threshold: float = VOTE_THRESHOLD) -> None:
+        if 'drift' not in model:
+            raise ValueError('The model has no drift profile, train it again with drift=True, or save it with runner.py or fastfit.py')
+        profile: Dict[str, Any] = model['drift']
+        self.fast_semantics: bool = model['fast_semantics']
+        self.names: List[str] = profile['features']
+        self.tags: List[str] = profile['tags']
+        self.analyzers: List[str] = list(profile['votes'])
+        self.edges = pad_rows(profile['edges'], np.inf)
+        self.expected = pad_rows(profile['proportions'], 0.0)
+        self.valid = pad_rows([[1.0] * len(row) for row in profile['proportions']], 0.0) > 0
+        self.expected_votes = np.array([profile['votes'][analyzer] for analyzer in self.analyzers])
+        self.window, self.min_documents = window, min_documents
+        self.psi_threshold, self.vote_threshold = psi_threshold, vote_threshold
+
+        # the bins and AI votes of the texts in the window, a ring buffer, and their running counts
+        self.bins = np.full((window, len(self.names)), -1, dtype=np.int16)
+        self.ai_votes = np.zeros((window, len(self.analyzers)), dtype=bool)
+        self.counts = np.zeros(self.expected.shape, dtype=np.int64)
+        self.vote_counts = np.zeros(len(self.analyzers), dtype=np.int64)
+        self.size: int = 0
+        self.seen: int = 0
+        self.alerts: Dict[str, str] = {}
+
+    def update(self, doc: Doc, votes: Dict[str, str]) -> List[str]:
+        '''
+        Add a scored text to the window
+        param doc: Doc, the scored text
+        param votes: Dict[str, str], the vote of every analyzer on the text
+        return: List[str], the alerts that are raised by this text
+        '''
+        return self.add(get_document_features(doc, self.tags, self.fast_semantics), votes)
+
+    def add(self, features: Dict[str, float], votes: Dict[str, str]) -> List[str]:
+        '''
+        Add the features and votes of a scored text to the window
+        param features: Dict[str, float], the features from get_document_features
+        param votes: Dict[str, str], the vote of every analyzer on the text
+        return: List[str], the alerts that are raised by this text
+        '''
+        columns = np.arange(len(self.names))
+        slot: int = self.seen % self.window
+        if self.size == self.window:
+            old_bins = self.bins[slot]
+            np.subtract.at(self.counts, (columns[old_bins >= 0], old_bins[old_bins >= 0]), 1)
+            self.vote_counts -= self.ai_votes[slot]
+        else:
+            self.size += 1
+
+        new_bins = get_bins(np.array([features[name] for name in self.names], dtype=float), self.edges)
+        np.add.at(self.counts, (columns[new_bins >= 0], new_bins[new_bins >= 0]), 1)
+        self.bins[slot] = new_bins
+        self.ai_votes[slot] = [votes[analyzer] == 'AI' for analyzer in self.analyzers]
+        self.vote_counts += self.ai_votes[slot]
+        self.seen += 1
+        return self.check()
+
+    def get_psi(self) -> np.ndarray:
+        '''
+        Get the population stability index of every feature between the window and the training data
+        '''
+        totals = self.counts.sum(axis=1, keepdims=True)
+        actual = np.maximum(self.counts / np.maximum(totals, 1), MIN_SHARE)
+        expected = np.maximum(self.expected, MIN_SHARE)
+        psi = np.where(self.valid, (actual - expected) * np.log(actual / expected), 0.0).sum(axis=1)
+        return np.where(totals[:, 0] > 0, psi, 0.0)
+
+    def get_vote_rates(self) -> np.ndarray:
+        '''
+        Get the AI vote share of every analyzer in the window
+        '''
+        return self.vote_counts / max(self.size, 1)
+
+    def check(self) -> List[str]:
+        '''
+        Raise the alerts of the features and analyzers that drifted, and clear the ones that are back
+        return: List[str], the alerts that are new
+        '''
+        if self.size < self.min_documents:
+            return []
+
+        measures: List[Tuple[str, float, float, str]] = []
+        for name, psi in zip(self.names, self.get_psi()):
+            measures.append((name, psi, self.psi_threshold, f'{name} drifted, PSI {psi:.3f}'))
+        for analyzer, rate, expected in zip(self.analyzers, self.get_vote_rates(), self.expected_votes):
+            measures.append((f'{analyzer} votes', abs(rate - expected), self.vote_threshold,
+                             f'{analyzer} votes AI for {rate:.0%} of the texts, {expected:.0%} in training'))
+
+        new_alerts: List[str] = []
+        for name, value, threshold, message in measures:
+            if value > threshold and name not in self.alerts:
+                new_alerts.append(f'after {self.seen} texts: {message}')
+            elif value < threshold / 2 and name in self.alerts:
+                del self.alerts[name]
+            if value > threshold or name in self.alerts:
+                self.alerts[name] = message
+        return new_alerts
+
+    def get_metrics(self) -> Dict[str, Any]:
+        '''
+        Get the current drift metrics, to print or to export
+        '''
+        return {
+            'texts': self.seen,
+            'window': self.size,
+            'psi': {name: float(psi) for name, psi in zip(self.names, self.get_psi())},
+            'ai_votes': {analyzer: {'window': float(rate), 'training': float(expected)}
+                         for analyzer, rate, expected in zip(self.analyzers, self.get_vote_rates(), self.expected_votes)},
+            'alerts': list(self.alerts.values()),
+        }
+
+
+def write_metrics(monitor: DriftMonitor) -> None:
+    '''
+    Print the drift metrics of a monitor
+    param monitor: DriftMonitor, the monitor to print the metrics of
+    '''
+    metrics = monitor.get_metrics()
+    print(f'Drift over the last {metrics["window"]} of {metrics["texts"]} texts\n')
+    print(f'{"feature":<32}{"PSI":>8}')
+    for name, psi in metrics['psi'].items():
+        print(f'{name:<32}{psi:>8.3f}')
+    print(f'\n{"analyzer":<32}{"window":>8}{"training":>10}')
+    for analyzer, rates in metrics['ai_votes'].items():
+        print(f'{analyzer + " AI votes":<32}{rates["window"]:>8.0%}{rates["training"]:>10.0%}')
+    print('\nActive alerts:' if metrics['alerts'] else '\nNo active alerts')
+    for alert in metrics['alerts']:
+        print(f'  {alert}')
+
+
+def create_parser():
+    '''
+    Create the parser for the command line arguments
+    '''
+    parser = argparse.ArgumentParser(description='monitor the drift of scored texts from the training data of a model')
+    parser.add_argument('prompt', metavar="prompt data", type=str,
+                        help='Path to the prompt data jsonl file')
+    parser.add_argument('-m', '--model', metavar='<model>', type=str, required=True,
+                        help='Path to a model saved with detector.save_model')
+    parser.add_argument('--window', metavar='<texts>', type=int, default=500,
+                        help='The amount of most recent texts that are compared to the training data')
+    parser.add_argument('--min-texts', metavar='<texts>', type=int, default=100,
+                        help='The amount of texts in the window before alerts are raised')
+    parser.add_argument('--psi', metavar='<threshold>', type=float, default=PSI_THRESHOLD,
+                        help='The PSI of a feature above which an alert is raised')
+    parser.add_argument('--votes', metavar='<threshold>', type=float, default=VOTE_THRESHOLD,
+                        help='The change of the AI vote share of an analyzer above which an alert is raised')
+    parser.add_argument('--batch', metavar='<records>', type=int, default=256,
+                        help='The amount of records that are parsed at once')
+    return parser.parse_args()
+
+
+def main():
+    from detector import load_model, get_analyzer_votes
+    from preprocessor import parse_prompt_data, load_spacy_model, Path
+    from corpus import count_records
+
+    args = create_parser()
+    model = load_model(args.model)
+    monitor = DriftMonitor(model, args.window, args.min_texts, args.psi, args.votes)
+    nlp = load_spacy_model(not model['fast_semantics'])
+
+    # score the prompts in batches of records, like in production, and print the alerts as they are raised
+    record_amount: int = count_records(args.prompt)
+    for start in range(0, record_amount, args.batch):
+        prompts = parse_prompt_data(Path(args.prompt), nlp=nlp, records=(start, min(start + args.batch, record_amount)))
+        votes = get_analyzer_votes(model, prompts)
+        for prompt, prompt_votes in zip(prompts, zip(*votes.values())):
+            for alert in monitor.update(prompt['text'], dict(zip(votes, prompt_votes))): # type: ignore
+                print(alert)
+
+    print()
+    write_metrics(monitor)
+
+
+if __name__ == '__main__':
+    main()
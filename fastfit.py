@@ -0,0 +1,292 @@
+# Program name: fastfit.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# Fast-fit training. The separators of the analyzers are ratios and averages over the training data,
+# and they settle long before every text is parsed. fast_fit draws a random sample of each corpus with
+# reservoir sampling, parses a growing part of it (100, 200, 400, ... texts) and after every step
+# computes a bootstrap confidence interval for every separator and threshold. As soon as all intervals
+# are narrower than the tolerance, the model is fitted on the parsed texts and the rest is never parsed.
+# The bootstrap resamples per-text statistics instead of refitting the analyzers on resampled docs,
+# estimate_separators computes the separators from them the same way the analyzers do.
+#
+# python3 fastfit.py -t human.jsonl group1.jsonl -o model.json --tolerance 0.05
+
+# import our modules
+from __future__ import annotations
+from preprocessor import load_spacy_model, process_data, Path
+from corpus import sample_records, count_records
+
+# import the supporting packages
+import argparse
+import numpy as np
+from typing import Any, Dict, List, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from spacy.language import Language
+    from spacy.tokens import Doc
+
+# the columns of the morphology statistics of a text
+MORPHOLOGY_COLUMNS: Tuple[str, ...] = ('points', 'commas', 'tokens', 'lemmas', 'types')
+
+# syntax tags with a lower measure ratio hardly move the vote, they are reported but not waited for
+MIN_TAG_RATIO: float = 0.01
+
+# the interval of a separator close to zero is compared to this scale instead of to the separator
+MIN_SCALE: float = 0.01
+
+
+class CorpusStatistics:
+    '''
+    The per-text statistics of the parsed texts of a corpus, from which the separators are estimated
+    param fast_semantics: bool, whether the coreference values are estimated without fastcoref
+    '''
+
+    def __init__(self, fast_semantics: bool = False) -> None:
+        self.fast_semantics = fast_semantics
+        self.morphology: List[List[float]] = []
+        self.tags: List[Dict[str, float]] = []
+        self.semantics: List[Tuple[int, int, int, int, int, int]] = []
+        self.sentiment: List[Tuple[float, float]] = []
+
+    def __len__(self) -> int:
+        return len(self.morphology)
+
+    def add(self, docs: List[Doc]) -> None:
+        '''
+        Add the statistics of parsed texts
+        param docs: List[Doc], the parsed texts
+        '''
+        from features import get_doc_array, count_unique, count_values, LEMMA_COLUMN, ORTH_COLUMN, TAG_COLUMN
+        from semantics import perform_analysis_single
+        from pragmatics import get_sentiment
+
+        for doc in docs:
+            token_amount: int = len(get_doc_array(doc))
+            self.morphology.append([doc.text.count('.'), doc.text.count(','), token_amount,
+                                    count_unique(doc, LEMMA_COLUMN), count_unique(doc, ORTH_COLUMN)])
+            self.tags.append({tag: amount / token_amount for tag, amount in count_values(doc, TAG_COLUMN).items()})
+            self.semantics.append(perform_analysis_single(doc, self.fast_semantics))
+            self.sentiment.append(get_sentiment(doc))
+
+    def get_arrays(self, tags: List[str]) -> Dict[str, np.ndarray]:
+        '''
+        Get the statistics as arrays with one row per text
+        param tags: List[str], the tags of the syntax columns, a tag that is not in a text is nan
+        '''
+        return {
+            'morphology': np.array(self.morphology, dtype=float).reshape(-1, len(MORPHOLOGY_COLUMNS)),
+            'syntax': np.array([[ratios.get(tag, np.nan) for tag in tags] for ratios in self.tags], dtype=float).reshape(-1, len(tags)),
+            'semantics': np.array(self.semantics, dtype=float).reshape(-1, 6),
+            'sentiment': np.array(self.sentiment, dtype=float).reshape(-1, 2),
+        }
+
+
+def get_corpus_values(arrays: Dict[str, np.ndarray], rows: np.ndarray) -> Dict[str, np.ndarray]:
+    '''
+    Compute the values of one corpus that the separators are the midpoints of, for some of its texts,
+    like morphology.calculate_ratios, syntax.calculate_average_ratios and semantics.perform_analysis do
+    param arrays: Dict[str, np.ndarray], the statistics from CorpusStatistics.get_arrays
+    param rows: np.ndarray, the texts to use, a text can be used more than once
+    '''
+    points, commas, tokens, lemmas, types = arrays['morphology'][rows].sum(axis=0)
+    coref, references, sentences, NEs, verbs, synsets = arrays['semantics'][rows].sum(axis=0)
+    tag_ratios = arrays['syntax'][rows]
+    tag_amounts = (~np.isnan(tag_ratios)).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'morphology': np.array([commas / points, tokens / lemmas, tokens / types]),
+            'syntax': np.where(tag_amounts > 0, np.nansum(tag_ratios, axis=0) / tag_amounts, np.nan),
+            'semantics': np.array([NEs / sentences, references / coref, synsets / verbs]),
+        }
+
+
+def estimate_separators(human: Dict[str, np.ndarray], machine: Dict[str, np.ndarray], tags: List[str],
+                        human_rows: np.ndarray, machine_rows: np.ndarray) -> Dict[str, float]:
+    '''
+    Estimate every separator and threshold of the analyzers from the statistics of some texts
+    param human: Dict[str, np.ndarray], the statistics of the human texts
+    param machine: Dict[str, np.ndarray], the statistics of the machine texts
+    param tags: List[str], the tags of the syntax columns
+    param human_rows, machine_rows: np.ndarray, the texts to use
+    return: Dict[str, float], the separators by name
+    '''
+    human_values = get_corpus_values(human, human_rows)
+    machine_values = get_corpus_values(machine, machine_rows)
+    separators: Dict[str, float] = {}
+
+    for name, human_value, machine_value in zip(('comma-point', 'token-lemma', 'token-types'), human_values['morphology'], machine_values['morphology']):
+        separators[f'morphology {name}'] = (human_value + machine_value) / 2
+    for tag, human_value, machine_value in zip(tags, human_values['syntax'], machine_values['syntax']):
+        separators[f'syntax {tag}'] = (human_value + machine_value) / 2
+    for name, human_value, machine_value in zip(('NE-sentence', 'references-cluster', 'synsets-verb'), human_values['semantics'], machine_values['semantics']):
+        separators[f'semantics {name}'] = (human_value + machine_value) / 2
+
+    # the pragmatic thresholds are the extremes of the human texts, which start from 0 in do_sentiment_analysis
+    polarity, subjectivity = human['sentiment'][human_rows].T
+    separators['pragmatics max-polarity'] = float(polarity.max(initial=0.0))
+    separators['pragmatics min-polarity'] = float(polarity.min(initial=0.0))
+    separators['pragmatics max-subjectivity'] = float(subjectivity.max(initial=0.0))
+    separators['pragmatics min-subjectivity'] = float(subjectivity.min(initial=0.0))
+    return separators
+
+
+def bootstrap_intervals(human: Dict[str, np.ndarray], machine: Dict[str, np.ndarray], tags: List[str], rounds: int,
+                        generator: np.random.Generator, confidence: float = 0.95) -> Dict[str, Tuple[float, float]]:
+    '''
+    Compute a bootstrap confidence interval for every separator, by resampling the texts of both corpora
+    param human, machine: Dict[str, np.ndarray], the statistics of the human and the machine texts
+    param tags: List[str], the tags of the syntax columns
+    param rounds: int, the amount of bootstrap samples
+    param generator: np.random.Generator, the random generator
+    param confidence: float, the confidence level of the intervals
+    '''
+    human_amount, machine_amount = len(human['morphology']), len(machine['morphology'])
+    samples: Dict[str, List[float]] = {}
+    for _ in range(rounds):
+        separators = estimate_separators(human, machine, tags, generator.integers(0, human_amount, human_amount),
+                                         generator.integers(0, machine_amount, machine_amount))
+        for name, value in separators.items():
+            samples.setdefault(name, []).append(value)
+
+    intervals: Dict[str, Tuple[float, float]] = {}
+    tail: float = (1 - confidence) / 2 * 100
+    for name, values in samples.items():
+        finite = np.array(values)[np.isfinite(values)]
+        intervals[name] = (float(np.percentile(finite, tail)), float(np.percentile(finite, 100 - tail))) if len(finite) else (np.nan, np.nan)
+    return intervals
+
+
+def get_relative_width(estimate: float, interval: Tuple[float, float]) -> float:
+    '''
+    Get the half width of a confidence interval relative to its separator
+    param estimate: float, the separator
+    param interval: Tuple[float, float], the confidence interval of the separator
+    '''
+    low, high = interval
+    if not np.isfinite(estimate) or not np.isfinite(low) or not np.isfinite(high):
+        return np.inf
+    return (high - low) / 2 / max(abs(estimate), MIN_SCALE)
+
+
+def is_tracked(name: str, estimate: float) -> bool:
+    '''
+    Whether fast_fit waits for the interval of a separator, rare syntax tags are only reported
+    param name: str, the name of the separator
+    param estimate: float, the separator
+    '''
+    return not name.startswith('syntax ') or (np.isfinite(estimate) and estimate >= MIN_TAG_RATIO)
+
+
+def write_intervals(estimates: Dict[str, float], intervals: Dict[str, Tuple[float, float]]) -> None:
+    '''
+    Print every separator with its confidence interval
+    param estimates: Dict[str, float], the separators
+    param intervals: Dict[str, Tuple[float, float]], the confidence intervals of the separators
+    '''
+    print(f'{"separator":<32}{"value":>10}{"low":>10}{"high":>10}{"width":>8}')
+    for name, estimate in estimates.items():
+        low, high = intervals[name]
+        width = get_relative_width(estimate, (low, high))
+        print(f'{name:<32}{estimate:>10.4f}{low:>10.4f}{high:>10.4f}{width:>8.1%}{"" if is_tracked(name, estimate) else " (not tracked)"}')
+
+
+def fast_fit(human_path: Path, machine_path: Path, nlp: Language, fast_semantics: bool = False, tolerance: float = 0.05,
+             start: int = 100, growth: float = 2.0, max_size: int = 10000, rounds: int = 100, seed: int = 0,
+             drift: bool = False) -> Dict[str, Any]:
+    '''
+    Fit the detector on a growing random sample of the training data, until the separators are stable
+    param human_path, machine_path: Path, the paths to the human and machine training data
+    param nlp: Language, the loaded spacy model
+    param fast_semantics: bool, whether the semantic analysis estimates the coreference values without fastcoref
+    param tolerance: float, the largest half width of a 95% interval, relative to its separator
+    param start: int, the amount of texts per corpus of the first step
+    param growth: float, how many times larger every next step is
+    param max_size: int, the size of the random sample of each corpus, the most texts that are parsed
+    param rounds: int, the amount of bootstrap samples per step
+    param seed: int, the seed of the random sample and the bootstrap
+    param drift: bool, whether to add the drift profile of the parsed sample, see detector.get_drift_profile
+    return: Dict[str, Any], the model, like detector.train_detector, with the confidence intervals
+    '''
+    from detector import train_detector
+
+    generator = np.random.default_rng(seed)
+    samples = [sample_records(human_path, max_size, seed), sample_records(machine_path, max_size, seed + 1)]
+    docs: List[List[Doc]] = [[], []]
+    statistics = [CorpusStatistics(fast_semantics), CorpusStatistics(fast_semantics)]
+    parsed: List[int] = [0, 0]
+
+    print(f'{"human":>8}{"machine":>8}{"unstable":>10}  widest interval')
+    size: int = start
+    while True:
+        # parse the next part of the sample of both corpora
+        for corpus in range(2):
+            new_docs = process_data(samples[corpus][parsed[corpus]:size], nlp)
+            statistics[corpus].add(new_docs)
+            docs[corpus].extend(new_docs)
+            parsed[corpus] = min(size, len(samples[corpus]))
+
+        tags: List[str] = sorted(set(tag for corpus in statistics for ratios in corpus.tags for tag in ratios))
+        human, machine = [corpus.get_arrays(tags) for corpus in statistics]
+        estimates = estimate_separators(human, machine, tags, np.arange(len(human['morphology'])), np.arange(len(machine['morphology'])))
+        intervals = bootstrap_intervals(human, machine, tags, rounds, generator)
+        widths = {name: get_relative_width(estimate, intervals[name]) for name, estimate in estimates.items() if is_tracked(name, estimate)}
+        unstable = [name for name, width in widths.items() if width > tolerance]
+        widest = max(widths, key=lambda name: widths[name])
+        print(f'{len(docs[0]):>8}{len(docs[1]):>8}{len(unstable):>10}  {widest} ({widths[widest]:.1%})')
+
+        if not unstable:
+            print(f'\nAll separators are within {tolerance:.0%} after {len(docs[0])} human and {len(docs[1])} machine texts')
+            break
+        if parsed[0] == len(samples[0]) and parsed[1] == len(samples[1]):
+            print(f'\nThe sample is used up, {len(unstable)} separators are not within {tolerance:.0%}, use a larger --max-size')
+            break
+        size = int(size * growth)
+
+    record_amount: int = count_records(human_path) + count_records(machine_path)
+    print(f'{len(docs[0]) + len(docs[1])} of {record_amount} training texts are parsed\n')
+    write_intervals(estimates, intervals)
+
+    model = train_detector(docs[0], docs[1], fast_semantics, drift)
+    model['intervals'] = {name: list(interval) for name, interval in intervals.items()}
+    return model
+
+
+def create_parser():
+    '''
+    Create the parser for the command line arguments
+    '''
+    parser = argparse.ArgumentParser(description='fit the detector on a growing sample of the training data')
+    parser.add_argument('-t', '--training', metavar=('<human_data>', '<machine_data>'), nargs=2, type=str,
+                        default=['human.jsonl', 'group1.jsonl'], help='Path to the human and machine data jsonl file')
+    parser.add_argument('-o', '--output', metavar='<model>', type=str, required=True,
+                        help='Path to save the model to')
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help='The largest half width of a 95%% interval, relative to its separator')
+    parser.add_argument('--start', metavar='<texts>', type=int, default=100,
+                        help='The amount of texts per corpus of the first step')
+    parser.add_argument('--growth', type=float, default=2.0,
+                        help='How many times larger every next step is')
+    parser.add_argument('--max-size', metavar='<texts>', type=int, default=10000,
+                        help='The most texts per corpus that are parsed')
+    parser.add_argument('--bootstrap', metavar='<rounds>', type=int, default=100,
+                        help='The amount of bootstrap samples per step')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of the random sample and the bootstrap')
+    parser.add_argument('--fast-semantics', action='store_true',
+                        help='Estimate the coreference values without fastcoref, see semantics.estimate_coreference')
+    return parser.parse_args()
+
+
+def main():
+    from detector import save_model
+
+    args = create_parser()
+    nlp = load_spacy_model(not args.fast_semantics)
+    model = fast_fit(Path(args.training[0]), Path(args.training[1]), nlp, args.fast_semantics, args.tolerance,
+                     args.start, args.growth, args.max_size, args.bootstrap, args.seed, drift=True)
+    save_model(model, args.output)
+    print(f'\nThe model is saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
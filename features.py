@@ -0,0 +1,100 @@
+# Program name: features.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# Shared extraction layer for the analyzers. Every analyzer needs the same handful of token
+# attributes, so instead of looking them up token by token through Python attributes
+# (token.tag_, token.pos_, ...) we pull them out of the Doc once with Doc.to_array and
+# let the analyzers work on the NumPy columns.
+
+# import the supporting packages
+from typing import Dict, List
+import numpy as np
+
+# import the necessary packages
+from spacy.attrs import TAG, POS, LEMMA, ORTH, ENT_IOB, SENT_START # type: ignore
+from spacy.symbols import VERB # type: ignore
+from spacy.tokens import Doc
+
+# the attributes that are extracted, in column order
+ATTRIBUTES: List[int] = [TAG, POS, LEMMA, ORTH, ENT_IOB, SENT_START]
+TAG_COLUMN, POS_COLUMN, LEMMA_COLUMN, ORTH_COLUMN, ENT_IOB_COLUMN, SENT_START_COLUMN = range(len(ATTRIBUTES))
+
+# the ENT_IOB code of the first token of an entity (0 = unset, 1 = I, 2 = O, 3 = B)
+ENT_IOB_BEGIN = 3
+
+# the key under which the extracted array is cached in doc.user_data
+ARRAY_KEY = 'pta_array'
+
+
+def get_doc_array(doc: Doc) -> np.ndarray:
+    '''
+    Get the attribute array of a doc, extracting it on first use
+    param doc: Doc, the doc to get the attribute array of
+    return: np.ndarray, one row per token and one column per attribute in ATTRIBUTES
+    '''
+    array = doc.user_data.get(ARRAY_KEY)
+    if array is None:
+        array = doc.to_array(ATTRIBUTES)
+        doc.user_data[ARRAY_KEY] = array
+    return array
+
+
+def get_doc_arrays(docs: List[Doc]) -> List[np.ndarray]:
+    '''
+    Get the attribute arrays of a batch of docs
+    param docs: List[Doc], the docs to get the attribute arrays of
+    '''
+    return [get_doc_array(doc) for doc in docs]
+
+
+def count_values(doc: Doc, column: int) -> Dict[str, int]:
+    '''
+    Count how often every value of a column occurs in a doc
+    param doc: Doc, the doc to count the values of
+    param column: int, the column of the attribute array to count, for example TAG_COLUMN
+    return: Dict[str, int], the string value mapped to its frequency
+    '''
+    values, counts = np.unique(get_doc_array(doc)[:, column], return_counts=True)
+    return {doc.vocab.strings[int(value)]: int(count) for value, count in zip(values, counts)}
+
+
+def count_unique(doc: Doc, column: int) -> int:
+    '''
+    Count the number of different values of a column in a doc, for example the number of types
+    param doc: Doc, the doc to count the values of
+    param column: int, the column of the attribute array to count
+    '''
+    return len(np.unique(get_doc_array(doc)[:, column]))
+
+
+def count_sentences(doc: Doc) -> int:
+    '''
+    Count the sentences in a doc, the same way Doc.sents splits them
+    param doc: Doc, the doc to count the sentences of
+    '''
+    array = get_doc_array(doc)
+    if not len(array):
+        return 0
+
+    # the first token always starts a sentence, the others only when SENT_START is 1
+    return 1 + int(np.count_nonzero(array[1:, SENT_START_COLUMN] == 1))
+
+
+def count_entities(doc: Doc) -> int:
+    '''
+    Count the named entities in a doc, every entity starts with exactly one B token
+    param doc: Doc, the doc to count the named entities of
+    '''
+    return int(np.count_nonzero(get_doc_array(doc)[:, ENT_IOB_COLUMN] == ENT_IOB_BEGIN))
+
+
+def get_verb_lemmas(doc: Doc) -> Dict[str, int]:
+    '''
+    Get the lemmas of the verbs in a doc with their frequency
+    param doc: Doc, the doc to get the verb lemmas of
+    '''
+    array = get_doc_array(doc)
+    verb_lemmas = array[array[:, POS_COLUMN] == VERB, LEMMA_COLUMN]
+    values, counts = np.unique(verb_lemmas, return_counts=True)
+    return {doc.vocab.strings[int(value)]: int(count) for value, count in zip(values, counts)}
@@ -0,0 +1,278 @@
+# Program name: localization.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# Span-level localization: which parts of a text look machine-written.
+# The feature counts of the analyzers are computed once per sentence and stored as cumulative
+# (prefix-sum) arrays, so the counts of any window of sentences are a subtraction away and every
+# window is classified in O(1) with the thresholds of the trained model, without running the
+# analyses again on every span. The amount of different lemmas and types in a window can not be
+# summed, so for every token the sentence of the previous token with the same value is stored, and
+# a window counts the tokens whose previous occurrence lies before it.
+
+# import our modules
+from features import get_doc_array, POS_COLUMN, LEMMA_COLUMN, ORTH_COLUMN, TAG_COLUMN, ENT_IOB_COLUMN, SENT_START_COLUMN, ENT_IOB_BEGIN
+from morphology import morphology_decider
+from syntax import human_machine_decider
+from semantics import semantic_decider, count_verb_synsets, estimate_coreference_clusters
+from pragmatics import pragmatic_decider
+from detector import get_predicion
+from sentiment import get_sentence_assessments
+
+# import the supporting packages
+import re
+import numpy as np
+from spacy.attrs import IDX # type: ignore
+from spacy.symbols import VERB # type: ignore
+from spacy.tokens import Doc
+from typing import Any, Dict, List, Tuple
+
+# paragraphs are separated by an empty line
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+
+
+def prefix_sum(values: np.ndarray) -> np.ndarray:
+    '''
+    Cumulative sum with a leading zero, so the sum of sentences first..last-1 is prefix[last] - prefix[first]
+    param values: np.ndarray, one value (or row of values) per sentence
+    '''
+    zero = np.zeros((1,) + values.shape[1:], dtype=np.float64)
+    return np.concatenate([zero, np.cumsum(values, axis=0, dtype=np.float64)])
+
+
+def distinct_index(values: np.ndarray, sentence_of: np.ndarray, sentence_amount: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Index the values so the different values of any window of sentences can be counted.
+    A value counts for a window starting at sentence a when the previous occurrence of the same value
+    lies before sentence a, so only the sentence of that previous occurrence is stored, in O(tokens)
+    memory instead of a table for every (first, last) sentence pair.
+    param values: np.ndarray, the value of every token, for example its lemma hash
+    param sentence_of: np.ndarray, the sentence of every token
+    param sentence_amount: int, the amount of sentences
+    return: Tuple[np.ndarray, np.ndarray], the sentence of the previous occurrence of every value, -1 when
+            there is none, ordered by sentence, and where the values of every sentence start, see count_distinct
+    '''
+    # order the values by their sentence, the coreference mentions are ordered by their cluster
+    position = np.argsort(sentence_of, kind='stable')
+    values, sentence_of = values[position], sentence_of[position]
+
+    # find the sentence of the previous occurrence of the same value, -1 when there is none
+    order = np.argsort(values, kind='stable')
+    sorted_values, sorted_sentences = values[order], sentence_of[order]
+    previous_sorted = np.full(len(values), -1, dtype=np.int64)
+    same = sorted_values[1:] == sorted_values[:-1]
+    previous_sorted[1:][same] = sorted_sentences[:-1][same]
+    previous = np.empty_like(previous_sorted)
+    previous[order] = previous_sorted
+
+    return previous, np.searchsorted(sentence_of, np.arange(sentence_amount + 1), side='left')
+
+
+def count_distinct(index: Tuple[np.ndarray, np.ndarray], first: int, last: int) -> int:
+    '''
+    Count the different values in the sentences first..last-1, in O(values in the window)
+    param index: Tuple[np.ndarray, np.ndarray], the index from distinct_index
+    param first: int, the first sentence of the window
+    param last: int, the sentence after the last sentence of the window
+    '''
+    previous, starts = index
+    return int(np.count_nonzero(previous[starts[first]:starts[last]] < first))
+
+
+def get_coreference_mentions(doc: Doc, fast: bool) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Get the first token of every coreference mention with the cluster it belongs to
+    param doc: Doc, the doc to get the mentions of
+    param fast: bool, whether to estimate the clusters without fastcoref, see semantics.estimate_coreference_clusters
+    return: Tuple[np.ndarray, np.ndarray], the token index and the cluster number of every mention
+    '''
+    if fast:
+        clusters: List[List[int]] = estimate_coreference_clusters(doc)
+    else:
+        # fastcoref gives the mentions as character offsets
+        token_starts = doc.to_array([IDX]).ravel()
+        clusters = [[int(np.searchsorted(token_starts, start, side='right')) - 1 for start, _ in cluster]
+                    for cluster in doc._.coref_clusters]
+
+    tokens = [token for cluster in clusters for token in cluster]
+    cluster_numbers = [number for number, cluster in enumerate(clusters) for _ in cluster]
+    return np.array(tokens, dtype=np.int64), np.array(cluster_numbers, dtype=np.int64)
+
+
+def get_sentence_sentiment(doc: Doc) -> np.ndarray:
+    '''
+    Get the summed polarity, summed subjectivity and amount of sentiment assessments of every sentence,
+    so the polarity of a window is its summed polarity divided by its amount of assessments, like TextBlob does
+    param doc: Doc, the doc to get the sentiment of
+    return: np.ndarray, one row (polarity, subjectivity, assessments) per sentence
+    '''
+    if Doc.has_extension('polarity') and doc._.polarity is not None:
+        return get_sentence_assessments(doc)
+
+    sentiment = []
+    for sentence in doc.sents:
+        assessments = sentence._.blob.sentiment_assessments.assessments
+        sentiment.append((sum(assessment[1] for assessment in assessments),
+                          sum(assessment[2] for assessment in assessments),
+                          len(assessments)))
+    return np.array(sentiment, dtype=np.float64).reshape(-1, 3)
+
+
+def get_sentence_features(doc: Doc, fast: bool = False) -> Dict[str, Any]:
+    '''
+    Compute the feature counts of every sentence of a doc once, as prefix sums
+    param doc: Doc, the doc to compute the features of
+    param fast: bool, whether to estimate the coreference clusters without fastcoref
+    return: Dict[str, Any], the prefix sums and distinct indexes used by classify_window
+    '''
+    array = get_doc_array(doc)
+    is_start = array[:, SENT_START_COLUMN] == 1
+    if len(array):
+        is_start[0] = True
+    sentence_of = np.cumsum(is_start) - 1
+    sentence_amount = int(is_start.sum())
+    sentence_starts = np.flatnonzero(is_start)
+
+    # character offsets of the sentences, a sentence ends where the next one starts
+    token_starts = doc.to_array([IDX]).ravel()
+    start_chars = token_starts[sentence_starts].astype(np.int64)
+    end_chars = np.append(start_chars[1:], len(doc.text))
+
+    def per_sentence(weights: np.ndarray | None = None) -> np.ndarray:
+        return np.bincount(sentence_of, weights=weights, minlength=sentence_amount)
+
+    # morphology: punctuation in the sentence text, tokens, and different lemmas and types
+    punctuation = np.array([(doc.text[start:end].count(','), doc.text[start:end].count('.'))
+                            for start, end in zip(start_chars, end_chars)], dtype=np.float64).reshape(-1, 2)
+
+    # syntax: the frequency of every tag
+    tags, tag_of = np.unique(array[:, TAG_COLUMN], return_inverse=True)
+    tag_counts = np.zeros((sentence_amount, len(tags)), dtype=np.float64)
+    np.add.at(tag_counts, (sentence_of, tag_of.ravel()), 1)
+
+    # semantics: named entities, verbs with their synsets and coreference mentions
+    is_verb = array[:, POS_COLUMN] == VERB
+    verb_lemmas, verb_lemma_of = np.unique(array[is_verb, LEMMA_COLUMN], return_inverse=True)
+    synsets_per_lemma = np.array([count_verb_synsets(doc.vocab.strings[int(lemma)]) for lemma in verb_lemmas], dtype=np.float64)
+    synsets = np.zeros(len(array), dtype=np.float64)
+    synsets[is_verb] = synsets_per_lemma[verb_lemma_of.ravel()] if len(verb_lemmas) else 0
+    mention_tokens, mention_clusters = get_coreference_mentions(doc, fast)
+    mention_sentences = sentence_of[mention_tokens] if len(mention_tokens) else mention_tokens
+
+    return {
+        'sentence_amount': sentence_amount,
+        'start_chars': start_chars,
+        'end_chars': end_chars,
+        'tags': [doc.vocab.strings[int(tag)] for tag in tags],
+        'tokens': prefix_sum(per_sentence().astype(np.float64)),
+        'punctuation': prefix_sum(punctuation),
+        'lemma_types': distinct_index(array[:, LEMMA_COLUMN], sentence_of, sentence_amount),
+        'types': distinct_index(array[:, ORTH_COLUMN], sentence_of, sentence_amount),
+        'tag_counts': prefix_sum(tag_counts),
+        'entities': prefix_sum(per_sentence((array[:, ENT_IOB_COLUMN] == ENT_IOB_BEGIN).astype(np.float64))),
+        'verbs': prefix_sum(per_sentence(is_verb.astype(np.float64))),
+        'synsets': prefix_sum(per_sentence(synsets)),
+        'references': prefix_sum(np.bincount(mention_sentences, minlength=sentence_amount).astype(np.float64)),
+        'clusters': distinct_index(mention_clusters, mention_sentences, sentence_amount),
+        'sentiment': prefix_sum(get_sentence_sentiment(doc)),
+    }
+
+
+def classify_window(features: Dict[str, Any], model: Dict[str, Any], first: int, last: int) -> Dict[str, Any]:
+    '''
+    Classify the sentences first..last-1 of a doc with the thresholds of the model, in O(1) for the
+    pragmatics, in O(tags) for the syntax and in O(tokens in the window) for the different lemmas,
+    types and coreference clusters of the morphology and semantics
+    param features: Dict[str, Any], the sentence features from get_sentence_features
+    param model: Dict[str, Any], the model from detector.train_detector
+    param first: int, the first sentence of the window
+    param last: int, the sentence after the last sentence of the window
+    return: Dict[str, Any], the character span of the window, the vote of every analyzer and the prediction
+    '''
+    def window(name: str) -> Any:
+        return features[name][last] - features[name][first]
+
+    # morphology
+    tokens = window('tokens')
+    commas, points = window('punctuation')
+    morphology = morphology_decider(commas / (points + 0.0001), tokens / count_distinct(features['lemma_types'], first, last),
+                                    tokens / count_distinct(features['types'], first, last), model['morphology'])
+
+    # syntax
+    unknown_average_ratios = {tag: count / tokens for tag, count in zip(features['tags'], window('tag_counts')) if count}
+    syntax = human_machine_decider(*model['syntax'], unknown_average_ratios)
+
+    # semantics
+    values = (count_distinct(features['clusters'], first, last), int(window('references')), last - first,
+              int(window('entities')), int(window('verbs')), int(window('synsets')))
+    semantics = semantic_decider(values, model['semantics'])[0] # type: ignore
+
+    # pragmatics
+    polarity, subjectivity, assessments = window('sentiment')
+    chance = pragmatic_decider(polarity / (assessments or 1), subjectivity / (assessments or 1), model['pragmatics'])
+    pragmatics = 'AI' if chance > 0.0 else 'Human'
+
+    return {
+        'start_char': int(features['start_chars'][first]),
+        'end_char': int(features['end_chars'][last - 1]),
+        'morphology': morphology,
+        'syntax': syntax,
+        'semantics': semantics,
+        'pragmatics': pragmatics,
+        'prediction': get_predicion(morphology, syntax, semantics, pragmatics),
+    }
+
+
+def get_paragraph_windows(doc: Doc, features: Dict[str, Any]) -> List[Tuple[int, int]]:
+    '''
+    Get the sentence windows of the paragraphs of a doc, a sentence belongs to the paragraph it starts in
+    param doc: Doc, the doc to split into paragraphs
+    param features: Dict[str, Any], the sentence features from get_sentence_features
+    return: List[Tuple[int, int]], the first and the after-last sentence of every paragraph
+    '''
+    paragraph_starts = [0] + [match.end() for match in PARAGRAPH_BREAK.finditer(doc.text)]
+    bounds = np.searchsorted(features['start_chars'], paragraph_starts, side='left').tolist()
+    bounds.append(features['sentence_amount'])
+    return [(first, last) for first, last in zip(bounds, bounds[1:]) if first < last]
+
+
+def get_sliding_windows(features: Dict[str, Any], size: int) -> List[Tuple[int, int]]:
+    '''
+    Get every window of size consecutive sentences
+    param features: Dict[str, Any], the sentence features from get_sentence_features
+    param size: int, the amount of sentences per window
+    '''
+    sentence_amount: int = features['sentence_amount']
+    size = max(1, min(size, sentence_amount))
+    return [(first, first + size) for first in range(sentence_amount - size + 1)]
+
+
+def localize(doc: Doc, model: Dict[str, Any], window: int | None = None) -> List[Dict[str, Any]]:
+    '''
+    Classify the parts of a doc
+    param doc: Doc, the doc to localize the machine-written parts of
+    param model: Dict[str, Any], the model from detector.train_detector
+    param window: int, the amount of sentences per sliding window, by default the paragraphs are classified
+    return: List[Dict[str, Any]], the classified windows, see classify_window
+    '''
+    if not len(doc):
+        return []
+    features = get_sentence_features(doc, model['fast_semantics'])
+    windows = get_paragraph_windows(doc, features) if window is None else get_sliding_windows(features, window)
+    return [classify_window(features, model, first, last) for first, last in windows]
+
+
+def write_localization(model: Dict[str, Any], prompts: List[Dict[str, Doc | str]], window: int | None = None) -> None:
+    '''
+    Print the classified parts of every prompt
+    param model: Dict[str, Any], the model from detector.train_detector
+    param prompts: List[Dict[str, Doc | str]], the parsed prompts
+    param window: int, the amount of sentences per sliding window, by default the paragraphs are classified
+    '''
+    for number, prompt in enumerate(prompts):
+        doc: Doc = prompt['text'] # type: ignore
+        print(f'text{number:0>3}: {prompt.get("id", "")}')
+        for part in localize(doc, model, window):
+            excerpt = doc.text[part['start_char']:part['end_char']].strip().replace('\n', ' ')
+            print(f'  {part["start_char"]:>6}-{part["end_char"]:<6} {part["prediction"]:6} {excerpt[:60]}')
+        print('')
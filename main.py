@@ -4,46 +4,23 @@
 
 # Jasper #
 
-# import our modules
-from preprocessor import get_and_parse_texts, parse_prompt_data, Path
-from pragmatics import do_sentiment_analysis, get_sentiment_results
-from morphology import do_morpology_analysis, get_morphology_results
-from syntax import do_syntactic_analysis, get_syntactic_results
-from semantics import do_semantic_analysis, get_semantic_results
+# import our modules, the analysis modules import spacy, so they are imported by the functions that use them
+from __future__ import annotations
+from preprocessor import get_and_parse_texts, parse_prompt_data, load_spacy_model, tune_batch_size, Path, COREF_MODELS, SENTIMENT_COMPONENTS
+from corpus import parse_record_range, sample_records, CORPUS_SUFFIXES
+from preparsed import PARSED_SUFFIXES, is_preparsed
 
 # import the supporting packages
 import argparse
 import os
 from collections import Counter
-from sklearn.metrics import classification_report, confusion_matrix
-from spacy.tokens import Doc
-from typing import NewType, Tuple, List
+from typing import NewType, List, TYPE_CHECKING
+if TYPE_CHECKING:
+    from spacy.tokens import Doc
 Error = NewType('Error', str)
 
-
-def get_predicion(morph: str, syn: str, sam: str, prag: str) -> str:
-    score: float = 0.0
-    if morph == 'AI':
-        score += 0.66
-    elif morph == 'Human':
-        score -= 0.78
-
-    if syn == 'AI':
-        score += 0.97
-    elif syn == 'Human':
-        score -= 0.73
-
-    if sam == 'AI':
-        score += 0.59
-    elif sam == 'Human':
-        score -= 0.46
-
-    if prag == 'AI':
-        score += 0.98
-    elif prag == 'Human':
-        score -= 0.53
-
-    return 'AI' if score > 0.0 else 'Human'
+# the amount of training texts the batch size is tuned on
+TUNING_SAMPLE: int = 1000
 
 
 def create_final_predictions(*results: List[str], true_labels: List[str]) -> None:
@@ -53,6 +30,9 @@ def create_final_predictions(*results: List[str], true_labels: List[str]) -> Non
     param true_labels: List[str], the true labels of the data
     '''
 
+    from detector import get_predicion
+    from sklearn.metrics import classification_report, confusion_matrix
+
     final_predictions: List[str] = []
     for idx in range(len(results[0])):
         morph, syn, sam, prag = results[0][idx], results[1][idx], results[2][idx], results[3][idx]
@@ -76,6 +56,8 @@ def make_report(true_labels: List[str], pred_labels: List[str], by: str) -> None
     param pred_labels: List[str], the predicted labels of the data
     '''
 
+    from sklearn.metrics import classification_report, confusion_matrix
+
     print(f'The report for the {by} results are: \n')
     print(classification_report(true_labels, pred_labels))
     matrix = confusion_matrix(true_labels, pred_labels)
@@ -95,9 +77,53 @@ def create_parser():
                         help='Path to the human and machine data jsonl file')
     parser.add_argument('prompt', metavar="prompt data", type=str,
                         help='Path to the prompt data jsonl file')
+    parser.add_argument('--fast-semantics', action='store_true',
+                        help='Estimate the coreference values without fastcoref, see semantics.estimate_coreference')
+    parser.add_argument('--coref-model', choices=list(COREF_MODELS), default='FCoref',
+                        help='The fastcoref model, FCoref is fast, LingMessCoref is more accurate')
+    parser.add_argument('--coref-max-tokens', metavar='<tokens>', type=int, default=10000,
+                        help='The maximum amount of tokens fastcoref puts in one batch')
+    parser.add_argument('--device', type=str, default=None,
+                        help='The device fastcoref runs on, for example cpu or cuda:0')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='The amount of cpu threads fastcoref may use')
+    parser.add_argument('--sentiment', choices=list(SENTIMENT_COMPONENTS), default='lexicon',
+                        help='The sentiment component, lexicon is a fast version of textblob with the same results')
+    parser.add_argument('--batch-size', metavar='<size>', type=parse_batch_size, default=None,
+                        help='The batch size for nlp.pipe, or auto to tune it on a sample of the training data, '
+                             'by default the batch size of the spacy model')
+    parser.add_argument('--stream', action='store_true',
+                        help='Parse the training texts while the files are read and decompressed, instead of loading them first')
+    parser.add_argument('--records', metavar='<start:stop>', type=parse_record_range, default=None,
+                        help='Only score these prompt records, a number like 17 or a range like 1000:2000')
+    parser.add_argument('--localize', action='store_true',
+                        help='Also classify the paragraphs of every prompt, to find the machine-written parts')
+    parser.add_argument('--window', metavar='<sentences>', type=int, default=None,
+                        help='Classify sliding windows of this many sentences instead of paragraphs with --localize')
+    parser.add_argument('--fast-fit', action='store_true',
+                        help='Fit the analyzers on a growing sample of the training data until the separators are stable, see fastfit.py')
+    parser.add_argument('--drift', action='store_true',
+                        help='Compare the prompts to the training data and print the drift alerts, see drift.py')
+    parser.add_argument('--dedup', choices=['drop', 'flag'], default=None,
+                        help='Drop the near-duplicate texts before they are parsed, or flag the prompts that are near-duplicates '
+                             'of the training data and also report the scores without them, see dedup.py')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Train the analyzers and let them vote in this many worker processes, see detector.train_and_vote')
     return parser.parse_args()
 
 
+def parse_batch_size(value: str) -> str | int:
+    '''
+    Check the batch size argument, which is either auto or a positive number
+    param value: str, the value given on the command line
+    '''
+    if value == 'auto':
+        return value
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(f'{value}, the batch size must be auto or a positive number')
+    return int(value)
+
+
 def check_file(data_path: Path) -> None | Error:
     '''
     Check if the given files exist and is of the correct type
@@ -105,14 +131,16 @@ def check_file(data_path: Path) -> None | Error:
     '''
     if not os.path.exists(data_path):
         raise FileNotFoundError(f'{data_path} does not exist')
-    if not data_path.endswith('.jsonl'):
-        raise ValueError(f'{data_path}, File must be a .jsonl file')
+    if not data_path.endswith(CORPUS_SUFFIXES + PARSED_SUFFIXES):
+        raise ValueError(f'{data_path}, File must be a .jsonl file, a compressed .jsonl.gz, .jsonl.xz or .jsonl.zst file, '
+                         'or a pre-parsed .spacy or .conllu file')
 
 
-def test_data(data: Doc) -> None | Error:
+def test_data(data: Doc, coref: bool = True) -> None | Error:
     '''
     Function to test the functions in the main program
     Param data: Doc, a Doc object to test the basic spacy nlp functions
+    Param coref: bool, whether the coreference clusters should be set
     '''
 
     # test if the data exists
@@ -159,7 +187,7 @@ def test_data(data: Doc) -> None | Error:
             raise ValueError('No entity label found')
         break
 
-    for cluster in data._.coref_clusters:
+    for cluster in (data._.coref_clusters if coref else []):
         if not cluster:
             raise ValueError('No coreference clusters found')
         if not cluster[0]:
@@ -170,17 +198,21 @@ def test_data(data: Doc) -> None | Error:
             raise ValueError('No end index found')
         break
 
-    if not data._.blob.polarity:
+    from pragmatics import get_sentiment
+    polarity, subjectivity = get_sentiment(data)
+    if not polarity:
         raise ValueError('No polarity found')
-    if not data._.blob.subjectivity:
+    if not subjectivity:
         raise ValueError('No subjectivity found')
-    if not data._.blob.sentiment_assessments.assessments:
-        raise ValueError('No sentiment assessment found')
 
 
 def main():
 
     args = create_parser()
+    coref: bool = not args.fast_semantics
+
+    from detector import train_detector, get_analyzer_votes, train_and_vote
+    from localization import write_localization
 
     print('Loading the training data')
     if args.training:
@@ -191,51 +223,91 @@ def main():
         check_file(machine_path)
         print('File paths are checked')
 
-        # load the data from the jsonl files
-        human, machine = get_and_parse_texts(human_path, machine_path)
-        print('Data is loaded')
-
-        test_data(human[0])
-        print('All required spaCy-attributes are set')
-
     else:
-        human, machine = get_and_parse_texts(Path('human.jsonl'), Path('group1.jsonl'))
+        human_path, machine_path = Path('human.jsonl'), Path('group1.jsonl')
+
+    # load the spacy model once for the training and the prompt data
+    nlp = load_spacy_model(coref, args.coref_model, args.coref_max_tokens, args.device, args.threads, args.sentiment)
+    if args.batch_size == 'auto' and not is_preparsed(human_path):
+        # a bounded random sample, drawn in one streaming pass, so a large or compressed corpus is not loaded for it
+        sample = sample_records(human_path, TUNING_SAMPLE, seed=0, fields=('text',))
+        nlp.batch_size = tune_batch_size([entry.get('text', '') for entry in sample], nlp)
+        print(f'The tuned batch size is {nlp.batch_size}')
+    elif args.batch_size is not None and args.batch_size != 'auto':
+        nlp.batch_size = args.batch_size
+
+    # the near-duplicates are found in the order the corpora are read, the training data before the prompts
+    deduplicator = None
+    if args.dedup:
+        from dedup import Deduplicator
+        deduplicator = Deduplicator(drop=args.dedup == 'drop')
+
+    # load the data from the jsonl files, with --fast-fit only a sample of it is parsed while fitting
+    if args.fast_fit:
+        from fastfit import fast_fit
+        model = fast_fit(human_path, machine_path, nlp, args.fast_semantics, drift=args.drift)
+
+        # the sample is not deduplicated, but the training data is indexed to find the prompts that leak from it
+        if deduplicator is not None:
+            from corpus import iter_records
+            for data_path in (human_path, machine_path):
+                if not is_preparsed(data_path):
+                    for _ in deduplicator.filter(iter_records(data_path), data_path):
+                        pass
+    else:
+        human, machine = get_and_parse_texts(human_path, machine_path, coref, nlp, args.stream, deduplicator)
         print('Data is loaded')
 
+        if args.training:
+            test_data(human[0], coref)
+            print('All required spaCy-attributes are set')
+
     print('\nLoading the prompt data')
     prompt_path = Path(args.prompt)
 
     check_file(prompt_path)
 
     # load the data from the jsonl files
-    prompts = parse_prompt_data(prompt_path)
+    prompts = parse_prompt_data(prompt_path, coref, nlp, args.records, deduplicator)
     true_labels: List[str] = [prompt['by'] for prompt in prompts] # type: ignore
 
-    # for the morphological analysis
-    morphology_ratios = do_morpology_analysis(human, machine)
-    morphology_prediction = get_morphology_results(prompts, morphology_ratios)
-    #make_report(true_labels, morpology_prediction, 'morpological')
-
-    # for the syntactic analysis
-    ratios = do_syntactic_analysis(human, machine)
-    syntactic_prediction = get_syntactic_results(ratios, prompts)
-    #make_report(true_labels, syntactic_prediction, 'syntactic')
-    syntactic_prediction = [result[0] for result in syntactic_prediction]
-
-    # for the semantic analysis
-    seperators = do_semantic_analysis(human, machine)
-    semantic_prediction = get_semantic_results(seperators, prompts)
-    #make_report(true_labels, semantic_prediction, 'semantic')
-    semantic_prediction = [result[0] for result in semantic_prediction]
-
-    # for the pragmatic analysis
-    polarity, subjectivity =  do_sentiment_analysis(human)
-    comparison_data: Tuple[float, float, float, float] = (polarity[0], polarity[1], subjectivity[0], subjectivity[1])
-    sentiment_prediction = get_sentiment_results(prompts, comparison_data)
-    #make_report(true_labels, sentiment_prediction, 'pragmatic')
+    # fit the morphological, syntactic, semantic and pragmatic analysis and let them vote on the prompts
+    if args.fast_fit:
+        votes = get_analyzer_votes(model, prompts)
+    elif args.workers > 1:
+        model, votes = train_and_vote(human, machine, prompts, args.fast_semantics, args.workers, args.drift)
+    else:
+        model = train_detector(human, machine, args.fast_semantics, args.drift)
+        votes = get_analyzer_votes(model, prompts)
 
     # create the final prediction
-    create_final_predictions(morphology_prediction, syntactic_prediction, semantic_prediction, sentiment_prediction, true_labels=true_labels)
+    create_final_predictions(votes['morphology'], votes['syntax'], votes['semantics'], votes['pragmatics'], true_labels=true_labels)
+
+    # report the near-duplicates, and the scores without the flagged prompts, which leak from the training data
+    if deduplicator is not None:
+        from dedup import write_report
+        print('\nThe near-duplicates are: \n')
+        write_report(deduplicator)
+        unique = [number for number, prompt in enumerate(prompts) if 'duplicate' not in prompt]
+        if unique and len(unique) < len(prompts):
+            print(f'\nThe scores of the {len(unique)} prompts that are no near-duplicates are: \n')
+            create_final_predictions(*[[analyzer_votes[number] for number in unique] for analyzer_votes in votes.values()],
+                                     true_labels=[true_labels[number] for number in unique])
+
+    # compare the prompts to the training data
+    if args.drift:
+        from drift import DriftMonitor, write_metrics
+        print('\nThe drift of the prompts from the training data is: \n')
+        monitor = DriftMonitor(model)
+        for prompt, prompt_votes in zip(prompts, zip(*votes.values())):
+            for alert in monitor.update(prompt['text'], dict(zip(votes, prompt_votes))): # type: ignore
+                print(alert)
+        write_metrics(monitor)
+
+    # classify the parts of every prompt
+    if args.localize:
+        print('\nThe classified parts of the prompts are: \n')
+        write_localization(model, prompts, args.window)
 
 
 if __name__ == '__main__':
@@ -3,30 +3,14 @@
 # Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
 
 from spacy.tokens import Doc
-from collections import Counter
 from preprocessor import parse_prompt_data, get_and_parse_texts, Path
+from features import get_doc_array, count_unique, LEMMA_COLUMN, ORTH_COLUMN
 from typing import List, Tuple, Dict
-from sklearn.metrics import classification_report, confusion_matrix
 
 DEBUG = False
 
 # Sem wrote the code, Jasper added Type-hints #
 
-# Tokenization and Lemmatization
-def tokenize_and_lemmatize(texts: List[Doc]) -> Tuple[List[str], List[str]]:
-    """
-    Tokenise and lemmatize the texts
-    :param texts: List[Doc], the texts to tokenize and lemmatize
-    """
-
-    tokens: List[str] = []
-    lemmas: List[str] = []
-    for doc in texts:
-        tokens.extend([token.text for token in doc])
-        lemmas.extend([token.lemma_ for token in doc])
-    return tokens, lemmas
-
-
 def calculate_ratios(texts: List[Doc]) -> Dict[str, float]:
     '''
     This function calculates the ratios of the data
@@ -44,10 +28,9 @@ def calculate_ratios(texts: List[Doc]) -> Dict[str, float]:
     for line in texts:
         point_count += line.text.count('.')
         comma_count += line.text.count(',')
-        tokens: List[str] = [token.text for token in line]
-        token_count += len(tokens)
-        lemma_count += len(set([token.lemma_ for token in line]))
-        types_count += len(set(tokens))
+        token_count += len(get_doc_array(line))
+        lemma_count += count_unique(line, LEMMA_COLUMN)
+        types_count += count_unique(line, ORTH_COLUMN)
 
     ratios['comma-point'] = comma_count / point_count
     ratios['token-lemma'] = token_count / lemma_count
@@ -62,30 +45,13 @@ def do_morpology_analysis(human_texts: List[Doc], machine_texts: List[Doc]) -> T
     :param human_texts: List[Doc], the human data
     :param machine_texts: List[Doc], the machine data
     """
-    human_tokens, human_lemmas = tokenize_and_lemmatize(human_texts)
-    machine_tokens, machine_lemmas = tokenize_and_lemmatize(machine_texts)
-
     if DEBUG:
-        # Average number of tokens and lemmas per line for both the machine and human data
-        print(f'Average tokens per line for the human data: {round(len(human_tokens) / len(human_texts), 1)}')
-        print(f'Average tokens per line for the machine data: {round(len(machine_tokens) / len(machine_texts), 1)}')
-        print(f'Average lemmas per line for the human data: {round(len(human_lemmas) / len(human_texts), 1)}')
-        print(f'Average lemmas per line for the machine data: {round(len(machine_lemmas) / len(machine_texts), 1)}\n')
-        print(f'Average types per line for the human data: {round(len(set(human_tokens)) / len(human_texts), 1)}')
-        print(f'Average types per line for the machine data: {round(len(set(machine_tokens)) / len(machine_texts), 1)}')
-        print(f'Average lemma types per line for the human data: {round(len(set(human_lemmas)) / len(human_texts), 1)}')
-        print(f'Average lemma types per line for the machine data: {round(len(set(machine_lemmas)) / len(machine_texts), 1)}\n')
-
-        # Looking at the frequency of tokens
-        human_tokens_count = Counter(human_tokens)
-        machine_tokens_count = Counter(machine_tokens)
-        print("Human:")
-        for item in human_tokens_count.most_common(10):
-            print(item)
-        print("\nMachine:")
-        for item in machine_tokens_count.most_common(10):
-            print(item)
-
+        # the token counts of a large corpus do not fit in memory, the profile keeps the most common ones in fixed memory
+        from profiling import profile_docs, write_profile
+        for name, texts in (('human', human_texts), ('machine', machine_texts)):
+            print(f'The {name} data:')
+            write_profile(profile_docs(texts, fast_semantics=not Doc.has_extension('coref_clusters')))
+            print()
 
     human_ratios = calculate_ratios(human_texts)
     machine_ratios = calculate_ratios(machine_texts)
@@ -110,43 +76,65 @@ def get_morphology_results(prompts: List[Dict[str, str | Doc]], ratios: Tuple[Di
     # Parse the prompt data
     texts: List[Doc] = [entry['text'] for entry in prompts] # type: ignore
 
-    human_ratios, machine_ratios = ratios
-    comma_point = human_ratios['comma-point'] - machine_ratios['comma-point']
-    token_lemma = human_ratios['token-lemma'] - machine_ratios['token-lemma']
-    token_types = human_ratios['token-types'] - machine_ratios['token-types']
-
     # Initialize the results list
     results: List[str] = []
 
     # Analyze each line using the calculated average ratio as threshold
     for line in texts:
-        result: List[str] = []
+        results.append(morphology_decider(*get_text_ratios(line), ratios))
+
+    return results
 
-        comma_point_ratio = line.text.count(',') / (line.text.count('.') + 0.0001)
-        tokens = [token.text for token in line]
-        token_lemma_ratio = len(tokens) / len(set([token.lemma_ for token in line]))
-        token_types_ratio = len(tokens) / len(set(tokens))
 
-        if comma_point_ratio > human_ratios['comma-point'] - (comma_point / 2):
-            result.append('Human')
-        else:
-            result.append('AI')
+def get_text_ratios(text: Doc) -> Tuple[float, float, float]:
+    """
+    Calculates the comma/point ratio, the token/lemma ratio and the token/types ratio of one text.
+    :param text: Doc, the text to calculate the ratios of
+    """
+    comma_point_ratio = text.text.count(',') / (text.text.count('.') + 0.0001)
+    token_amount = len(get_doc_array(text))
+    token_lemma_ratio = token_amount / count_unique(text, LEMMA_COLUMN)
+    token_types_ratio = token_amount / count_unique(text, ORTH_COLUMN)
+    return comma_point_ratio, token_lemma_ratio, token_types_ratio
+
+
+def morphology_decider(comma_point_ratio: float, token_lemma_ratio: float, token_types_ratio: float,
+                       ratios: Tuple[Dict[str, float], Dict[str, float]]) -> str:
+    """
+    Decides if a text (or a part of a text) is written by a human or a machine from its ratios.
+    Every ratio is compared to the point halfway between the human and machine ratio, and the majority wins.
+    :param comma_point_ratio: float, the comma/point ratio of the text
+    :param token_lemma_ratio: float, the token/lemma ratio of the text
+    :param token_types_ratio: float, the token/types ratio of the text
+    :param ratios: Tuple[Dict[str, float], Dict[str, float]], the ratios of the human and machine data
+    """
+    human_ratios, machine_ratios = ratios
+    comma_point = human_ratios['comma-point'] - machine_ratios['comma-point']
+    token_lemma = human_ratios['token-lemma'] - machine_ratios['token-lemma']
+    token_types = human_ratios['token-types'] - machine_ratios['token-types']
 
-        if token_lemma_ratio > human_ratios['token-lemma'] - (token_lemma / 2):
-            result.append('Human')
-        else:
-            result.append('AI')
+    result: List[str] = []
 
-        if token_types_ratio > human_ratios['token-types'] - (token_types / 2):
-            result.append('Human')
-        else:
-            result.append('AI')
+    if comma_point_ratio > human_ratios['comma-point'] - (comma_point / 2):
+        result.append('Human')
+    else:
+        result.append('AI')
 
-        results.append(max(set(result), key=result.count))
+    if token_lemma_ratio > human_ratios['token-lemma'] - (token_lemma / 2):
+        result.append('Human')
+    else:
+        result.append('AI')
 
-    return results
+    if token_types_ratio > human_ratios['token-types'] - (token_types / 2):
+        result.append('Human')
+    else:
+        result.append('AI')
+
+    return max(set(result), key=result.count)
 
 def main():
+    from sklearn.metrics import classification_report, confusion_matrix
+
     # Load the test data
     human_data_path: Path = Path('human.jsonl')
     machine_data_path: Path = Path('group1.jsonl')
@@ -7,13 +7,22 @@
 
 from preprocessor import get_and_parse_texts, parse_prompt_data, Path
 from spacy.tokens import Doc
-from sklearn.metrics import classification_report, confusion_matrix
 from typing import List, Tuple, Dict
 
 # Jasper #
 DEBUG = False
 
 
+def get_sentiment(text: Doc) -> Tuple[float, float]:
+    '''
+    Get the polarity and subjectivity of a text, from the lexicon_sentiment component or from spacytextblob
+    param text: Doc, the text to get the sentiment of
+    '''
+    if Doc.has_extension('polarity') and text._.polarity is not None:
+        return text._.polarity, text._.subjectivity
+    return text._.blob.polarity, text._.blob.subjectivity
+
+
 def pragmatic_predictor(text: Doc, comparison: Tuple[float, float, float, float]):
     '''
     Predict the pragmatic score of the data
@@ -21,13 +30,23 @@ def pragmatic_predictor(text: Doc, comparison: Tuple[float, float, float, float]
     param comparison: Tuple[float, float, float, float], the comparison values to use
     '''
 
+    # get the pragmatic values of the text
+    pragmatic_polarity, pragmatic_subjectivity = get_sentiment(text)
+
+    return pragmatic_decider(pragmatic_polarity, pragmatic_subjectivity, comparison)
+
+
+def pragmatic_decider(pragmatic_polarity: float, pragmatic_subjectivity: float, comparison: Tuple[float, float, float, float]) -> int:
+    '''
+    Count how many of the pragmatic values of a text (or a part of a text) are outside the "normal" values
+    param pragmatic_polarity: float, the polarity of the text
+    param pragmatic_subjectivity: float, the subjectivity of the text
+    param comparison: Tuple[float, float, float, float], the comparison values to use
+    '''
+
     # unpack the comparison values
     max_sent, min_sent, max_subj, min_subj = comparison
 
-    # get the pragmatic values of the text
-    pragmatic_polarity: float = text._.blob.polarity # type: ignore
-    pragmatic_subjectivity: float = text._.blob.subjectivity # type: ignore
-
     # check if the pragmatic values are outside the "normal" values with a small margin
     ai_counter: int = 0
     if pragmatic_polarity > (max_sent * 1.025) or pragmatic_polarity < (min_sent * 1.025):
@@ -64,6 +83,8 @@ def write_sentiment_results(prompts: List[Dict[str, Doc | str]], comparison_data
     param comparison_data: Tuple[float, float, float, float], the "norm" values to use
     '''
 
+    from sklearn.metrics import classification_report, confusion_matrix
+
     # get the data
     true_list: List[str] = [prompt['by'] for prompt in prompts] # type: ignore
     pred_list: List[str] = get_sentiment_results(prompts, comparison_data)
@@ -89,18 +110,19 @@ def do_sentiment_analysis(data: List[Doc]) -> Tuple[Tuple[float, float, float],
     avg_subjectivity: float = 0.0
 
     for doc in data:
-
-        if doc._.blob.polarity > max_sentiment:
-            max_sentiment = doc._.blob.polarity
-        if doc._.blob.polarity < min_sentiment:
-            min_sentiment = doc._.blob.polarity
-        avg_sentiment += doc._.blob.polarity
-
-        if doc._.blob.subjectivity > max_subjectivity:
-            max_subjectivity = doc._.blob.subjectivity
-        if doc._.blob.subjectivity < min_subjectivity:
-            min_subjectivity = doc._.blob.subjectivity
-        avg_subjectivity += doc._.blob.subjectivity
+        polarity, subjectivity = get_sentiment(doc)
+
+        if polarity > max_sentiment:
+            max_sentiment = polarity
+        if polarity < min_sentiment:
+            min_sentiment = polarity
+        avg_sentiment += polarity
+
+        if subjectivity > max_subjectivity:
+            max_subjectivity = subjectivity
+        if subjectivity < min_subjectivity:
+            min_subjectivity = subjectivity
+        avg_subjectivity += subjectivity
 
     if DEBUG:
         print(f'The maximum positive sentiment is: {max_sentiment:.4f}')
@@ -0,0 +1,234 @@
+# Program name: preparsed.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# Pre-parsed input. When the texts are already tokenized, tagged and parsed, the corpora and prompts
+# can be given as a spaCy DocBin (.spacy) or as CoNLL-U (.conllu) instead of jsonl. Only the pipeline
+# components whose annotations are missing from the docs run on top of them, usually the named entities,
+# the sentiment and fastcoref, so the tagger, the lemmatizer and the parser are skipped.
+#
+# The label and id of a doc are read from doc.user_data['by'] and doc.user_data['id'] in a DocBin
+# (save it with store_user_data=True), and from '# by = AI' and '# newdoc id = 17' comments in CoNLL-U.
+# In CoNLL-U every '# newdoc' starts a new document, a file without them has one document per sentence.
+
+# import the supporting packages
+from __future__ import annotations
+from typing import Any, Dict, List, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from spacy.language import Language
+    from spacy.tokens import Doc
+    from spacy.vocab import Vocab
+
+# the suffixes of the pre-parsed formats
+PARSED_SUFFIXES: Tuple[str, ...] = ('.spacy', '.conllu')
+
+# the token annotation the components of en_core_web_sm add, a component runs when a doc misses it
+COMPONENT_ANNOTATIONS: Dict[str, str] = {
+    'tagger': 'TAG',
+    'attribute_ruler': 'POS',
+    'lemmatizer': 'LEMMA',
+    'parser': 'DEP',
+    'senter': 'SENT_START',
+    'ner': 'ENT_IOB',
+}
+
+# the doc extensions the other components set, a component runs when a doc does not have it set
+COMPONENT_EXTENSIONS: Dict[str, str] = {
+    'lexicon_sentiment': 'polarity',
+    'fastcoref': 'coref_clusters',
+}
+
+# the components that only prepare the input of other components
+LISTENER_COMPONENTS: Tuple[str, ...] = ('tok2vec',)
+LISTENING_COMPONENTS: Tuple[str, ...] = ('tagger', 'parser', 'ner')
+
+
+def is_preparsed(file_path: str) -> bool:
+    '''
+    Whether a corpus is in a pre-parsed format, by its suffix
+    param file_path: str, the path to the corpus
+    '''
+    return str(file_path).endswith(PARSED_SUFFIXES)
+
+
+def read_docbin(file_path: str, vocab: Vocab) -> List[Doc]:
+    '''
+    Read the docs of a DocBin file
+    param file_path: str, the path to the .spacy file
+    param vocab: Vocab, the vocab of the pipeline the docs are used with
+    '''
+    from spacy.tokens import DocBin
+    return list(DocBin().from_disk(file_path).get_docs(vocab))
+
+
+def create_conllu_doc(vocab: Vocab, rows: List[List[str]], sentence_starts: List[bool], comments: Dict[str, str]) -> Doc:
+    '''
+    Create a doc from the token rows of a CoNLL-U document, a column that is not filled in for any token is left out
+    param vocab: Vocab, the vocab of the pipeline the doc is used with
+    param rows: List[List[str]], the ten columns of every token
+    param sentence_starts: List[bool], whether every token starts a sentence
+    param comments: Dict[str, str], the label and id of the document
+    '''
+    from spacy.tokens import Doc
+
+    # an underscore is also the lemma and the form of the token '_', so only a column of underscores is missing
+    def column(number: int) -> List[str] | None:
+        values = [row[number] for row in rows]
+        return None if all(value == '_' for value in values) else values
+
+    # the heads are counted from 1 within their sentence, 0 is the root, and the doc needs absolute indices
+    heads: List[int] | None = []
+    sentence_first: int = 0
+    for index, (row, start) in enumerate(zip(rows, sentence_starts)):
+        if start:
+            sentence_first = index
+        if not row[6].isdigit() or heads is None:
+            heads = None
+            continue
+        heads.append(index if row[6] == '0' else sentence_first + int(row[6]) - 1)
+
+    # a token is followed by a space unless SpaceAfter=No, but the last token of the document is not
+    spaces: List[bool] = ['SpaceAfter=No' not in row[9].split('|') for row in rows]
+    spaces[-1] = False
+    deps = column(7)
+    # '_' is never a universal part of speech, so in a partly filled column it is a missing one
+    pos = column(3)
+    if pos is not None:
+        pos = ['' if value == '_' else value for value in pos]
+    doc = Doc(vocab, words=[row[1] for row in rows], spaces=spaces,
+              lemmas=column(2), pos=pos, tags=column(4), heads=heads if deps else None, deps=deps if heads else None,
+              sent_starts=sentence_starts)
+    doc.user_data.update(comments)
+    return doc
+
+
+def read_conllu(file_path: str, vocab: Vocab) -> List[Doc]:
+    '''
+    Read the documents of a CoNLL-U file, multiword tokens and empty nodes are skipped
+    param file_path: str, the path to the .conllu file
+    param vocab: Vocab, the vocab of the pipeline the docs are used with
+    '''
+    documents: List[Tuple[List[List[str]], List[bool], Dict[str, str]]] = []
+    has_newdoc: bool = False
+    rows: List[List[str]] = []
+    sentence_starts: List[bool] = []
+    comments: Dict[str, str] = {}
+    sentence_start: bool = True
+
+    def end_document() -> None:
+        nonlocal rows, sentence_starts, comments
+        if rows:
+            documents.append((rows, sentence_starts, comments))
+        rows, sentence_starts, comments = [], [], {}
+
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.rstrip('\n')
+            if line.startswith('#'):
+                name, _, value = line[1:].partition('=')
+                name = name.strip()
+                if name.startswith('newdoc'):
+                    has_newdoc = True
+                    end_document()
+                    if name == 'newdoc id':
+                        comments['id'] = value.strip()
+                elif name == 'by':
+                    comments['by'] = value.strip()
+            elif not line.strip():
+                # a sentence ends, without newdoc markers it is a document of its own
+                if not has_newdoc:
+                    end_document()
+                sentence_start = True
+            else:
+                row = line.split('\t')
+                if len(row) != 10:
+                    raise ValueError(f'{file_path}, the CoNLL-U line {line!r} does not have 10 columns')
+                if '-' in row[0] or '.' in row[0]:
+                    continue
+                rows.append(row)
+                sentence_starts.append(sentence_start)
+                sentence_start = False
+    end_document()
+
+    return [create_conllu_doc(vocab, *document) for document in documents]
+
+
+def read_parsed(file_path: str, vocab: Vocab) -> List[Doc]:
+    '''
+    Read the docs of a pre-parsed corpus
+    param file_path: str, the path to the .spacy or .conllu file
+    param vocab: Vocab, the vocab of the pipeline the docs are used with
+    '''
+    if str(file_path).endswith('.conllu'):
+        return read_conllu(file_path, vocab)
+    return read_docbin(file_path, vocab)
+
+
+def get_missing_components(docs: List[Doc], nlp: Language) -> List[str]:
+    '''
+    Find the components of the pipeline whose annotations are missing from any of the docs
+    param docs: List[Doc], the pre-parsed docs
+    param nlp: Language, the loaded spacy model
+    '''
+    from spacy.tokens import Doc
+
+    missing: List[str] = []
+    for name in nlp.pipe_names:
+        if name in COMPONENT_ANNOTATIONS:
+            annotation = COMPONENT_ANNOTATIONS[name]
+            # a partly filled CoNLL-U column is completed by its component, see create_conllu_doc
+            if not all(doc.has_annotation(annotation, require_complete=True) for doc in docs):
+                missing.append(name)
+        elif name in COMPONENT_EXTENSIONS:
+            extension = COMPONENT_EXTENSIONS[name]
+            if not Doc.has_extension(extension) or any(getattr(doc._, extension) is None for doc in docs):
+                missing.append(name)
+        elif name not in LISTENER_COMPONENTS:
+            missing.append(name)
+
+    # the tagger, parser and ner need the output of tok2vec
+    if any(name in LISTENING_COMPONENTS for name in missing):
+        missing = [name for name in nlp.pipe_names if name in LISTENER_COMPONENTS or name in missing]
+    return missing
+
+
+def complete_docs(docs: List[Doc], nlp: Language) -> List[Doc]:
+    '''
+    Run the components of the pipeline whose annotations are missing from the pre-parsed docs on them
+    param docs: List[Doc], the pre-parsed docs
+    param nlp: Language, the loaded spacy model
+    '''
+    if not docs:
+        return docs
+    missing: List[str] = get_missing_components(docs, nlp)
+    print(f'Running {", ".join(missing) or "no components"} on {len(docs)} pre-parsed docs')
+    if not missing:
+        return docs
+    with nlp.select_pipes(enable=missing):
+        return list(nlp.pipe(docs))
+
+
+def parse_parsed_data(file_path: str, nlp: Language, annotation: str | None = None,
+                      records: Tuple[int | None, int | None] | None = None) -> List[Dict[str, Any]]:
+    '''
+    Read pre-parsed prompts and complete them, like preprocessor.process_prompt_data does for jsonl prompts
+    param file_path: str, the path to the .spacy or .conllu file
+    param nlp: Language, the loaded spacy model
+    param annotation: str, the label of every doc, by default the label stored with the doc
+    param records: Tuple[int | None, int | None], the start and stop of the docs to use, by default all docs
+    '''
+    docs: List[Doc] = read_parsed(file_path, nlp.vocab)
+    if records is not None:
+        docs = docs[slice(*records)]
+
+    labeled: List[Doc] = [doc for doc in docs if annotation or doc.user_data.get('by')]
+    if len(labeled) < len(docs):
+        print(f'Skipped {len(docs) - len(labeled)} of {len(docs)} pre-parsed prompts without a label')
+
+    prompts: List[Dict[str, Any]] = []
+    for doc in complete_docs(labeled, nlp):
+        prompt: Dict[str, Any] = {'text': doc, 'by': annotation or doc.user_data['by']}
+        if 'id' in doc.user_data:
+            prompt['id'] = doc.user_data['id']
+        prompts.append(prompt)
+    return prompts
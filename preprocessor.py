@@ -6,56 +6,82 @@
 # Jasper #
 
 # import the supporting packages
-import json
+from __future__ import annotations
 import subprocess
-from typing import Tuple, List, Dict, NewType
+import time
+from functools import lru_cache
+from typing import Any, Tuple, List, Dict, NewType, TYPE_CHECKING
+from corpus import load_jsonl, read_records, iter_records, load_index
+from preparsed import is_preparsed
 Path = NewType('Path', str)
 
-# import the necessary packages
-import spacy
-from spacy.language import Language
-from spacy.tokens import Doc
-from fastcoref import spacy_component # type: ignore
-import nltk # type: ignore
-
-# try importing the nltk wordnet package, if it fails, download it
-try:
-    from nltk.corpus import wordnet as wn # type: ignore
-except ImportError:
-    nltk.download('wordnet') # type: ignore
+# spacy, fastcoref (with torch) and nltk take seconds to import, so they are only imported by the
+# functions that need them, and the command line and the reports start without them
+if TYPE_CHECKING:
+    from spacy.language import Language
+    from spacy.tokens import Doc
+    from dedup import Deduplicator
+
+
+@lru_cache(maxsize=None)
+def get_wordnet():
+    '''
+    Import the nltk wordnet corpus, if it fails, download it
+    '''
     try:
         from nltk.corpus import wordnet as wn # type: ignore
-    except ImportError:
-        subprocess.run('pip install -r requirements.txt', shell = True, executable="/bin/bash")
+        wn.ensure_loaded()
+    except (ImportError, LookupError):
+        import nltk # type: ignore
+        nltk.download('wordnet') # type: ignore
         try:
             from nltk.corpus import wordnet as wn # type: ignore
         except ImportError:
-            exit('Please install the nltk wordnet package')
+            subprocess.run('pip install -r requirements.txt', shell = True, executable="/bin/bash")
+            try:
+                from nltk.corpus import wordnet as wn # type: ignore
+            except ImportError:
+                exit('Please install the nltk wordnet package')
+    return wn
+
 
-# try importing the spacytextblob package, if it fails, download it
-try:
-    from spacytextblob.spacytextblob import SpacyTextBlob # type: ignore
-except ImportError:
-    subprocess.run('python3 -m textblob.download_corpora', shell = True, executable="/bin/bash")
+def import_spacytextblob() -> None:
+    '''
+    Import the spacytextblob package, which registers its component, if it fails, download it
+    '''
     try:
         from spacytextblob.spacytextblob import SpacyTextBlob # type: ignore
     except ImportError:
-            try:
-                subprocess.run('pip install -r requirements.txt', shell = True, executable="/bin/bash")
-            except ImportError:
-                exit('Please install the textblob package')
+        subprocess.run('python3 -m textblob.download_corpora', shell = True, executable="/bin/bash")
+        try:
+            from spacytextblob.spacytextblob import SpacyTextBlob # type: ignore
+        except ImportError:
+                try:
+                    subprocess.run('pip install -r requirements.txt', shell = True, executable="/bin/bash")
+                except ImportError:
+                    exit('Please install the textblob package')
 
 
-# subfunction to load the jsonl files
-def load_jsonl(file_path: Path) -> List[Dict[str, str]]:
-    """
-    Loads a jsonl file
-    :param file_path: str, the path to the jsonl file
-    :return: list of dictionaries, with each dictionary being a line in the jsonl file
-    """
-    with open(file_path, 'r') as file:
-        data: List[Dict[str, str]] = [json.loads(line) for line in file]
-    return data
+# the fastcoref model variants and the weights they load
+COREF_MODELS: Dict[str, str] = {
+    'FCoref': 'biu-nlp/f-coref',
+    'LingMessCoref': 'biu-nlp/lingmess-coref',
+}
+
+# the sentiment components, lexicon is the array based one of sentiment.py, textblob is spacytextblob
+SENTIMENT_COMPONENTS: Dict[str, str] = {
+    'lexicon': 'lexicon_sentiment',
+    'textblob': 'spacytextblob',
+}
+
+# the batch sizes tried by tune_batch_size
+BATCH_SIZES: Tuple[int, ...] = (4, 8, 16, 32, 64, 128)
+
+# the longest text of a length bucket is at most this many times as long as the shortest one
+BUCKET_GROWTH: float = 2.0
+
+# the amount of skipped records process_prompt_data lists one by one
+MAX_SKIPPED_REPORTED: int = 10
 
 
 # subfunction to process the data with spacy
@@ -67,16 +93,33 @@ def process_prompt_data(data: List[Dict[str, str]], nlp: Language, annotation: s
     :param annotation: str, the annotation for the data
     :return: list of dictionaries, the processed data
     """
-    # Extract text data
-    text_data: List[str] = [entry['text'] for entry in data if 'text' in entry and entry['text'].strip()]
-    docs: List[Doc] = list(nlp.pipe(text_data))
-
-    if annotation:
-        return [{'text': doc, 'by': annotation} for doc in docs]
-    else:
-        text_by: List[str] = [entry['by'] for entry in data if 'by' in entry and entry['by'].strip()]
-        return [{'text': doc, 'by': by} for doc, by in zip(docs, text_by)]
-
+    # Collect every usable record in a single pass, keeping its text, label and id together,
+    # so a record without text or label can never shift the labels of the records after it
+    records: List[Tuple[str, Dict[str, str]]] = []
+    skipped: List[str] = []
+    for number, entry in enumerate(data):
+        text: str = entry.get('text', '')
+        label: str = annotation or entry.get('by', '')
+        if not isinstance(text, str) or not text.strip():
+            skipped.append(f'record {number}: no text')
+        elif not isinstance(label, str) or not label.strip():
+            skipped.append(f'record {number}: no label')
+        else:
+            context: Dict[str, str] = {'by': label}
+            if 'id' in entry:
+                context['id'] = entry['id']
+            if 'duplicate' in entry:
+                context['duplicate'] = entry['duplicate']
+            records.append((text, context))
+
+    if skipped:
+        print(f'Skipped {len(skipped)} of {len(data)} prompt records:')
+        for reason in skipped[:MAX_SKIPPED_REPORTED]:
+            print(f'  {reason}')
+        if len(skipped) > MAX_SKIPPED_REPORTED:
+            print(f'  and {len(skipped) - MAX_SKIPPED_REPORTED} more')
+
+    return [{'text': doc, **context} for doc, context in pipe_bucketed(records, nlp)]
 
 
 def process_data(data: List[Dict[str, str]], nlp: Language) -> List[Doc]:
@@ -87,34 +130,181 @@ def process_data(data: List[Dict[str, str]], nlp: Language) -> List[Doc]:
     :return: list of spacy docs, the processed data
     """
     # Extract text data
-    text_data: List[str] = [entry['text'] for entry in data if 'text' in entry and entry['text'].strip()]
-    docs: List[Doc] = list(nlp.pipe(text_data))
+    records: List[Tuple[str, Any]] = [(entry['text'], None) for entry in data if 'text' in entry and entry['text'].strip()]
+    docs: List[Doc] = [doc for doc, _ in pipe_bucketed(records, nlp)]
     return docs
 
 
+def process_stream(data_path: Path, nlp: Language, deduplicator: Deduplicator | None = None) -> List[Doc]:
+    """
+    Process the texts of a corpus while it is read, and decompressed if it is compressed, in a background thread
+    The texts are parsed in file order, without the length buckets of pipe_bucketed
+    :param data_path: str, the path to the corpus
+    :param nlp: spacy model, the spacy model to use for processing
+    :param deduplicator: Deduplicator, drops or flags the near-duplicates before they are parsed, see dedup.py
+    :return: list of spacy docs, the processed data
+    """
+    entries = iter_records(data_path, background=True)
+    if deduplicator is not None:
+        entries = deduplicator.filter(entries, data_path)
+    texts = (entry['text'] for entry in entries if 'text' in entry and entry['text'].strip())
+    return list(nlp.pipe(texts))
+
+
+def bucket_by_length(lengths: List[int], growth: float = BUCKET_GROWTH) -> List[List[int]]:
+    """
+    Groups texts into buckets of about the same length
+    :param lengths: list of ints, the length of every text
+    :param growth: float, how many times longer than the shortest text a text in the same bucket may be
+    :return: list of buckets, every bucket is a list of text indices sorted by length
+    """
+    order: List[int] = sorted(range(len(lengths)), key=lambda index: lengths[index])
+    buckets: List[List[int]] = []
+    bucket_start: float = 0.0
+    for index in order:
+        if not buckets or lengths[index] > bucket_start * growth:
+            buckets.append([])
+            bucket_start = max(1, lengths[index])
+        buckets[-1].append(index)
+    return buckets
+
+
+def pipe_bucketed(records: List[Tuple[str, Any]], nlp: Language, batch_characters: int | None = None) -> List[Tuple[Doc, Any]]:
+    """
+    Processes (text, context) records bucket by bucket, see bucket_by_length, so a batch never mixes short and
+    very long texts and the transformer of the coreference component wastes little time on padding.
+    Every bucket gets its own batch size, so a batch holds about the same amount of characters in every bucket.
+    The context travels through nlp.pipe with its text (as_tuples) and the results keep the original order.
+    :param records: list of (text, context) tuples, the texts to process with anything that belongs to them
+    :param nlp: spacy model, the spacy model to use for processing
+    :param batch_characters: int, the characters per batch, by default nlp.batch_size texts of the median length
+    :return: list of (doc, context) tuples, one per record
+    """
+    if not records:
+        return []
+    lengths: List[int] = [len(text) for text, _ in records]
+    if batch_characters is None:
+        batch_characters = nlp.batch_size * max(1, sorted(lengths)[len(lengths) // 2])
+
+    results: List[Tuple[Doc, Any]] = [None] * len(records) # type: ignore
+    for bucket in bucket_by_length(lengths):
+        longest: int = max(1, lengths[bucket[-1]])
+        batch_size: int = max(1, batch_characters // longest)
+        bucket_records = ((records[index][0], (index, records[index][1])) for index in bucket)
+        for doc, (index, context) in nlp.pipe(bucket_records, as_tuples=True, batch_size=batch_size):
+            results[index] = (doc, context)
+    return results
+
+
+def tune_batch_size(texts: List[str], nlp: Language, sample_size: int = 48) -> int:
+    """
+    Finds the batch size with the highest throughput by timing nlp.pipe on a sample of the texts
+    :param texts: list of strings, the texts to take the sample from
+    :param nlp: spacy model, the spacy model to tune
+    :param sample_size: int, the amount of texts to time every batch size on
+    :return: int, the batch size with the most characters processed per second
+    """
+    # take the sample evenly over the length distribution, sorted like pipe_bucketed does
+    texts = sorted((text for text in texts if text.strip()), key=len)
+    step: int = max(1, len(texts) // sample_size)
+    sample: List[str] = texts[::step][:sample_size]
+    if not sample:
+        return nlp.batch_size
+
+    # warm up the pipeline, so the first batch size is not timed with the model loading
+    nlp(sample[0])
+
+    best_batch_size: int = nlp.batch_size
+    best_throughput: float = 0.0
+    characters: int = sum(len(text) for text in sample)
+    for batch_size in BATCH_SIZES:
+        if batch_size > len(sample):
+            break
+        start: float = time.perf_counter()
+        for _ in nlp.pipe(sample, batch_size=batch_size):
+            pass
+        throughput: float = characters / (time.perf_counter() - start)
+        if throughput > best_throughput:
+            best_batch_size, best_throughput = batch_size, throughput
+
+    return best_batch_size
+
+
 # subfunction to load the spacy model
-def load_spacy_model() -> Language:
+def load_spacy_model(coref: bool = True, coref_model: str = 'FCoref', max_tokens_in_batch: int = 10000,
+                     device: str | None = None, threads: int | None = None, sentiment: str = 'lexicon') -> Language:
     """
     Loads the spacy model with all necessary components
+    :param coref: bool, whether to add the fastcoref component, not needed for the fast semantic analysis
+    :param coref_model: str, the fastcoref model variant, FCoref (fast) or LingMessCoref (accurate)
+    :param max_tokens_in_batch: int, the maximum amount of tokens fastcoref puts in one batch
+    :param device: str, the device fastcoref runs on, for example 'cpu' or 'cuda:0', by default cuda when available
+    :param threads: int, the amount of threads torch may use on the cpu, by default all cores
+    :param sentiment: str, the sentiment component, lexicon (the fast one of sentiment.py) or textblob (spacytextblob)
     :return: spacy model, the loaded spacy model
     """
+    if coref_model not in COREF_MODELS:
+        raise ValueError(f'{coref_model}, the coreference model must be one of {", ".join(COREF_MODELS)}')
+    if sentiment not in SENTIMENT_COMPONENTS:
+        raise ValueError(f'{sentiment}, the sentiment component must be one of {", ".join(SENTIMENT_COMPONENTS)}')
+
+    import spacy
+    if sentiment == 'textblob':
+        import_spacytextblob()
+    else:
+        from sentiment import create_lexicon_sentiment # registers the lexicon_sentiment component
+
     nlp: Language = spacy.load("en_core_web_sm")
-    nlp.add_pipe('spacytextblob')
-    nlp.add_pipe('fastcoref')
+    nlp.add_pipe(SENTIMENT_COMPONENTS[sentiment])
+    if coref:
+        from fastcoref import spacy_component # type: ignore # registers the fastcoref component
+        if threads:
+            import torch # type: ignore
+            torch.set_num_threads(threads)
+        nlp.add_pipe('fastcoref', config={
+            'model_architecture': coref_model,
+            'model_path': COREF_MODELS[coref_model],
+            'device': device,
+            'max_tokens_in_batch': max_tokens_in_batch,
+        })
     return nlp
 
 
-def parse_prompt_data(prompt_file: Path) -> List[Dict[str, Doc | str]]:
+def parse_prompt_data(prompt_file: Path, coref: bool = True, nlp: Language | None = None,
+                      records: Tuple[int | None, int | None] | None = None,
+                      deduplicator: Deduplicator | None = None) -> List[Dict[str, Doc | str]]:
     '''
     Function to parse the prompt data
-    param prompt_file: str, the path to the jsonl file with the prompt data
+    param prompt_file: str, the path to the jsonl file with the prompt data, or a pre-parsed .spacy or .conllu file
+    param coref: bool, whether to run the fastcoref component
+    param nlp: Language, an already loaded spacy model, by default a new one is loaded
+    param records: Tuple[int | None, int | None], the start and stop of the records to parse, by default all records
+    param deduplicator: Deduplicator, drops or flags the near-duplicates of jsonl prompts before they are parsed, see dedup.py
     '''
 
     # load the spacy model
-    nlp: Language = load_spacy_model()
-
-    # load the prompt data from the jsonl file
-    prompt_list: List[Dict[str, str]] = load_jsonl(prompt_file)
+    if nlp is None:
+        nlp = load_spacy_model(coref)
+
+    # pre-parsed prompts only get the components they miss, see preparsed.py
+    if is_preparsed(prompt_file):
+        from preparsed import parse_parsed_data
+        annotation: str | None = None
+        if 'human' in str(prompt_file).lower():
+            annotation = 'Human'
+        elif 'machine' in str(prompt_file).lower():
+            annotation = 'AI'
+        return parse_parsed_data(prompt_file, nlp, annotation, records)
+
+    # load the prompt data from the jsonl file, a range of records is read through the offset index
+    if records is None:
+        prompt_list: List[Dict[str, str]] = load_jsonl(prompt_file)
+    else:
+        prompt_list = read_records(prompt_file, *records)
+    if deduplicator is not None:
+        # the records are numbered as in the whole file, so a flagged prompt can be found with --records
+        start: int = 0 if records is None else slice(*records).indices(len(load_index(prompt_file)) - 1)[0]
+        prompt_list = list(deduplicator.filter(prompt_list, prompt_file, start))
 
     # check if the prompt data is human or machine
     if 'human' in str(prompt_file).lower():
@@ -129,18 +319,36 @@ def parse_prompt_data(prompt_file: Path) -> List[Dict[str, Doc | str]]:
     return prompt_data
 
 
-def get_and_parse_texts(human_data: Path, machine_data: Path) -> Tuple[List[Doc], List[Doc]]:
+def get_and_parse_texts(human_data: Path, machine_data: Path, coref: bool = True, nlp: Language | None = None,
+                        stream: bool = False, deduplicator: Deduplicator | None = None) -> Tuple[List[Doc], List[Doc]]:
     '''
     Function to load and parse the texts from the jsonl files
-    param human_data: str, the path to the jsonl file with the human data
-    param machine_data: str, the path to the jsonl file with the machine data
+    param human_data: str, the path to the jsonl file with the human data, or a pre-parsed .spacy or .conllu file
+    param machine_data: str, the path to the jsonl file with the machine data, or a pre-parsed .spacy or .conllu file
+    param coref: bool, whether to run the fastcoref component
+    param nlp: Language, an already loaded spacy model, by default a new one is loaded
+    param stream: bool, whether to parse the texts while the files are read, see process_stream
+    param deduplicator: Deduplicator, drops the near-duplicates of jsonl texts before they are parsed, see dedup.py
     '''
 
-    nlp: Language = load_spacy_model()
+    if nlp is None:
+        nlp = load_spacy_model(coref)
+
+    # pre-parsed corpora only get the components they miss, see preparsed.py
+    if is_preparsed(human_data) or is_preparsed(machine_data):
+        from preparsed import read_parsed, complete_docs
+        return tuple(complete_docs(read_parsed(data, nlp.vocab), nlp) if is_preparsed(data) else process_data(load_jsonl(data), nlp)
+                     for data in (human_data, machine_data)) # type: ignore
+
+    if stream:
+        return process_stream(human_data, nlp, deduplicator), process_stream(machine_data, nlp, deduplicator)
 
     # load the data
     human_data_list = load_jsonl(human_data)
     machine_data_list = load_jsonl(machine_data)
+    if deduplicator is not None:
+        human_data_list = list(deduplicator.filter(human_data_list, human_data))
+        machine_data_list = list(deduplicator.filter(machine_data_list, machine_data))
 
     # process the data
     human_docs = process_data(human_data_list, nlp)
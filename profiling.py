@@ -0,0 +1,469 @@
+# Program name: profiling.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# Corpus profiling in bounded memory. The corpus is streamed and parsed once, and every text is added
+# to a CorpusProfile: Space-Saving summaries with Count-Min sketches for the most common tokens,
+# lemmas, tags and entity types, histograms of the text lengths and running sums of the per-text
+# features of the four analyzers (see drift.get_document_features). None of them grows with the
+# corpus, and the profiles of shards of a corpus merge into the profile of the whole corpus.
+#
+# python3 profiling.py corpus human.jsonl --records 0:50000 -o human.0.json
+# python3 profiling.py corpus human.jsonl --records 50000: -o human.1.json
+# python3 profiling.py merge human.0.json human.1.json -o human.json
+
+# import our modules
+from __future__ import annotations
+from features import get_doc_array, count_values, count_sentences, TAG_COLUMN, LEMMA_COLUMN, ORTH_COLUMN
+
+# import the supporting packages
+import argparse
+import hashlib
+import heapq
+import json
+import math
+import os
+import numpy as np
+from typing import Any, Dict, Iterator, List, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from spacy.tokens import Doc
+
+# the items every Space-Saving summary follows, and the width and depth of every Count-Min sketch
+CAPACITY: int = 1000
+SKETCH_WIDTH: int = 4096
+SKETCH_DEPTH: int = 4
+
+# the values the heavy hitters are counted of
+HITTERS: Tuple[str, ...] = ('tokens', 'lemmas', 'tags', 'entities')
+
+# the lengths of a text that get a histogram, the bins grow by a factor 2 every BINS_PER_OCTAVE bins
+LENGTHS: Tuple[str, ...] = ('characters', 'tokens', 'sentences')
+BINS_PER_OCTAVE: int = 4
+LENGTH_BINS: int = 24 * BINS_PER_OCTAVE
+
+
+class CountMinSketch:
+    '''
+    Count items in a fixed table, an estimate is never lower than the true count and is at most
+    the total count times e / width higher, with probability 1 - e ** -depth
+    param width: int, the columns of the table
+    param depth: int, the rows of the table, every row has its own hash
+    '''
+
+    def __init__(self, width: int = SKETCH_WIDTH, depth: int = SKETCH_DEPTH) -> None:
+        self.table = np.zeros((depth, width), dtype=np.int64)
+
+    def get_columns(self, items: List[str]) -> np.ndarray:
+        '''
+        Get the column of every item in every row, from two halves of a hash that is the same in every process
+        param items: List[str], the items
+        return: np.ndarray, the columns, one row per table row
+        '''
+        depth, width = self.table.shape
+        digests = b''.join(hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest() for item in items)
+        halves = np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+        rows = np.arange(depth, dtype=np.uint64)[:, None]
+        return ((halves[:, 0] + rows * (halves[:, 1] | np.uint64(1))) % np.uint64(width)).astype(np.intp)
+
+    def add(self, counts: Dict[str, int]) -> None:
+        '''
+        Add the counts of items
+        param counts: Dict[str, int], the items mapped to how often they occur
+        '''
+        if not counts:
+            return
+        columns = self.get_columns(list(counts))
+        rows = np.broadcast_to(np.arange(self.table.shape[0])[:, None], columns.shape)
+        np.add.at(self.table, (rows, columns), np.array(list(counts.values()), dtype=np.int64))
+
+    def estimate(self, items: List[str]) -> List[int]:
+        '''
+        Estimate the counts of items
+        param items: List[str], the items
+        '''
+        if not items:
+            return []
+        columns = self.get_columns(items)
+        return [int(count) for count in np.take_along_axis(self.table, columns, axis=1).min(axis=0)]
+
+    def merge(self, other: CountMinSketch) -> None:
+        '''
+        Add the counts of a sketch with the same width and depth
+        param other: CountMinSketch, the sketch to add
+        '''
+        if self.table.shape != other.table.shape:
+            raise ValueError(f'A sketch of {other.table.shape} cannot be merged into a sketch of {self.table.shape}')
+        self.table += other.table
+
+
+class SpaceSaving:
+    '''
+    Follow the most common items in a fixed amount of counters. A new item takes the counter of the
+    least common item and starts from its count, which is kept as the error of the new count. Every
+    item that occurs more than total / capacity times has a counter.
+    param capacity: int, the amount of counters
+    '''
+
+    def __init__(self, capacity: int = CAPACITY) -> None:
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        # the counters ordered by count, with outdated entries that are skipped when they come up
+        self.heap: List[Tuple[int, str]] = []
+
+    def get_minimum(self) -> Tuple[int, str]:
+        '''
+        Get the least common item and its count
+        '''
+        while self.heap[0][0] != self.counts.get(self.heap[0][1]):
+            heapq.heappop(self.heap)
+        return self.heap[0]
+
+    def add(self, counts: Dict[str, int]) -> None:
+        '''
+        Add the counts of items
+        param counts: Dict[str, int], the items mapped to how often they occur
+        '''
+        for item, amount in counts.items():
+            if item in self.counts:
+                self.counts[item] += amount
+            elif len(self.counts) < self.capacity:
+                self.counts[item] = amount
+                self.errors[item] = 0
+            else:
+                minimum, evicted = self.get_minimum()
+                del self.counts[evicted], self.errors[evicted]
+                self.counts[item] = minimum + amount
+                self.errors[item] = minimum
+            heapq.heappush(self.heap, (self.counts[item], item))
+
+        # drop the outdated entries before the heap outgrows the counters
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, item) for item, count in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def merge(self, other: SpaceSaving) -> None:
+        '''
+        Add the counters of another summary. An item without a counter in one of the summaries occurred at
+        most as often as the least common item of that summary, which is added to its count and error.
+        param other: SpaceSaving, the summary to add
+        '''
+        own_minimum: int = min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+        other_minimum: int = min(other.counts.values()) if len(other.counts) >= other.capacity else 0
+        counts: Dict[str, int] = {}
+        errors: Dict[str, int] = {}
+        for item in set(self.counts) | set(other.counts):
+            counts[item] = self.counts.get(item, own_minimum) + other.counts.get(item, other_minimum)
+            errors[item] = self.errors.get(item, own_minimum) + other.errors.get(item, other_minimum)
+
+        kept = sorted(counts, key=lambda item: -counts[item])[:self.capacity]
+        self.counts = {item: counts[item] for item in kept}
+        self.errors = {item: errors[item] for item in kept}
+        self.heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self.heap)
+
+
+class HeavyHitters:
+    '''
+    The most common values of a corpus, the Space-Saving summary finds them and the Count-Min sketch
+    gives a second upper bound on their counts, the lowest of the two is reported
+    param capacity: int, the amount of Space-Saving counters
+    '''
+
+    def __init__(self, capacity: int = CAPACITY) -> None:
+        self.summary = SpaceSaving(capacity)
+        self.sketch = CountMinSketch()
+        self.total: int = 0
+
+    def add(self, counts: Dict[str, int]) -> None:
+        '''
+        Add the counts of the values of a text
+        param counts: Dict[str, int], the values mapped to how often they occur
+        '''
+        self.summary.add(counts)
+        self.sketch.add(counts)
+        self.total += sum(counts.values())
+
+    def merge(self, other: HeavyHitters) -> None:
+        '''
+        Add the counts of another corpus
+        param other: HeavyHitters, the counts to add
+        '''
+        self.summary.merge(other.summary)
+        self.sketch.merge(other.sketch)
+        self.total += other.total
+
+    def top(self, amount: int) -> List[Tuple[str, int, int]]:
+        '''
+        Get the most common values
+        param amount: int, the amount of values
+        return: List[Tuple[str, int, int]], every value with its estimated count and the most it can be too high
+        '''
+        items = sorted(self.summary.counts, key=lambda item: -self.summary.counts[item])[:amount]
+        top: List[Tuple[str, int, int]] = []
+        for item, estimate in zip(items, self.sketch.estimate(items)):
+            count = min(self.summary.counts[item], estimate)
+            top.append((item, count, min(self.summary.errors[item], count)))
+        return top
+
+
+class CorpusProfile:
+    '''
+    The profile of a corpus, every text is added once and the memory does not grow with the corpus
+    param capacity: int, the amount of Space-Saving counters per heavy hitter summary
+    param fast_semantics: bool, whether the coreference values are estimated without fastcoref
+    '''
+
+    def __init__(self, capacity: int = CAPACITY, fast_semantics: bool = False) -> None:
+        self.fast_semantics = fast_semantics
+        self.documents: int = 0
+        self.hitters: Dict[str, HeavyHitters] = {name: HeavyHitters(capacity) for name in HITTERS}
+        self.lengths: Dict[str, np.ndarray] = {name: np.zeros(LENGTH_BINS, dtype=np.int64) for name in LENGTHS}
+        self.length_sums: Dict[str, int] = {name: 0 for name in LENGTHS}
+        # per feature the amount of texts it has a value for, the sum, the sum of squares, the minimum and the maximum
+        self.features: Dict[str, List[float]] = {}
+
+    def add(self, doc: Doc) -> None:
+        '''
+        Add a text to the profile
+        param doc: Doc, the parsed text
+        '''
+        from drift import get_document_features
+
+        self.documents += 1
+        tags: Dict[str, int] = count_values(doc, TAG_COLUMN)
+        entities: Dict[str, int] = {}
+        for entity in doc.ents:
+            entities[entity.label_] = entities.get(entity.label_, 0) + 1
+        for name, counts in zip(HITTERS, (count_values(doc, ORTH_COLUMN), count_values(doc, LEMMA_COLUMN), tags, entities)):
+            self.hitters[name].add(counts)
+
+        for name, length in zip(LENGTHS, (len(doc.text), len(get_doc_array(doc)), count_sentences(doc))):
+            self.lengths[name][min(int(BINS_PER_OCTAVE * math.log2(length + 1)), LENGTH_BINS - 1)] += 1
+            self.length_sums[name] += length
+
+        # the syntax features of every tag of the text, a text without a tag counts as 0 in the summary
+        for feature, value in get_document_features(doc, sorted(tags), self.fast_semantics).items():
+            if math.isnan(value):
+                continue
+            summary = self.features.setdefault(feature, [0, 0.0, 0.0, math.inf, -math.inf])
+            summary[0] += 1
+            summary[1] += value
+            summary[2] += value * value
+            summary[3] = min(summary[3], value)
+            summary[4] = max(summary[4], value)
+
+    def merge(self, other: CorpusProfile) -> None:
+        '''
+        Add the profile of another corpus, or of another shard of the same corpus
+        param other: CorpusProfile, the profile to add
+        '''
+        if other.fast_semantics != self.fast_semantics:
+            raise ValueError('Profiles with and without --fast-semantics cannot be merged')
+        self.documents += other.documents
+        for name in HITTERS:
+            self.hitters[name].merge(other.hitters[name])
+        for name in LENGTHS:
+            self.lengths[name] += other.lengths[name]
+            self.length_sums[name] += other.length_sums[name]
+        for feature, other_summary in other.features.items():
+            summary = self.features.setdefault(feature, [0, 0.0, 0.0, math.inf, -math.inf])
+            for number in range(3):
+                summary[number] += other_summary[number]
+            summary[3] = min(summary[3], other_summary[3])
+            summary[4] = max(summary[4], other_summary[4])
+
+    def get_feature_summary(self, feature: str) -> Tuple[int, float, float, float, float]:
+        '''
+        Summarize a feature over the texts
+        param feature: str, the name of the feature
+        return: Tuple[int, float, float, float, float], the amount of texts, the mean, the standard deviation, the minimum and the maximum
+        '''
+        amount, total, squares, minimum, maximum = self.features[feature]
+        if feature.startswith('syntax '):
+            # the texts without the tag have a ratio of 0
+            if amount < self.documents:
+                minimum = min(minimum, 0.0)
+            amount = self.documents
+        mean: float = total / amount
+        return int(amount), mean, math.sqrt(max(squares / amount - mean * mean, 0.0)), minimum, maximum
+
+    def get_length_quantile(self, name: str, share: float) -> int:
+        '''
+        Get the upper edge of the histogram bin a quantile of a length falls in
+        param name: str, the length, one of LENGTHS
+        param share: float, the quantile, from 0 to 1
+        '''
+        cumulative = np.cumsum(self.lengths[name])
+        upper_bin = int(np.searchsorted(cumulative, share * cumulative[-1]))
+        return math.ceil(2 ** ((upper_bin + 1) / BINS_PER_OCTAVE)) - 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        '''
+        Get the profile as json data
+        '''
+        return {
+            'fast_semantics': self.fast_semantics,
+            'documents': self.documents,
+            'hitters': {name: {
+                'capacity': hitters.summary.capacity,
+                'counts': hitters.summary.counts,
+                'errors': hitters.summary.errors,
+                'sketch': hitters.sketch.table.tolist(),
+                'total': hitters.total,
+            } for name, hitters in self.hitters.items()},
+            'lengths': {name: self.lengths[name].tolist() for name in LENGTHS},
+            'length_sums': self.length_sums,
+            'features': self.features,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> CorpusProfile:
+        '''
+        Create a profile from the json data of to_dict
+        param data: Dict[str, Any], the json data
+        '''
+        profile = cls(data['hitters']['tokens']['capacity'], data['fast_semantics'])
+        profile.documents = data['documents']
+        for name, hitters_data in data['hitters'].items():
+            hitters = profile.hitters[name]
+            hitters.summary.counts = hitters_data['counts']
+            hitters.summary.errors = hitters_data['errors']
+            hitters.summary.heap = [(count, item) for item, count in hitters.summary.counts.items()]
+            heapq.heapify(hitters.summary.heap)
+            hitters.sketch.table = np.array(hitters_data['sketch'], dtype=np.int64)
+            hitters.total = hitters_data['total']
+        profile.lengths = {name: np.array(bins, dtype=np.int64) for name, bins in data['lengths'].items()}
+        profile.length_sums = data['length_sums']
+        # json writes inf as Infinity, which it reads back
+        profile.features = data['features']
+        return profile
+
+
+def save_profile(profile: CorpusProfile, profile_path: str) -> None:
+    '''
+    Save a profile as json, the file is replaced atomically
+    param profile: CorpusProfile, the profile to save
+    param profile_path: str, the path to save the profile to
+    '''
+    temporary_path: str = f'{profile_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump(profile.to_dict(), file)
+    os.replace(temporary_path, profile_path)
+
+
+def load_profile(profile_path: str) -> CorpusProfile:
+    '''
+    Load a profile saved with save_profile
+    param profile_path: str, the path to the saved profile
+    '''
+    with open(profile_path, 'r') as file:
+        return CorpusProfile.from_dict(json.load(file))
+
+
+def profile_docs(docs: Iterator[Doc], capacity: int = CAPACITY, fast_semantics: bool = False) -> CorpusProfile:
+    '''
+    Profile parsed texts, they are not kept, so a generator of docs is profiled in bounded memory
+    param docs: Iterator[Doc], the parsed texts
+    param capacity: int, the amount of Space-Saving counters per heavy hitter summary
+    param fast_semantics: bool, whether the coreference values are estimated without fastcoref
+    '''
+    profile = CorpusProfile(capacity, fast_semantics)
+    for doc in docs:
+        profile.add(doc)
+    return profile
+
+
+def stream_docs(file_path: str, nlp: Any, records: Tuple[int | None, int | None] = (None, None)) -> Iterator[Doc]:
+    '''
+    Parse the texts of a corpus while it is read, compressed or not, a pre-parsed corpus is completed instead
+    param file_path: str, the path to the corpus
+    param nlp: Language, the loaded spacy model
+    param records: Tuple[int | None, int | None], the start and stop of the records to parse, by default all of them
+    '''
+    from itertools import islice
+    from corpus import iter_records
+    from preparsed import is_preparsed, read_parsed, complete_docs
+
+    if is_preparsed(file_path):
+        yield from complete_docs(read_parsed(file_path, nlp.vocab)[slice(*records)], nlp)
+        return
+    entries = islice(iter_records(file_path, background=True), *records)
+    yield from nlp.pipe(entry['text'] for entry in entries if 'text' in entry and entry['text'].strip())
+
+
+def write_profile(profile: CorpusProfile, amount: int = 10) -> None:
+    '''
+    Print the most common values, the length distributions and the feature summaries
+    param profile: CorpusProfile, the profile to print
+    param amount: int, the amount of most common values to print
+    '''
+    print(f'{profile.documents} texts')
+    for name, hitters in profile.hitters.items():
+        print(f'\nThe most common {name} of {hitters.total}:')
+        for item, count, error in hitters.top(amount):
+            print(f'{item!r:<24}{count:>10}{f" (at most {error} too high)" if error else "":>28}')
+
+    if not profile.documents:
+        return
+    print(f'\n{"length":<16}{"mean":>10}{"median":>10}{"90%":>10}{"99%":>10}')
+    for name in LENGTHS:
+        quantiles = [profile.get_length_quantile(name, share) for share in (0.5, 0.9, 0.99)]
+        print(f'{name:<16}{profile.length_sums[name] / profile.documents:>10.1f}' + ''.join(f'{f"<={quantile}":>10}' for quantile in quantiles))
+
+    print(f'\n{"feature":<32}{"texts":>8}{"mean":>10}{"std":>10}{"min":>10}{"max":>10}')
+    for feature in profile.features:
+        amount, mean, deviation, minimum, maximum = profile.get_feature_summary(feature)
+        print(f'{feature:<32}{amount:>8}{mean:>10.3f}{deviation:>10.3f}{minimum:>10.3f}{maximum:>10.3f}')
+
+
+def create_parser():
+    '''
+    Create the parser for the command line arguments
+    '''
+    from corpus import parse_record_range
+
+    parser = argparse.ArgumentParser(description='profile a corpus in bounded memory, or merge the profiles of its shards')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    corpus = subparsers.add_parser('corpus', help='profile a corpus, or a range of its records')
+    corpus.add_argument('corpus', type=str, help='Path to the corpus, jsonl (compressed or not), .spacy or .conllu')
+    corpus.add_argument('--records', metavar='<start:stop>', type=parse_record_range, default=(None, None),
+                        help='Only profile these records, a number like 17 or a range like 1000:2000')
+    corpus.add_argument('--capacity', metavar='<counters>', type=int, default=CAPACITY,
+                        help='The amount of Space-Saving counters per summary, every value more common than 1 in capacity is found')
+    corpus.add_argument('--fast-semantics', action='store_true',
+                        help='Estimate the coreference values without fastcoref, see semantics.estimate_coreference')
+
+    merge = subparsers.add_parser('merge', help='merge the saved profiles of shards')
+    merge.add_argument('profiles', metavar='profile', type=str, nargs='+', help='Path to a profile saved with -o')
+
+    for subparser in (corpus, merge):
+        subparser.add_argument('-o', '--output', metavar='<profile>', type=str, default=None,
+                               help='Save the profile as json, to merge it later')
+        subparser.add_argument('--top', metavar='<amount>', type=int, default=10,
+                               help='The amount of most common values to print')
+    return parser.parse_args()
+
+
+def main():
+
+    args = create_parser()
+
+    if args.command == 'corpus':
+        from preprocessor import load_spacy_model
+        nlp = load_spacy_model(not args.fast_semantics)
+        profile = profile_docs(stream_docs(args.corpus, nlp, args.records), args.capacity, args.fast_semantics)
+
+    elif args.command == 'merge':
+        profile = load_profile(args.profiles[0])
+        for profile_path in args.profiles[1:]:
+            profile.merge(load_profile(profile_path))
+
+    write_profile(profile, args.top)
+    if args.output:
+        save_profile(profile, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,395 @@
+# Program name: runner.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# Resumable batch runner for long scoring runs. The prompt file is split into shards of records,
+# the shards are scored by a pool of worker processes and every shard's predictions are written
+# atomically to the output directory. When a run is restarted, the shards that are already written
+# are skipped, so a crash only loses the shards that were being scored at that moment.
+# At the end the shard files are merged and the classification report is computed from them.
+# With --zygote the spacy pipeline, WordNet and the model are loaded once in this process, the heap is
+# frozen (gc.freeze) and the workers are forked from it, so they share that memory copy-on-write
+# instead of every worker loading its own copy. A forked worker cannot use CUDA or the thread pools of its
+# parent, so then fastcoref runs on the cpu with one thread, and a new model is trained in a separate process.
+# Without --zygote the workers are spawned, not forked, because the model may be trained in this process.
+#
+# python3 runner.py prompts.jsonl -o predictions/ -t human.jsonl group1.jsonl --shard-size 500 --workers 4 --zygote
+
+# import our modules
+from corpus import count_records, get_file_signature
+from preparsed import is_preparsed
+from detector import get_analyzer_votes, get_predicion, train_detector, save_model, load_model
+
+# import the supporting packages
+import argparse
+import gc
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+# the name of the run description, the trained model and the merged predictions in the output directory
+RUN_FILE: str = 'run.json'
+MODEL_FILE: str = 'model.json'
+PREDICTIONS_FILE: str = 'predictions.jsonl'
+
+# the spacy model and the model of a worker process, loaded once by init_worker or preload,
+# and how long the worker took to start
+worker_nlp = None
+worker_model: Dict[str, Any] | None = None
+worker_startup: float = 0.0
+
+
+def get_shards(prompt_path: str, shard_size: int) -> List[Tuple[int, int]]:
+    '''
+    Split the records of the prompt file into shards
+    param prompt_path: str, the path to the prompt data
+    param shard_size: int, the amount of records per shard
+    return: List[Tuple[int, int]], the first and the after-last record of every shard
+    '''
+    # the records are counted with the offset index of a jsonl file, a pre-parsed file has no lines to count
+    if is_preparsed(prompt_path):
+        raise ValueError(f'{prompt_path}, runner.py splits jsonl prompt files, pre-parsed prompts can be scored with main.py')
+    record_amount: int = count_records(prompt_path)
+    return [(start, min(start + shard_size, record_amount)) for start in range(0, record_amount, shard_size)]
+
+
+def get_shard_path(output_dir: str, number: int) -> str:
+    '''
+    Get the path of the predictions of a shard
+    param output_dir: str, the output directory
+    param number: int, the number of the shard
+    '''
+    return os.path.join(output_dir, f'shard-{number:05}.jsonl')
+
+
+def write_atomically(path: str, lines: List[str]) -> None:
+    '''
+    Write lines to a file through a temporary file, so the file either does not exist or is complete
+    param path: str, the path to write to
+    param lines: List[str], the lines to write, without newlines
+    '''
+    temporary_path: str = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as file:
+        for line in lines:
+            file.write(line + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+def get_model_hash(model: Dict[str, Any]) -> str:
+    '''
+    Get a hash of a model, the same for a trained model and the model after save_model and load_model
+    param model: Dict[str, Any], the model from detector.train_detector
+    '''
+    return hashlib.sha256(json.dumps(model, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def check_run(output_dir: str, prompt_path: str, shard_size: int, model: Dict[str, Any]) -> None:
+    '''
+    Check that the shards in the output directory belong to the same prompt file, shard size and model,
+    a new output directory gets the description of this run
+    param output_dir: str, the output directory
+    param prompt_path: str, the path to the prompt data
+    param shard_size: int, the amount of records per shard
+    param model: Dict[str, Any], the model the shards are scored with
+    '''
+    run: Dict[str, Any] = {
+        'prompt': get_file_signature(prompt_path),
+        'shard_size': shard_size,
+        'model': get_model_hash(model),
+        'fast_semantics': model['fast_semantics'],
+    }
+    run_path: str = os.path.join(output_dir, RUN_FILE)
+    if os.path.exists(run_path):
+        with open(run_path, 'r') as file:
+            if json.load(file) != run:
+                raise ValueError(f'{output_dir} holds the shards of another prompt file, shard size or model, use a new output directory')
+    else:
+        write_atomically(run_path, [json.dumps(run)])
+
+
+def init_worker(coref: bool, started: float | None = None) -> None:
+    '''
+    Load the spacy model once per worker process, a forked zygote worker already has it
+    param coref: bool, whether to add the fastcoref component
+    param started: float, the time.monotonic() at which the pool was started, to measure the startup time
+    '''
+    global worker_nlp, worker_startup
+    if worker_nlp is None:
+        from preprocessor import load_spacy_model
+        worker_nlp = load_spacy_model(coref)
+    if started is not None:
+        worker_startup = time.monotonic() - started
+
+
+def check_fork_safety() -> None:
+    '''
+    Check that this process can be forked: a forked child cannot use CUDA once the parent initialized it
+    '''
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_initialized():
+        raise RuntimeError('CUDA is initialized in this process, so the workers cannot be forked from it, '
+                           'run without --zygote or train the model with -m first')
+
+
+def preload(model: Dict[str, Any], coref: bool) -> None:
+    '''
+    Load everything the workers need in this process and freeze the heap, before the workers are forked.
+    The frozen objects are left alone by the garbage collector, so the workers do not write to
+    (and copy) the pages they share with this process.
+    fastcoref runs on the cpu with one torch thread, a forked child cannot use CUDA or the thread pools of its parent.
+    param model: Dict[str, Any], the model from detector.train_detector
+    param coref: bool, whether to add the fastcoref component
+    '''
+    global worker_nlp, worker_model
+    from preprocessor import load_spacy_model, get_wordnet
+    from sentiment import load_lexicon
+
+    check_fork_safety()
+    worker_nlp = load_spacy_model(coref, device='cpu', threads=1)
+    worker_model = model
+    # WordNet and the sentiment lexicon load lazily, on their first use
+    get_wordnet().synsets('be', pos='v')
+    load_lexicon()
+    gc.collect()
+    gc.freeze()
+
+
+def get_worker_memory() -> Dict[str, float]:
+    '''
+    Get the memory of this process from /proc/self/smaps_rollup: the unique memory (USS), which is
+    freed when the process ends, and the proportional memory (PSS), which divides shared pages over their sharers
+    return: Dict[str, float], the USS and the PSS in megabytes, empty when /proc is not available
+    '''
+    memory: Dict[str, float] = {}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as file:
+            for line in file:
+                name, _, value = line.partition(':')
+                if name in ('Private_Clean', 'Private_Dirty'):
+                    memory['uss'] = memory.get('uss', 0.0) + int(value.split()[0]) / 1024
+                elif name == 'Pss':
+                    memory['pss'] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return memory
+
+
+def score_shard(prompt_path: str, records: Tuple[int, int], shard_path: str, model: Dict[str, Any] | None = None) -> Tuple[int, Dict[str, Any]]:
+    '''
+    Score the records of one shard and write the predictions to the shard file
+    param prompt_path: str, the path to the prompt data
+    param records: Tuple[int, int], the first and the after-last record of the shard
+    param shard_path: str, the path to write the predictions of the shard to
+    param model: Dict[str, Any], the model from detector.train_detector, by default the preloaded one
+    return: Tuple[int, Dict[str, Any]], the amount of scored prompts, and the process id, startup time and memory of the worker
+    '''
+    from preprocessor import parse_prompt_data, Path
+
+    model = model or worker_model
+    prompts = parse_prompt_data(Path(prompt_path), nlp=worker_nlp, records=records)
+    votes = get_analyzer_votes(model, prompts) # type: ignore
+    lines: List[str] = []
+    for prompt, prompt_votes in zip(prompts, zip(*votes.values())):
+        result: Dict[str, Any] = {
+            'id': prompt.get('id'),
+            'by': prompt['by'],
+            'prediction': get_predicion(*prompt_votes),
+            'votes': dict(zip(votes, prompt_votes)),
+        }
+        lines.append(json.dumps(result))
+    write_atomically(shard_path, lines)
+    return len(lines), {'pid': os.getpid(), 'startup': worker_startup, **get_worker_memory()}
+
+
+def train_model(training: List[str], coref: bool, model_path: str) -> None:
+    '''
+    Train a model on the training data and save it
+    param training: List[str], the paths to the human and machine training data
+    param coref: bool, whether to run the fastcoref component
+    param model_path: str, the path to save the model to
+    '''
+    from preprocessor import get_and_parse_texts, Path
+    human, machine = get_and_parse_texts(Path(training[0]), Path(training[1]), coref)
+    save_model(train_detector(human, machine, not coref, drift=True), model_path)
+
+
+def get_model(output_dir: str, model_path: str | None, training: List[str], coref: bool, isolated: bool = False) -> Dict[str, Any]:
+    '''
+    Get the model for the run: a given model file, the model of an earlier attempt of this run,
+    or a new model trained on the training data and saved to the output directory
+    param output_dir: str, the output directory
+    param model_path: str, the path to a saved model, if any
+    param training: List[str], the paths to the human and machine training data
+    param coref: bool, whether to run the fastcoref component
+    param isolated: bool, whether a new model is trained in a separate process, so torch (and CUDA) is not loaded in this one
+    '''
+    if model_path:
+        return load_model(model_path)
+    run_model_path: str = os.path.join(output_dir, MODEL_FILE)
+    if os.path.exists(run_model_path):
+        print(f'Using the model of the earlier run, {run_model_path}')
+        return load_model(run_model_path)
+
+    if isolated:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            pool.submit(train_model, training, coref, run_model_path).result()
+    else:
+        train_model(training, coref, run_model_path)
+    return load_model(run_model_path)
+
+
+def merge_shards(output_dir: str, shard_amount: int) -> List[Dict[str, Any]]:
+    '''
+    Merge the shard files into one predictions file
+    param output_dir: str, the output directory
+    param shard_amount: int, the amount of shards
+    return: List[Dict[str, Any]], the predictions of all shards
+    '''
+    results: List[Dict[str, Any]] = []
+    lines: List[str] = []
+    for number in range(shard_amount):
+        with open(get_shard_path(output_dir, number), 'r') as file:
+            for line in file:
+                lines.append(line.rstrip('\n'))
+                results.append(json.loads(line))
+    write_atomically(os.path.join(output_dir, PREDICTIONS_FILE), lines)
+    return results
+
+
+def write_report(results: List[Dict[str, Any]]) -> None:
+    '''
+    Print the classification report of the merged predictions
+    param results: List[Dict[str, Any]], the predictions of all shards
+    '''
+    from sklearn.metrics import classification_report, confusion_matrix
+
+    true_labels: List[str] = [result['by'] for result in results]
+    pred_labels: List[str] = [result['prediction'] for result in results]
+    print('The final classification report is: \n')
+    print(classification_report(true_labels, pred_labels, labels=['AI', 'Human'], zero_division=0))
+    matrix = confusion_matrix(true_labels, pred_labels, labels=['AI', 'Human'])
+    print('the confusion matrix is: \n', matrix)
+
+
+def write_workers(workers: Dict[int, Dict[str, Any]]) -> None:
+    '''
+    Print the startup time and the memory of every worker
+    param workers: Dict[int, Dict[str, Any]], the last statistics of every worker, by process id
+    '''
+    print(f'\n{"worker":>8}{"startup":>10}{"USS":>10}{"PSS":>10}')
+    for pid, worker in workers.items():
+        print(f'{pid:>8}{worker["startup"]:>9.2f}s{worker.get("uss", 0.0):>8.0f}MB{worker.get("pss", 0.0):>8.0f}MB')
+    print()
+
+
+def run(prompt_path: str, output_dir: str, model: Dict[str, Any], shard_size: int, workers: int,
+        zygote: bool = False) -> List[Dict[str, Any]]:
+    '''
+    Score all shards that are not written yet and merge the shard files
+    param prompt_path: str, the path to the prompt data
+    param output_dir: str, the output directory
+    param model: Dict[str, Any], the model from detector.train_detector
+    param shard_size: int, the amount of records per shard
+    param workers: int, the amount of worker processes
+    param zygote: bool, whether to fork the workers from this process after preloading, see preload
+    return: List[Dict[str, Any]], the predictions of all shards
+    '''
+    # the prompts are parsed the way the model was trained, with or without fastcoref
+    coref: bool = not model['fast_semantics']
+    shards = get_shards(prompt_path, shard_size)
+    todo = [(number, records) for number, records in enumerate(shards)
+            if not os.path.exists(get_shard_path(output_dir, number))]
+    print(f'{len(shards) - len(todo)} of {len(shards)} shards are already done')
+
+    if workers <= 1:
+        init_worker(coref)
+        for number, records in todo:
+            amount, _ = score_shard(prompt_path, records, get_shard_path(output_dir, number), model)
+            print(f'Shard {number} is done ({amount} prompts)')
+    elif todo:
+        if zygote:
+            preload(model, coref)
+            context = multiprocessing.get_context('fork')
+            shard_model = None
+        else:
+            # this process may have trained the model with fastcoref, a forked worker would inherit the state of
+            # the torch thread pool (and CUDA) and can hang, so the workers start fresh and load their own pipeline
+            context = multiprocessing.get_context('spawn')
+            shard_model = model
+
+        worker_statistics: Dict[int, Dict[str, Any]] = {}
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                     initargs=(coref, time.monotonic())) as pool:
+                futures = {pool.submit(score_shard, prompt_path, records, get_shard_path(output_dir, number), shard_model): number
+                           for number, records in todo}
+                for future, number in futures.items():
+                    amount, worker = future.result()
+                    worker_statistics[worker['pid']] = worker
+                    print(f'Shard {number} is done ({amount} prompts)')
+        finally:
+            if zygote:
+                gc.unfreeze()
+        write_workers(worker_statistics)
+
+    return merge_shards(output_dir, len(shards))
+
+
+def parse_prompt_path(value: str) -> str:
+    '''
+    Check that the prompt file can be split into shards, it has to be a jsonl file, optionally compressed
+    param value: str, the path as given on the command line
+    '''
+    if is_preparsed(value):
+        raise argparse.ArgumentTypeError(f'{value}, runner.py splits jsonl prompt files, pre-parsed prompts can be scored with main.py')
+    return value
+
+
+def create_parser():
+    '''
+    Create the parser for the command line arguments
+    '''
+    parser = argparse.ArgumentParser(description='resumable sharded scoring of a prompt file')
+    parser.add_argument('prompt', metavar="prompt data", type=parse_prompt_path,
+                        help='Path to the prompt data jsonl file')
+    parser.add_argument('-o', '--output', metavar='<directory>', type=str, required=True,
+                        help='The directory for the shard predictions, the model and the merged predictions')
+    parser.add_argument('-t', '--training', metavar=('<human_data>', '<machine_data>'), nargs=2, type=str,
+                        default=['human.jsonl', 'group1.jsonl'], help='Path to the human and machine data jsonl file')
+    parser.add_argument('-m', '--model', metavar='<model>', type=str, default=None,
+                        help='Path to a saved model, instead of training one')
+    parser.add_argument('--shard-size', metavar='<records>', type=int, default=500,
+                        help='The amount of records per shard')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='The amount of worker processes')
+    parser.add_argument('--zygote', action='store_true',
+                        help='Load the pipeline and the model once and fork the workers from it, they share that memory')
+    parser.add_argument('--fast-semantics', action='store_true',
+                        help='Estimate the coreference values without fastcoref, see semantics.estimate_coreference')
+    return parser.parse_args()
+
+
+def main():
+
+    args = create_parser()
+    os.makedirs(args.output, exist_ok=True)
+
+    # the workers parse the prompts the way the model was trained, with or without fastcoref
+    model = get_model(args.output, args.model, args.training, not args.fast_semantics, args.zygote)
+    if model['fast_semantics'] != args.fast_semantics:
+        print(f'The model is trained {"without" if model["fast_semantics"] else "with"} fastcoref, the prompts are parsed the same way')
+
+    check_run(args.output, args.prompt, args.shard_size, model)
+    results = run(args.prompt, args.output, model, args.shard_size, args.workers, args.zygote)
+    write_report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# Program name: scheduler.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# A small stage scheduler. Every stage declares a function and the names of its inputs, which are
+# either shared data (the parsed docs) or the results of other stages. Stages whose inputs are ready
+# run concurrently in a process pool. The shared data is not pickled: the pool is forked after the
+# data is set, so the workers inherit the docs and their cached feature arrays, and only the small
+# results of the stages are sent back. After the run the critical path shows which chain of stages
+# decides the total time, see detector.get_stages for the stages of the four analyzers.
+# The pool is forked after spacy, and torch for fastcoref, are loaded. A forked worker cannot use the
+# thread pools or CUDA of its parent, so torch is set to one thread while the workers run, and the
+# stages themselves must not use torch: they work on the docs that are already parsed.
+
+# import the supporting packages
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+
+class Stage(NamedTuple):
+    '''
+    A step of the schedule
+    param name: str, the name of the stage, other stages use it as input
+    param function: Callable, the function of the stage, a module level function so it can be sent to a worker
+    param inputs: Tuple[str, ...], the names of the shared data and stages passed to the function, in order
+    '''
+    name: str
+    function: Callable
+    inputs: Tuple[str, ...]
+
+
+# the data the stages share, set by run_stages before the worker processes are forked
+shared_data: Dict[str, Any] = {}
+
+
+def run_stage(function: Callable, inputs: Tuple[str, ...], results: Dict[str, Any]) -> Tuple[Any, float, float]:
+    '''
+    Run one stage, the inputs are looked up in the results of the earlier stages and in the shared data
+    param function: Callable, the function of the stage
+    param inputs: Tuple[str, ...], the names of the inputs of the stage
+    param results: Dict[str, Any], the results of the stages this stage needs
+    return: Tuple[Any, float, float], the result and the start and end time of the stage
+    '''
+    start: float = time.monotonic()
+    arguments = [results[name] if name in results else shared_data[name] for name in inputs]
+    result = function(*arguments)
+    return result, start, time.monotonic()
+
+
+def check_stages(stages: List[Stage], data: Dict[str, Any]) -> None:
+    '''
+    Check that every input of a stage is shared data or another stage, and that the stages have no cycle
+    param stages: List[Stage], the stages to check
+    param data: Dict[str, Any], the shared data
+    '''
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError('Every stage needs a unique name')
+    for stage in stages:
+        for name in stage.inputs:
+            if name not in data and name not in names:
+                raise ValueError(f'The input {name} of stage {stage.name} is no shared data or stage')
+
+    done = set(data)
+    todo = list(stages)
+    while todo:
+        ready = [stage for stage in todo if done.issuperset(stage.inputs)]
+        if not ready:
+            raise ValueError(f'The stages {", ".join(stage.name for stage in todo)} depend on each other')
+        done.update(stage.name for stage in ready)
+        todo = [stage for stage in todo if stage not in ready]
+
+
+def run_stages(stages: List[Stage], data: Dict[str, Any], workers: int = 1) -> Tuple[Dict[str, Any], Dict[str, Tuple[float, float]]]:
+    '''
+    Run the stages, concurrently in a pool of forked worker processes if workers is more than 1.
+    Without fork (on Windows) the stages run one after another in this process. The stages may not use
+    torch or CUDA, the forked workers do not have the thread pools of this process.
+    param stages: List[Stage], the stages to run
+    param data: Dict[str, Any], the shared data, by name
+    param workers: int, the amount of worker processes
+    return: Tuple[Dict[str, Any], Dict[str, Tuple[float, float]]], the result and the start and end time of every stage
+    '''
+    global shared_data
+    check_stages(stages, data)
+    results: Dict[str, Any] = {}
+    times: Dict[str, Tuple[float, float]] = {}
+    todo = list(stages)
+
+    def get_inputs(stage: Stage) -> Dict[str, Any]:
+        return {name: results[name] for name in stage.inputs if name in results}
+
+    def is_ready(stage: Stage) -> bool:
+        return all(name in results or name in data for name in stage.inputs)
+
+    shared_data = data
+    try:
+        if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            while todo:
+                stage = next(stage for stage in todo if is_ready(stage))
+                todo.remove(stage)
+                results[stage.name], start, end = run_stage(stage.function, stage.inputs, get_inputs(stage))
+                times[stage.name] = (start, end)
+        else:
+            # torch is only loaded with fastcoref, its thread pool does not survive the fork, so the workers use one thread
+            torch = sys.modules.get('torch')
+            threads: int = torch.get_num_threads() if torch is not None else 0
+            if torch is not None:
+                torch.set_num_threads(1)
+            try:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                    running = {}
+                    while todo or running:
+                        for stage in [stage for stage in todo if is_ready(stage)]:
+                            todo.remove(stage)
+                            running[pool.submit(run_stage, stage.function, stage.inputs, get_inputs(stage))] = stage.name
+                        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            name = running.pop(future)
+                            results[name], start, end = future.result()
+                            times[name] = (start, end)
+            finally:
+                if torch is not None:
+                    torch.set_num_threads(threads)
+    finally:
+        shared_data = {}
+
+    return results, times
+
+
+def get_critical_path(stages: List[Stage], times: Dict[str, Tuple[float, float]]) -> Tuple[float, List[str]]:
+    '''
+    Find the chain of dependent stages with the longest total duration, no schedule can be faster than it
+    param stages: List[Stage], the stages that were run
+    param times: Dict[str, Tuple[float, float]], the start and end time of every stage
+    return: Tuple[float, List[str]], the duration and the stages of the critical path
+    '''
+    paths: Dict[str, Tuple[float, List[str]]] = {}
+    todo = list(stages)
+    while todo:
+        for stage in [stage for stage in todo if all(name in paths or name not in times for name in stage.inputs)]:
+            todo.remove(stage)
+            before = max((paths[name] for name in stage.inputs if name in paths), default=(0.0, []))
+            start, end = times[stage.name]
+            paths[stage.name] = (before[0] + end - start, before[1] + [stage.name])
+
+    return max(paths.values(), default=(0.0, []))
+
+
+def write_schedule(stages: List[Stage], times: Dict[str, Tuple[float, float]]) -> None:
+    '''
+    Print the duration of every stage, the critical path and the total time
+    param stages: List[Stage], the stages that were run
+    param times: Dict[str, Tuple[float, float]], the start and end time of every stage
+    '''
+    if not times:
+        return
+    first_start: float = min(start for start, _ in times.values())
+    wall_time: float = max(end for _, end in times.values()) - first_start
+    stage_time: float = sum(end - start for start, end in times.values())
+    path_time, path = get_critical_path(stages, times)
+
+    print(f'{"stage":<24}{"start":>10}{"duration":>10}')
+    for stage in stages:
+        start, end = times[stage.name]
+        print(f'{stage.name:<24}{start - first_start:>9.2f}s{end - start:>9.2f}s')
+    print(f'\nThe critical path is {" -> ".join(path)} ({path_time:.2f}s)')
+    print(f'The stages took {wall_time:.2f}s, {stage_time:.2f}s one after another')
@@ -4,21 +4,75 @@
 
 # Tieme, Joris #
 
-from preprocessor import get_and_parse_texts, Path, parse_prompt_data
+from preprocessor import get_and_parse_texts, Path, parse_prompt_data, get_wordnet
+from features import get_doc_array, count_sentences, count_entities, get_verb_lemmas, POS_COLUMN
 from typing import Tuple, List, Dict, Literal
 from spacy.tokens import Doc
-from fastcoref import spacy_component
 from collections import Counter
-from nltk.corpus import wordnet as wn
-import nltk
+from functools import lru_cache
+from spacy.symbols import PRON # type: ignore
+import numpy as np
 
+# Third person pronouns, the ones the fast coreference estimate links to a preceding named entity.
+THIRD_PERSON_PRONOUNS = {'he', 'him', 'his', 'himself', 'she', 'her', 'hers', 'herself',
+                         'it', 'its', 'itself', 'they', 'them', 'their', 'theirs', 'themselves'}
 
-def perform_analysis(texts: List[Doc]):
+# the key under which the values of perform_analysis_single are cached in doc.user_data, per fast setting,
+# so the voting, the training profile and the drift monitor count the values of a doc once
+VALUES_KEY = 'pta_semantics'
+
+
+@lru_cache(maxsize=None)
+def count_verb_synsets(lemma: str) -> int:
+    ''' Returns the amount of WordNet verb synsets of a lemma. The result is cached,
+       because the same verbs come back in almost every text. '''
+
+    wn = get_wordnet()
+    return len(wn.synsets(lemma, pos=wn.VERB))
+
+
+def estimate_coreference(doc: Doc) -> Tuple[int, int]:
+    ''' This function estimates the amount of coreference clusters and references of a doc
+       without the fastcoref component, see estimate_coreference_clusters. '''
+
+    cluster_sizes = [len(cluster) for cluster in estimate_coreference_clusters(doc)]
+    return len(cluster_sizes), sum(cluster_sizes)
+
+
+def estimate_coreference_clusters(doc: Doc) -> List[List[int]]:
+    ''' This function estimates the coreference clusters of a doc without the fastcoref
+       component, using only the parser and NER of en_core_web_sm.
+       Named entities with the same text are counted as one cluster, and every third person
+       pronoun is counted as a reference to the most recently mentioned named entity.
+       Only entities that are referred to at least twice form a cluster, like in fastcoref.
+       Every cluster is returned as the token indices of its references. '''
+
+    # Collect the mentions in order of appearance: (token index, entity text or None for a pronoun).
+    mentions = [(ent.start, ent.text.lower()) for ent in doc.ents]
+    array = get_doc_array(doc)
+    for index in np.flatnonzero(array[:, POS_COLUMN] == PRON):
+        if doc[int(index)].lower_ in THIRD_PERSON_PRONOUNS:
+            mentions.append((int(index), None))
+    mentions.sort(key=lambda mention: mention[0])
+
+    references: Dict[str, List[int]] = {}
+    last_entity = None
+    for index, entity in mentions:
+        if entity is not None:
+            last_entity = entity
+        if last_entity is not None:
+            references.setdefault(last_entity, []).append(index)
+
+    return [cluster for cluster in references.values() if len(cluster) >= 2]
+
+
+def perform_analysis(texts: List[Doc], fast: bool = False):
     ''' This function performs a few analyses on each doc within a list of docs.
        These are: calculating the amount of references per coreference cluster,
        calculating the average amount of Named Entities per sentence, and
        calculating the average synsets per verb. These values are then returned,
-       to be used to compute the separator values. '''
+       to be used to compute the separator values. If fast is set, the coreference
+       values are estimated without fastcoref, see estimate_coreference. '''
 
     total_reference_amount = 0
     total_coref_amount = 0
@@ -30,7 +84,7 @@ def perform_analysis(texts: List[Doc]):
     # For each doc, retrieve a bunch of values, and add them to their specific total.
     # These totals are then used to calculate the variables that will be returned by this function.
     for doc in texts:
-        coref_amount, reference_amount, sentence_amount, NE_amount, verb_amount, synset_amount = perform_analysis_single(doc)
+        coref_amount, reference_amount, sentence_amount, NE_amount, verb_amount, synset_amount = perform_analysis_single(doc, fast)
         amount_of_sentences += sentence_amount
         amount_of_NEs += NE_amount
         total_coref_amount += coref_amount
@@ -46,7 +100,7 @@ def perform_analysis(texts: List[Doc]):
     return references_per_cluster, average_NE_sentence, synsets_per_verb
 
 
-def perform_analysis_single(doc:Doc):
+def perform_analysis_single(doc:Doc, fast: bool = False):
     ''' This function is similar to perform_analysis, but is specific to a single doc.
        The main difference lies in the fact that this single analysis function is used
        to analyze test data one by one, while the average values calculated in
@@ -55,31 +109,47 @@ def perform_analysis_single(doc:Doc):
     # Retrieve a bunch of values, which are later compared to separator values
     # if test data is used, in order to determine whether a text is human or AI.
     # If the function is used by perform_analysis, the data is used to create these separators.
+    # The token attributes come from the shared attribute array of the doc,
+    # so every verb lemma only has to be looked up in WordNet once.
+    cached = doc.user_data.get((VALUES_KEY, fast))
+    if cached is not None:
+        return cached
+
     synset_amount = 0
-    sentence_amount = len(list(doc.sents))
-    NE_amount = len(list(doc.ents))
-    coref_amount = len(list(doc._.coref_clusters))
-    reference_amount = len(list(reference for cluster in doc._.coref_clusters for reference in cluster))
-    verb_amount = len(list(word for word in doc if word.pos_ == "VERB"))
+    sentence_amount = count_sentences(doc)
+    NE_amount = count_entities(doc)
+    if fast:
+        coref_amount, reference_amount = estimate_coreference(doc)
+    else:
+        coref_amount = len(list(doc._.coref_clusters))
+        reference_amount = len(list(reference for cluster in doc._.coref_clusters for reference in cluster))
+    verb_lemmas = get_verb_lemmas(doc)
+    verb_amount = sum(verb_lemmas.values())
 
-    for word in doc:
-        if word.pos_ == "VERB":
-            lemma = word.lemma_
-            synsets = wn.synsets(lemma, pos=wn.VERB)
-            synset_amount += len(synsets)
+    for lemma, amount in verb_lemmas.items():
+        synset_amount += amount * count_verb_synsets(lemma)
 
-    return coref_amount, reference_amount, sentence_amount, NE_amount, verb_amount, synset_amount
+    values = (coref_amount, reference_amount, sentence_amount, NE_amount, verb_amount, synset_amount)
+    doc.user_data[(VALUES_KEY, fast)] = values
+    return values
 
 
-def do_semantic_analysis(human_texts: List[Doc], machine_texts: List[Doc]):
+def do_semantic_analysis(human_texts: List[Doc], machine_texts: List[Doc], fast: bool = False):
     ''' This function uses values calculated by perform_analysis 
        to calculate separator values based on the average of the human
        and machine text values.'''
     
     # Retrieve values for both machine and human texts
     # which will then be used to calculate separator values.
-    machine_reference_amount, machine_NE_sentence, machine_synsets_verb = perform_analysis(machine_texts)
-    human_reference_amount, human_NE_sentence, human_synsets_verb = perform_analysis(human_texts)
+    return get_separators(perform_analysis(machine_texts, fast), perform_analysis(human_texts, fast))
+
+
+def get_separators(machine_values: Tuple[float, float, float], human_values: Tuple[float, float, float]):
+    ''' This function calculates the separator values from the values perform_analysis
+       returns for the machine and the human texts, so both can be analyzed separately.'''
+
+    machine_reference_amount, machine_NE_sentence, machine_synsets_verb = machine_values
+    human_reference_amount, human_NE_sentence, human_synsets_verb = human_values
 
     # Calculate separator values for each classification category.
     separator_value_NE_sentence = (machine_NE_sentence + human_NE_sentence) / 2
@@ -103,7 +173,7 @@ def human_or_ai(value_to_divide_by:int, value_to_divide:int, separator:float):
             return "AI"
 
 
-def get_semantic_results(separators:tuple[float, float, float], prompts: List[Dict[str, Doc | str]]) -> List[Tuple[Literal['Human', 'Unsure', 'AI'], float]]:
+def get_semantic_results(separators:tuple[float, float, float], prompts: List[Dict[str, Doc | str]], fast: bool = False) -> List[Tuple[Literal['Human', 'Unsure', 'AI'], float]]:
     ''' This function takes as input a list of prompts (test data). These prompts are then
        analyzed individually and compared to the patterns found in the training data.
        The function then makes a decision of Human or AI based on the values found;
@@ -111,45 +181,52 @@ def get_semantic_results(separators:tuple[float, float, float], prompts: List[Di
        assigned. In the end, the list of answers is returned, to be used by the main program
        in order to assign a definitive label. '''
 
-    human_counter = 0
-    ai_counter = 0
-    separator_NE_sentence, separator_references, separator_synsets_verb = separators
     answers = []
     for prompt in prompts:
         # Retrieve required values for this prompt.
-        coref_current, references_current, sentences_current, NE_current, verbs_current, synsets_current = perform_analysis_single(prompt['text']) # type: ignore
-
-        if human_or_ai(sentences_current, NE_current, separator_NE_sentence) == "Human":
-            human_counter +=1
-        else:
-            ai_counter += 1
+        values = perform_analysis_single(prompt['text'], fast) # type: ignore
+        answers.append(semantic_decider(values, separators))
 
-        if human_or_ai(coref_current, references_current, separator_references) == "Human":
-            human_counter +=1
-        else:
-            ai_counter += 1
+    return answers
 
-        if human_or_ai(verbs_current, synsets_current, separator_synsets_verb) == "Human":
-            human_counter +=1
-        else:
-            ai_counter += 1
-
-        # Here, certainty is calculated based on the amount of classification 
-        # categories that assigned the same label to the text.
-        max_score = 3
-        guessed = max(human_counter, ai_counter)
-        certainty = guessed / max_score
-        if human_counter > ai_counter:
-            answers.append(("Human", certainty))
-        elif human_counter == ai_counter:
-            answers.append(("Unsure", certainty))
-        else:
-            answers.append(("AI", certainty))
 
-        human_counter = 0
-        ai_counter = 0
+def semantic_decider(values: Tuple[int, int, int, int, int, int], separators: tuple[float, float, float]) -> Tuple[Literal['Human', 'Unsure', 'AI'], float]:
+    ''' This function makes the decision of Human or AI for one text, based on the values
+       returned by perform_analysis_single (or the same values for a part of a text).
+       Every classification category compares its value to its separator, and the label
+       that most categories point to is returned, together with the certainty. '''
 
-    return answers
+    human_counter = 0
+    ai_counter = 0
+    separator_NE_sentence, separator_references, separator_synsets_verb = separators
+    coref_current, references_current, sentences_current, NE_current, verbs_current, synsets_current = values
+
+    if human_or_ai(sentences_current, NE_current, separator_NE_sentence) == "Human":
+        human_counter +=1
+    else:
+        ai_counter += 1
+
+    if human_or_ai(coref_current, references_current, separator_references) == "Human":
+        human_counter +=1
+    else:
+        ai_counter += 1
+
+    if human_or_ai(verbs_current, synsets_current, separator_synsets_verb) == "Human":
+        human_counter +=1
+    else:
+        ai_counter += 1
+
+    # Here, certainty is calculated based on the amount of classification 
+    # categories that assigned the same label to the text.
+    max_score = 3
+    guessed = max(human_counter, ai_counter)
+    certainty = guessed / max_score
+    if human_counter > ai_counter:
+        return ("Human", certainty)
+    elif human_counter == ai_counter:
+        return ("Unsure", certainty)
+    else:
+        return ("AI", certainty)
 
 
 def main():
@@ -0,0 +1,324 @@
+# Program name: sentiment.py
+# Date: 19/10
+# Contributors: Joris van Bruggen (s5723752), Mervyn Bolhuis (s5119103), Tieme Boerema (s5410762), Jasper Kleine (s5152372), Sem Bartels (s5374588)
+
+# A lexicon sentiment component that replaces spacytextblob. It uses the same pattern lexicon and the
+# same modifier, negation, exclamation and emoticon rules as TextBlob, but works on the token arrays of
+# the spacy doc: the lexicon is loaded once into arrays keyed by the hash of the lowercase word, the
+# properties of every token are looked up per word type, and only the tokens that can change the
+# result (known words, negations, exclamation marks and emoticons) are walked through one by one.
+# Use it with nlp.add_pipe('lexicon_sentiment'), it sets doc._.polarity and doc._.subjectivity.
+
+# import the supporting packages
+import numpy as np
+from functools import lru_cache
+from spacy.attrs import LOWER, SPACY # type: ignore
+from spacy.language import Language
+from spacy.strings import hash_string # type: ignore
+from spacy.tokens import Doc
+from typing import Dict, List, Tuple
+
+# the rules of the pattern analyzer of TextBlob, see textblob._text.Sentiment
+NEGATIONS: Tuple[str, ...] = ('no', 'not', "n't", 'never')
+MODIFIER_TAG: str = 'RB'
+MODIFIER_SUFFIX: str = 'ly'
+EXCLAMATION_BOOST: float = 1.25
+NEGATION_FACTOR: float = -0.5
+
+# the columns of the token properties, see get_type_properties
+LEXICON_COLUMN, NEGATION_COLUMN, MODIFIER_RESET_COLUMN, NEGATION_RESET_COLUMN, EXCLAMATION_COLUMN, EMOTICON_COLUMN, WORD_COLUMN, SPACE_COLUMN = range(8)
+NEUTRAL: Tuple[float, ...] = (-1.0, 0.0, 0.0, 0.0, 0.0, np.nan, 0.0, 0.0)
+PROPERTIES_KEY: str = 'pta_sentiment'
+
+
+@lru_cache(maxsize=None)
+def load_lexicon() -> Dict[str, np.ndarray]:
+    '''
+    Load the pattern lexicon of TextBlob into arrays, sorted by the hash of the word. TextBlob scores a
+    text without part of speech tags, so every word gets the scores averaged over its tags
+    return: Dict[str, np.ndarray], the hashes, polarity, subjectivity and intensity of the words, and
+            whether a word is a modifier (it has an adverb entry) and ends with -ly
+    '''
+    from textblob.en import sentiment as pattern_lexicon # type: ignore
+    from textblob._text import PUNCTUATION, EMOTICONS # type: ignore
+
+    words = sorted(((hash_string(word), word, scores) for word, scores in pattern_lexicon.items()), key=lambda entry: entry[0])
+    lexicon: Dict[str, np.ndarray] = {
+        'hashes': np.array([entry[0] for entry in words], dtype=np.uint64),
+        'polarity': np.array([entry[2][None][0] for entry in words], dtype=np.float64),
+        'subjectivity': np.array([entry[2][None][1] for entry in words], dtype=np.float64),
+        'intensity': np.array([entry[2][None][2] for entry in words], dtype=np.float64),
+        'modifier': np.array([MODIFIER_TAG in entry[2] for entry in words], dtype=bool),
+        'ly': np.array([entry[1].endswith(MODIFIER_SUFFIX) for entry in words], dtype=bool),
+    }
+
+    # the emoticons are not in the lexicon, they only have a polarity
+    emoticons: Dict[str, float] = {}
+    for (_, polarity), faces in EMOTICONS.items():
+        for face in faces:
+            emoticons.setdefault(face.lower(), polarity)
+    lexicon['emoticons'] = emoticons # type: ignore
+    lexicon['punctuation'] = PUNCTUATION # type: ignore
+    return lexicon
+
+
+@lru_cache(maxsize=1 << 16)
+def get_type_properties(word: str) -> Tuple[float, ...]:
+    '''
+    Get the sentiment properties of a lowercase word type, the way the tokenizer of TextBlob sees it:
+    punctuation marks are split from the start and end of a word and every apostrophe is split off
+    param word: str, the lowercase word
+    return: the index of the word in the lexicon (or -1), whether it is a negation, whether it ends
+            a preceding modifier or negation, the amount of exclamation marks, the emoticon polarity (or nan),
+            and whether it is a word or white space, see get_token_properties
+    '''
+    lexicon = load_lexicon()
+    punctuation: str = lexicon['punctuation'] # type: ignore
+    hashes = lexicon['hashes']
+
+    index = int(np.searchsorted(hashes, np.uint64(hash_string(word))))
+    if index < len(hashes) and hashes[index] == hash_string(word) and "'" not in word:
+        return (float(index), float(word in NEGATIONS), 0.0, 0.0, 0.0, np.nan, 1.0, 0.0)
+
+    # white space is no token for TextBlob
+    if word.isspace():
+        return (-1.0, 0.0, 0.0, 0.0, 0.0, np.nan, 0.0, 1.0)
+
+    # the punctuation marks around a word are split off, only an ellipsis stays a token of its own
+    core = word.lstrip(punctuation.replace('.', '')).rstrip(punctuation + '.')
+    ellipsis = float('...' in word)
+    emoticon = lexicon['emoticons'].get(word, np.nan) if not word.isalpha() and len(word) <= 5 and word not in punctuation else np.nan # type: ignore
+    if np.isnan(emoticon) and core != word:
+        if not core:
+            return (-1.0, 0.0, ellipsis, ellipsis, float(word.count('!')), np.nan, 0.0, 0.0)
+        properties = list(get_type_properties(core))
+        properties[MODIFIER_RESET_COLUMN] = max(properties[MODIFIER_RESET_COLUMN], ellipsis)
+        properties[NEGATION_RESET_COLUMN] = max(properties[NEGATION_RESET_COLUMN], ellipsis)
+        properties[EXCLAMATION_COLUMN] = float(word.count('!'))
+        properties[WORD_COLUMN] = float("'" not in word)
+        return tuple(properties)
+
+    # the negation n't never reaches the rules of TextBlob, its tokenizer splits it into n ' t
+    pieces = word.split("'")
+    return (-1.0,
+            float(word in NEGATIONS and len(pieces) == 1),
+            float(any(len(piece) > 2 for piece in pieces)),
+            float(any(len(piece) > 1 for piece in pieces)),
+            0.0,
+            emoticon,
+            float(len(pieces) == 1),
+            0.0)
+
+
+# the most word types a type table holds, 2 MB per 32768 types
+MAX_TYPES: int = 1 << 18
+
+
+class TypeTable:
+    '''
+    The properties of the word types seen so far, as rows of one array, so a doc only looks up its new types.
+    Every lexicon_sentiment component has its own table, and a full table is emptied, so the memory stays
+    bounded on an open-ended stream of texts
+    param max_types: int, the most word types the table holds
+    '''
+
+    def __init__(self, max_types: int = MAX_TYPES) -> None:
+        self.max_types = max_types
+        self.rows: Dict[int, int] = {}
+        self.table: np.ndarray = np.empty((0, len(NEUTRAL)), dtype=np.float64)
+
+    def get_properties(self, types: np.ndarray, strings) -> np.ndarray:
+        '''
+        Get the properties of word types, the types that are not in the table yet are added
+        param types: np.ndarray, the unique hashes of the lowercase words
+        param strings: StringStore, the strings of the vocab the hashes come from
+        return: np.ndarray, one row per type, see get_type_properties for the columns
+        '''
+        hashes: List[int] = types.tolist()
+        missing = [word for word in hashes if word not in self.rows]
+        if missing:
+            # start over when the new types do not fit, the types of the next docs are added again
+            if len(self.rows) + len(missing) > self.max_types:
+                self.rows = {}
+                missing = hashes
+            first = len(self.rows)
+            for word in missing:
+                self.rows[word] = len(self.rows)
+
+            # the table doubles when it is full, up to the bound, so adding types costs amortized constant time
+            if len(self.rows) > len(self.table):
+                size = max(min(2 * len(self.table), self.max_types), len(self.rows), 1024)
+                grown = np.empty((size, len(NEUTRAL)), dtype=np.float64)
+                grown[:first] = self.table[:first]
+                self.table = grown
+            self.table[first:len(self.rows)] = [get_type_properties(strings[word]) for word in missing]
+        return self.table[np.fromiter(map(self.rows.__getitem__, hashes), dtype=np.int64, count=len(hashes))]
+
+
+# the table of the docs that are not scored by a lexicon_sentiment component
+default_table = TypeTable()
+
+
+def get_token_properties(doc: Doc, table: TypeTable | None = None) -> np.ndarray:
+    '''
+    Get the sentiment properties of every token of a doc, cached in doc.user_data
+    param doc: Doc, the doc to get the properties of
+    param table: TypeTable, the table to look up the word types in, by default one shared table
+    return: np.ndarray, one row per token, see get_type_properties for the columns
+    '''
+    if PROPERTIES_KEY in doc.user_data:
+        return doc.user_data[PROPERTIES_KEY]
+
+    array = doc.to_array([LOWER, SPACY])
+    types, type_of = np.unique(array[:, 0], return_inverse=True)
+    properties = (table or default_table).get_properties(types, doc.vocab.strings)[type_of.ravel()]
+
+    # TextBlob only splits the punctuation marks and apostrophes from the text between two spaces, so when
+    # spacy splits that text into more words, like well-known, 90% or them—super, they are one word for TextBlob
+    if len(properties) > 1:
+        is_space = properties[:, SPACE_COLUMN] > 0
+        chunk_start = np.concatenate(([True], (array[:-1, 1] == 1) | is_space[:-1] | is_space[1:]))
+        chunk_of = np.cumsum(chunk_start) - 1
+        words_per_chunk = np.bincount(chunk_of, weights=properties[:, WORD_COLUMN])
+        word_tokens = np.flatnonzero(properties[:, WORD_COLUMN] > 0)
+        word_tokens = word_tokens[words_per_chunk[chunk_of[word_tokens]] > 1]
+        if len(word_tokens):
+            word_chunks = chunk_of[word_tokens]
+            firsts = np.flatnonzero(np.concatenate(([True], word_chunks[1:] != word_chunks[:-1])))
+            lasts = np.append(firsts[1:], len(word_tokens)) - 1
+            for first, last in zip(word_tokens[firsts].tolist(), (word_tokens[lasts] + 1).tolist()):
+                properties[first:last] = NEUTRAL
+                properties[first] = get_type_properties(doc[first:last].text.lower())
+
+    doc.user_data[PROPERTIES_KEY] = properties
+    return properties
+
+
+def get_assessments(properties: np.ndarray, start: int = 0, end: int | None = None) -> Tuple[List[float], List[float]]:
+    '''
+    Assess the sentiment of a range of tokens like TextBlob does: a known word gets its own assessment,
+    or changes the assessment of a preceding modifier ("very good"), a preceding negation flips it
+    ("not good"), an exclamation mark boosts the last assessment and an emoticon gets its own assessment
+    param properties: np.ndarray, the token properties from get_token_properties
+    param start: int, the first token of the range
+    param end: int, the token after the range, by default the end of the doc
+    return: Tuple[List[float], List[float]], the polarity and subjectivity of every assessment
+    '''
+    lexicon = load_lexicon()
+    properties = properties[start:end]
+
+    # only these tokens change the assessments, the others can only end a modifier or a negation
+    is_event = ((properties[:, LEXICON_COLUMN] >= 0) | (properties[:, NEGATION_COLUMN] > 0)
+                | (properties[:, EXCLAMATION_COLUMN] > 0) | ~np.isnan(properties[:, EMOTICON_COLUMN]))
+    events = np.flatnonzero(is_event)
+    modifier_resets = np.concatenate(([0], np.cumsum(properties[:, MODIFIER_RESET_COLUMN] * ~is_event)))
+    negation_resets = np.concatenate(([0], np.cumsum(properties[:, NEGATION_RESET_COLUMN] * ~is_event)))
+
+    polarity: List[float] = []
+    subjectivity: List[float] = []
+    intensity: List[float] = []
+    negated: List[bool] = []
+    modifier: int | None = None # the lexicon index of the preceding modifier
+    negation: bool = False
+    previous: int = 0
+    for token in events:
+        if modifier is not None and modifier_resets[token] > modifier_resets[previous]:
+            modifier = None
+        if negation and negation_resets[token] > negation_resets[previous]:
+            negation = False
+        previous = token + 1
+        index, is_negation, modifier_reset, negation_reset, exclamations, emoticon = properties[token, :WORD_COLUMN]
+
+        if index >= 0:
+            index = int(index)
+            p, s, i = lexicon['polarity'][index], lexicon['subjectivity'][index], lexicon['intensity'][index]
+            if modifier is None:
+                polarity.append(p)
+                subjectivity.append(s)
+                intensity.append(i)
+                negated.append(False)
+            else:
+                polarity[-1] = max(-1.0, min(p * intensity[-1], 1.0))
+                subjectivity[-1] = max(-1.0, min(s * intensity[-1], 1.0))
+                intensity[-1] = i
+            if negation:
+                intensity[-1] = 1.0 / intensity[-1]
+                negated[-1] = True
+            modifier = index if lexicon['modifier'][index] else None
+            negation = bool(is_negation)
+            continue
+
+        if is_negation:
+            negation = True
+        elif negation and negation_reset:
+            negation = False
+        if negation and modifier is not None and lexicon['ly'][modifier]:
+            negated[-1] = True
+            negation = False
+        elif modifier is not None and modifier_reset:
+            modifier = None
+        for _ in range(int(exclamations)):
+            if polarity:
+                polarity[-1] = max(-1.0, min(polarity[-1] * EXCLAMATION_BOOST, 1.0))
+        if not np.isnan(emoticon):
+            polarity.append(emoticon)
+            subjectivity.append(1.0)
+            intensity.append(1.0)
+            negated.append(False)
+
+    # "not good" is slightly bad, "not bad" is slightly good
+    polarity = [p * NEGATION_FACTOR if is_negated else p for p, is_negated in zip(polarity, negated)]
+    return polarity, subjectivity
+
+
+def get_sentiment_scores(doc: Doc, start: int = 0, end: int | None = None, table: TypeTable | None = None) -> Tuple[float, float]:
+    '''
+    Get the polarity and subjectivity of a doc, or a range of its tokens, the averages of the assessments
+    param doc: Doc, the doc to score
+    param start: int, the first token of the range
+    param end: int, the token after the range, by default the end of the doc
+    param table: TypeTable, the table to look up the word types in, by default one shared table
+    '''
+    polarity, subjectivity = get_assessments(get_token_properties(doc, table), start, end)
+    if not polarity:
+        return 0.0, 0.0
+    return sum(polarity) / len(polarity), sum(subjectivity) / len(subjectivity)
+
+
+def get_sentence_assessments(doc: Doc) -> np.ndarray:
+    '''
+    Get the summed polarity, summed subjectivity and amount of assessments of every sentence of a doc,
+    every sentence is assessed on its own, like TextBlob does with the text of a span
+    param doc: Doc, the doc to assess
+    return: np.ndarray, one row (polarity, subjectivity, assessments) per sentence
+    '''
+    properties = get_token_properties(doc)
+    sentiment = []
+    for sentence in doc.sents:
+        polarity, subjectivity = get_assessments(properties, sentence.start, sentence.end)
+        sentiment.append((sum(polarity), sum(subjectivity), len(polarity)))
+    return np.array(sentiment, dtype=np.float64).reshape(-1, 3)
+
+
+class LexiconSentiment:
+    '''
+    The spacy component that sets doc._.polarity and doc._.subjectivity
+    '''
+
+    def __init__(self, nlp: Language, name: str):
+        for extension in ('polarity', 'subjectivity'):
+            if not Doc.has_extension(extension):
+                Doc.set_extension(extension, default=None)
+
+        # load the lexicon now, not with the first doc
+        load_lexicon()
+        self.table = TypeTable()
+
+    def __call__(self, doc: Doc) -> Doc:
+        doc._.polarity, doc._.subjectivity = get_sentiment_scores(doc, table=self.table)
+        return doc
+
+
+@Language.factory('lexicon_sentiment')
+def create_lexicon_sentiment(nlp: Language, name: str) -> LexiconSentiment:
+    return LexiconSentiment(nlp, name)
@@ -7,12 +7,11 @@
 
 # import preprocessor
 from preprocessor import get_and_parse_texts, Path, parse_prompt_data
+from features import get_doc_array, count_values, TAG_COLUMN
 
 # import other necessary packages
-from sklearn.metrics import classification_report, confusion_matrix
 from typing import List, Tuple
 from spacy.tokens import Doc
-from collections import Counter
 
 
 def get_ratio_dict(data: list) -> dict:
@@ -29,18 +28,15 @@ def get_ratio_dict(data: list) -> dict:
     # loop for every doc in the data, which corresponds to: for every text line in the json file
     for doc in data:
 
-        pos_tags = []
-
-        # create a Counter dictionary of the frequency per tag
-        for token in doc:
-            pos_tags.append(token.tag_)
-        tag_counter_dict = Counter(pos_tags)
+        # create a dictionary of the frequency per tag from the tag column of the doc
+        tag_counter_dict = count_values(doc, TAG_COLUMN)
+        token_amount = len(get_doc_array(doc))
 
         # calculate ratio and add tag and ratio to tag_dict
         for key, value in tag_counter_dict.items():
 
             # calculate ratio as amount of occurences of tag divided by amount of tokens in text
-            ratio = value / len(pos_tags)
+            ratio = value / token_amount
 
             # for single text and not entire files
             if key not in tag_dict.keys():
@@ -101,7 +97,7 @@ def calculate_measure_ratios(human_average_ratio : dict, machine_average_ratio:
     return measure_ratios_dict
 
 
-def human_machine_decider(measure_ratios: dict, human_average_ratios: dict, machine_average_ratios: dict, unknown_average_ratios: dict) -> tuple[str, float]:
+def human_machine_decider(measure_ratios: dict, human_average_ratios: dict, machine_average_ratios: dict, unknown_average_ratios: dict) -> str:
     '''
     Function that takes the human/machine/measure ratios plus the unknown text's ratios and decides if the text is written by human or ai
     param measure_ratios: dict with tags and the 'golden standard' ratios to test the new data on
@@ -198,15 +194,15 @@ def write_syntactic_results(ratios: Tuple[dict, dict, dict], prompts: List[dict[
         print(f'text{id:0>3}: predicted: {answer:10} actual: {text["by"]}')
 
 
-def get_syntactic_results(ratios: Tuple[dict, dict, dict], prompts: List[dict[str, str | Doc]]) -> list[tuple[str, float]]:
+def get_syntactic_results(ratios: Tuple[dict, dict, dict], prompts: List[dict[str, str | Doc]]) -> list[str]:
     """
     Gets the results of the syntactic analysis.
     :param ratios: Tuple containing the measure ratios, human average ratios and machine average ratios.
     :param prompts: List of dictionaries containing the text and the author.
-    :return: List of tuples containing the predicted author.
+    :return: List containing the predicted author.
     """
     measure_ratios, human_average_ratios, machine_average_ratios = ratios
-    answers: list[tuple[str, float]] = []
+    answers: list[str] = []
 
     for text in prompts:
         unknown_ratios = get_ratio_dict([text['text']])
@@ -218,6 +214,7 @@ def get_syntactic_results(ratios: Tuple[dict, dict, dict], prompts: List[dict[st
 
 
 def main():
+    from sklearn.metrics import classification_report, confusion_matrix
 
     # get data
     human_text, machine_text = get_and_parse_texts(Path('human.jsonl'), Path('group1.jsonl'))